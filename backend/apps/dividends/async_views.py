@@ -0,0 +1,161 @@
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound, ValidationError
+from apps.equities.models import Equity
+from apps.equities.mongo import to_mongo
+from apps.equities.motor_client import get_async_collection, allocate_ids_async
+from apps.equities.native import to_representation, get_projection
+from apps.equities.cache import invalidate_dividends, forget_label
+from apps.equities.async_http import run_in_thread, viewset_namespaces
+from apps.equities.async_views import to_pk, get_defaults
+from apps.equities.views import EquityDividendsViewSet
+from .models import Dividend
+from .dividendstore import calendar_pipeline, to_calendar_entry
+from .views import (
+    DividendListSerializer, DividendFilterSerializer, DividendCalendarSerializer,
+    DividendsViewSet, build_dividends_pipeline, with_equity_label
+)
+
+# async versions of the DividendsViewSet and EquityDividendsViewSet CRUD
+# endpoints (see apps/equities/async_http.py)
+#
+#   GET/POST /dividends/
+#   GET /dividends/calendar/
+#   GET/PUT/PATCH/DELETE /dividends/:id/
+#   GET/POST /equities/:equity_id/dividends/
+#   GET/PUT/PATCH/DELETE /equities/:equity_id/dividends/:id/
+
+
+# same fields as the DividendSerializer, the unique label is checked with
+# Motor by check_unique_label instead of the UniqueValidator (a blocking ORM
+# query)
+class DividendWriteSerializer(serializers.Serializer):
+    label = serializers.CharField(max_length=20)
+    date_time = serializers.DateTimeField(required=False)
+    dividends = DividendListSerializer(many=True)
+
+
+def validate_dividend(data, partial=False):
+    serializer = DividendWriteSerializer(data=data, partial=partial)
+    serializer.is_valid(raise_exception=True)
+    dividend = dict(serializer.validated_data)
+    if 'dividends' in dividend:
+        dividend['dividends'] = sorted((dict(entry) for entry in dividend['dividends']), key=lambda entry: entry['ex_div_date'])
+    return dividend
+
+
+def duplicate_label_error():
+    return ValidationError({'label': ['dividend with this label already exists.']})
+
+
+async def check_unique_label(label, pk=None):
+    # the UniqueValidator of the DividendSerializer, the unique index still
+    # rejects the concurrent writes of the same label
+    query = {'label': label} if pk is None else {'label': label, 'id': {'$ne': to_pk(pk)}}
+    if await get_async_collection(Dividend).find_one(query, {'_id': 1}) is not None:
+        raise duplicate_label_error()
+
+
+async def find_equity_label(equity_pk):
+    equity = await get_async_collection(Equity).find_one({'id': to_pk(equity_pk)}, {'label': 1})
+    if equity is None:
+        raise NotFound()
+    return equity['label']
+
+
+async def list_dividends(request, equity_pk=None):
+    if equity_pk is not None:
+        # the dividends of the label of the equity
+        label = await find_equity_label(equity_pk)
+        documents = get_async_collection(Dividend).find({'label': label}, get_projection(Dividend))
+    else:
+        serializer = DividendFilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        pipeline = build_dividends_pipeline(serializer.validated_data, DividendsViewSet.ordering)
+        documents = get_async_collection(Dividend).aggregate(pipeline)
+    return [to_representation(Dividend, document) async for document in documents]
+
+
+async def dividend_calendar(request):
+    serializer = DividendCalendarSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    params = serializer.validated_data
+    documents = get_async_collection(Dividend).aggregate(calendar_pipeline(params['start'], params['end'], params.get('labels')))
+    return [to_calendar_entry(document) async for document in documents]
+
+
+async def retrieve_dividend(request, pk, equity_pk=None):
+    document = await get_async_collection(Dividend).find_one({'id': to_pk(pk)}, get_projection(Dividend))
+    if document is None:
+        raise NotFound()
+    return to_representation(Dividend, document)
+
+
+async def create_dividend(request, equity_pk=None):
+    data = request.data
+    if equity_pk is not None:
+        data = with_equity_label(data, await find_equity_label(equity_pk))
+    document = get_defaults(Dividend, validate_dividend(data))
+    await check_unique_label(document['label'])
+    document['id'] = await allocate_ids_async(Dividend, 1)
+    try:
+        await get_async_collection(Dividend).insert_one(to_mongo(document))
+    except DuplicateKeyError:
+        raise duplicate_label_error()
+    await run_in_thread(invalidate_dividends, [document['label']])
+    return to_representation(Dividend, document), 201
+
+
+async def update_dividend(request, pk, equity_pk=None, partial=False):
+    values = to_mongo(validate_dividend(request.data, partial))
+    if 'label' in values:
+        await check_unique_label(values['label'], pk)
+    try:
+        before = await get_async_collection(Dividend).find_one_and_update(
+            {'id': to_pk(pk)}, {'$set': values}, projection=get_projection(Dividend),
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        raise duplicate_label_error()
+    if before is None:
+        raise NotFound()
+    document = dict(before, **values)
+    if before['label'] != document['label']:
+        await run_in_thread(forget_label, Dividend, pk)
+    await run_in_thread(invalidate_dividends, [before['label'], document['label']])
+    return to_representation(Dividend, document)
+
+
+async def partial_update_dividend(request, pk, equity_pk=None):
+    return await update_dividend(request, pk, equity_pk, partial=True)
+
+
+async def destroy_dividend(request, pk, equity_pk=None):
+    document = await get_async_collection(Dividend).find_one_and_delete({'id': to_pk(pk)}, projection={'label': 1})
+    if document is None:
+        raise NotFound()
+    await run_in_thread(invalidate_dividends, [document['label']])
+    return None, 204
+
+
+ROUTES = [
+    (r'^/dividends/$', {'GET': list_dividends, 'POST': create_dividend}, viewset_namespaces(DividendsViewSet)),
+    (r'^/dividends/calendar/$', {'GET': dividend_calendar}, viewset_namespaces(DividendsViewSet)),
+    (r'^/dividends/(?P<pk>\d+)/$', {
+        'GET': retrieve_dividend,
+        'PUT': update_dividend,
+        'PATCH': partial_update_dividend,
+        'DELETE': destroy_dividend
+    }, viewset_namespaces(DividendsViewSet)),
+    (r'^/equities/(?P<equity_pk>\d+)/dividends/$', {
+        'GET': list_dividends,
+        'POST': create_dividend
+    }, viewset_namespaces(EquityDividendsViewSet)),
+    (r'^/equities/(?P<equity_pk>\d+)/dividends/(?P<pk>\d+)/$', {
+        'GET': retrieve_dividend,
+        'PUT': update_dividend,
+        'PATCH': partial_update_dividend,
+        'DELETE': destroy_dividend
+    }, viewset_namespaces(EquityDividendsViewSet))
+]
@@ -0,0 +1,175 @@
+from django.utils import timezone
+from bson.son import SON
+from pymongo import UpdateOne
+from datetime import datetime, time
+from apps.equities.mongo import get_collection, allocate_ids, to_mongo
+
+# the dividends of a label are stored in a single document, with the entries
+# sorted by ex_div_date:
+# {
+#     "label": "MSFT",
+#     "date_time": "2021-08-25T18:14:44.249663Z",
+#     "dividends": [
+#         {"ex_div_date": "2021-05-19", "dividend": 0.56},
+#         {"ex_div_date": "2021-08-18", "dividend": 0.56}
+#     ]
+# }
+# the whole history of a label is written with one request and the
+# ex_div_date range queries (of a label or across all the labels) are
+# served by the multikey index on dividends.ex_div_date
+
+# sort keys of the ordering query parameter
+ORDERING_KEYS = {'id': 'id', 'label': 'label', 'date_time': 'date_time'}
+
+
+def to_mongo_date(value):
+    return datetime.combine(value, time())
+
+
+def ex_div_date_range(start=None, end=None):
+    # MongoDB condition of start <= ex_div_date <= end (both optional)
+    condition = {}
+    if start is not None:
+        condition['$gte'] = to_mongo_date(start)
+    if end is not None:
+        condition['$lte'] = to_mongo_date(end)
+    return condition
+
+
+def upsert_dividends(model, entries, using='default'):
+    # entries is a list of {label, dividends, date_time (optional)}. The
+    # entries are merged by ex_div_date into the document of the label
+    # (created if missing): the ex_div_dates sent replace the stored ones,
+    # the others are kept. Two ordered updates for each label, $pull then
+    # $push/$sort, since a single update cannot do both on the same array
+    merged = {}
+    for entry in entries:
+        label_dividends = merged.setdefault(entry['label'], {'dividends': {}, 'date_time': None})
+        for dividend in entry.get('dividends', []):
+            label_dividends['dividends'][dividend['ex_div_date']] = dividend
+        label_dividends['date_time'] = entry.get('date_time') or label_dividends['date_time']
+
+    if len(merged) == 0:
+        return {'labels': 0, 'upserted': 0, 'dividends': 0}
+
+    # ids are only reserved for the labels without a document
+    collection = get_collection(model, using)
+    existing = set(document['label'] for document in collection.find({'label': {'$in': list(merged)}}, {'label': 1}))
+    next_id = allocate_ids(model, len(merged) - len(existing), using) if len(existing) != len(merged) else None
+    operations = []
+    with_id = set()
+    count = 0
+    for label, label_dividends in merged.items():
+        dividends = to_mongo(list(label_dividends['dividends'].values()))
+        count += len(dividends)
+        update = {
+            '$pull': {'dividends': {'ex_div_date': {'$in': [d['ex_div_date'] for d in dividends]}}},
+            '$set': {'date_time': label_dividends['date_time'] or timezone.now()}
+        }
+        if label not in existing:
+            update['$setOnInsert'] = {'id': next_id}
+            with_id.add(len(operations))
+            next_id += 1
+        operations.append(UpdateOne({'label': label}, update, upsert=True))
+        operations.append(UpdateOne(
+            {'label': label},
+            {'$push': {'dividends': {'$each': dividends, '$sort': {'ex_div_date': 1}}}}
+        ))
+
+    result = collection.bulk_write(operations, ordered=True)
+    # the documents deleted since the find are inserted without id
+    without_id = [_id for index, _id in result.upserted_ids.items() if index not in with_id]
+    if len(without_id) != 0:
+        next_id = allocate_ids(model, len(without_id), using)
+        for i, _id in enumerate(without_id):
+            collection.update_one({'_id': _id}, {'$set': {'id': next_id + i}})
+    return {'labels': len(merged), 'upserted': result.upserted_count, 'dividends': count}
+
+
+def dividends_pipeline(label=None, start=None, end=None, sort=None):
+    # documents (of a label) with the entries between start and end,
+    # the documents without entries in the window are not returned
+    query = {}
+    if label is not None:
+        query['label'] = label
+    pipeline = []
+    condition = ex_div_date_range(start, end)
+    if len(condition) != 0:
+        query['dividends'] = {'$elemMatch': {'ex_div_date': condition}}
+    pipeline.append({'$match': query})
+    if len(condition) != 0:
+        bounds = [{operator: ['$$dividend.ex_div_date', value]} for operator, value in condition.items()]
+        pipeline.append({'$addFields': {'dividends': {'$filter': {
+            'input': '$dividends',
+            'as': 'dividend',
+            'cond': {'$and': bounds}
+        }}}})
+    pipeline.append({'$project': {'_id': 0}})
+    pipeline.append({'$sort': SON(sort or [('label', 1)])})
+    return pipeline
+
+
+def calendar_pipeline(start, end, labels=None):
+    # one entry per dividend between start and end across all the labels
+    # (or the labels given), sorted by ex_div_date. Only the documents with
+    # entries in the window are read, using the dividends.ex_div_date index
+    condition = ex_div_date_range(start, end)
+    query = {'dividends': {'$elemMatch': {'ex_div_date': condition}}}
+    if labels is not None:
+        query['label'] = {'$in': list(labels)}
+    return [
+        {'$match': query},
+        {'$unwind': '$dividends'},
+        {'$match': {'dividends.ex_div_date': condition}},
+        {'$sort': SON([('dividends.ex_div_date', 1), ('label', 1)])},
+        {'$project': {
+            '_id': 0,
+            'label': 1,
+            'ex_div_date': '$dividends.ex_div_date',
+            'dividend': '$dividends.dividend'
+        }}
+    ]
+
+
+def to_calendar_entry(document):
+    return {
+        'label': document['label'],
+        'ex_div_date': document['ex_div_date'].date().isoformat(),
+        'dividend': document['dividend']
+    }
+
+
+def get_sort(ordering, default='label'):
+    # same as the OrderingFilter: the unknown fields are ignored
+    sort = []
+    for field in (ordering or default).split(','):
+        field = field.strip()
+        if field.lstrip('-') in ORDERING_KEYS:
+            sort.append((ORDERING_KEYS[field.lstrip('-')], -1 if field.startswith('-') else 1))
+    return sort or [(default, 1)]
+
+
+def export_pipeline(labels=None, start=None, end=None):
+    # one entry per dividend of the labels (all the labels when None) between
+    # start and end, sorted by label (label index) then ex_div_date (the
+    # entries are stored sorted), without sorting the unwound entries
+    condition = ex_div_date_range(start, end)
+    query = {}
+    if labels is not None:
+        query['label'] = {'$in': list(labels)}
+    if len(condition) != 0:
+        query['dividends'] = {'$elemMatch': {'ex_div_date': condition}}
+    pipeline = [
+        {'$match': query},
+        {'$sort': SON([('label', 1)])},
+        {'$unwind': '$dividends'}
+    ]
+    if len(condition) != 0:
+        pipeline.append({'$match': {'dividends.ex_div_date': condition}})
+    pipeline.append({'$project': {
+        '_id': 0,
+        'label': 1,
+        'ex_div_date': '$dividends.ex_div_date',
+        'dividend': '$dividends.dividend'
+    }})
+    return pipeline
@@ -0,0 +1,69 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+# same as equities 0004_indexes, the indexes are created with pymongo
+# (frozen helpers) the foreign key is stored as equity_id in the documents
+
+DIVIDEND_INDEXES = [
+    ('dividend_equity_year_idx', [('equity_id', 1), ('year', 1)], {}),
+    ('dividend_year_idx', [('year', 1)], {}),
+]
+
+
+def get_database(schema_editor):
+    # the djongo connection is the pymongo Database object
+    schema_editor.connection.ensure_connection()
+    return schema_editor.connection.connection
+
+
+def create_indexes(collection, indexes):
+    # indexes is a list of (name, keys, options) with pymongo keys,
+    # create_index does nothing if the same index already exists
+    for name, keys, options in indexes:
+        collection.create_index(keys, name=name, **options)
+
+
+def drop_indexes(collection, names):
+    existing = collection.index_information()
+    for name in names:
+        if name in existing:
+            collection.drop_index(name)
+
+
+def forwards(apps, schema_editor):
+    Dividend = apps.get_model('dividends', 'Dividend')
+    create_indexes(get_database(schema_editor)[Dividend._meta.db_table], DIVIDEND_INDEXES)
+
+
+def backwards(apps, schema_editor):
+    Dividend = apps.get_model('dividends', 'Dividend')
+    drop_indexes(
+        get_database(schema_editor)[Dividend._meta.db_table],
+        [name for name, keys, options in DIVIDEND_INDEXES]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dividends', '0002_auto_20210825_1725'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(forwards, backwards),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='dividend',
+                    index=models.Index(fields=['equity', 'year'], name='dividend_equity_year_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='dividend',
+                    index=models.Index(fields=['year'], name='dividend_year_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,172 @@
+# Generated by Django 3.0.5 on 2026-10-18 15:40
+
+from django.db import migrations, models
+from pymongo import ReturnDocument
+
+# one Dividend document per label instead of one per equity/year: the
+# entries of all the years of a label are merged (sorted by ex_div_date) and
+# the equity foreign key is replaced by the label of the equity. The
+# dividends of equities which do not exist anymore cannot be given a label
+# and are dropped (RunPython has no stdout to report them). The indexes are
+# created with pymongo as in 0003_indexes, with the same frozen helpers
+
+OLD_INDEXES = [
+    ('dividend_equity_year_idx', [('equity_id', 1), ('year', 1)], {}),
+    ('dividend_year_idx', [('year', 1)], {}),
+]
+
+NEW_INDEXES = [
+    ('dividend_label_uniq', [('label', 1)], {'unique': True}),
+    ('dividend_ex_div_date_idx', [('dividends.ex_div_date', 1)], {}),
+]
+
+
+def get_database(schema_editor):
+    # the djongo connection is the pymongo Database object
+    schema_editor.connection.ensure_connection()
+    return schema_editor.connection.connection
+
+
+def allocate_ids(database, collection_name, count):
+    # ids reserved from the djongo AutoField sequence of the collection
+    if count == 0:
+        return None
+    schema = database['__schema__'].find_one_and_update(
+        {'name': collection_name, 'auto': {'$exists': True}},
+        {'$inc': {'auto.seq': count}},
+        return_document=ReturnDocument.AFTER
+    )
+    return schema['auto']['seq'] - count + 1
+
+
+def create_indexes(collection, indexes):
+    # indexes is a list of (name, keys, options) with pymongo keys,
+    # create_index does nothing if the same index already exists
+    for name, keys, options in indexes:
+        collection.create_index(keys, name=name, **options)
+
+
+def drop_indexes(collection, names):
+    existing = collection.index_information()
+    for name in names:
+        if name in existing:
+            collection.drop_index(name)
+
+
+def merge_by_label(apps, schema_editor):
+    Dividend = apps.get_model('dividends', 'Dividend')
+    Equity = apps.get_model('equities', 'Equity')
+    database = get_database(schema_editor)
+    dividends = database[Dividend._meta.db_table]
+
+    drop_indexes(dividends, [name for name, keys, options in OLD_INDEXES])
+    documents = list(dividends.find({'label': {'$exists': False}}))
+    equity_ids = list(set(document['equity_id'] for document in documents))
+    labels = {
+        equity['id']: equity['label']
+        for equity in database[Equity._meta.db_table].find({'id': {'$in': equity_ids}}, {'id': 1, 'label': 1})
+    }
+
+    merged = {}
+    for document in documents:
+        label = labels.get(document['equity_id'])
+        if label is None:
+            continue
+        entry = merged.setdefault(label, {'date_time': document['date_time'], 'dividends': {}})
+        entry['date_time'] = max(entry['date_time'], document['date_time'])
+        for dividend in document.get('dividends', []):
+            entry['dividends'][dividend['ex_div_date']] = {
+                'ex_div_date': dividend['ex_div_date'],
+                'dividend': dividend['dividend']
+            }
+
+    next_id = allocate_ids(database, Dividend._meta.db_table, len(merged))
+    new_documents = []
+    for label, entry in merged.items():
+        new_documents.append({
+            'id': next_id,
+            'label': label,
+            'date_time': entry['date_time'],
+            'dividends': [entry['dividends'][ex_div_date] for ex_div_date in sorted(entry['dividends'])]
+        })
+        next_id += 1
+
+    dividends.delete_many({'_id': {'$in': [document['_id'] for document in documents]}})
+    if len(new_documents) != 0:
+        dividends.insert_many(new_documents)
+    create_indexes(dividends, NEW_INDEXES)
+
+
+def split_by_year(apps, schema_editor):
+    # one document per year pointing to the most recent Equity of the label
+    Dividend = apps.get_model('dividends', 'Dividend')
+    Equity = apps.get_model('equities', 'Equity')
+    database = get_database(schema_editor)
+    dividends = database[Dividend._meta.db_table]
+    equities = database[Equity._meta.db_table]
+
+    drop_indexes(dividends, [name for name, keys, options in NEW_INDEXES])
+    documents = list(dividends.find({'label': {'$exists': True}}))
+    new_documents = []
+    for document in documents:
+        equity = equities.find_one({'label': document['label']}, {'id': 1}, sort=[('md_date', -1)])
+        if equity is None:
+            continue
+        years = {}
+        for dividend in document.get('dividends', []):
+            years.setdefault(str(dividend['ex_div_date'].year), []).append(dividend)
+        for year, year_dividends in sorted(years.items()):
+            new_documents.append({
+                'year': year,
+                'date_time': document['date_time'],
+                'equity_id': equity['id'],
+                'dividends': year_dividends
+            })
+
+    next_id = allocate_ids(database, Dividend._meta.db_table, len(new_documents))
+    for i, document in enumerate(new_documents):
+        document['id'] = next_id + i
+    dividends.delete_many({'_id': {'$in': [document['_id'] for document in documents]}})
+    if len(new_documents) != 0:
+        dividends.insert_many(new_documents)
+    create_indexes(dividends, OLD_INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dividends', '0003_indexes'),
+        ('equities', '0005_security_reference'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(merge_by_label, split_by_year),
+            ],
+            state_operations=[
+                migrations.RemoveIndex(
+                    model_name='dividend',
+                    name='dividend_equity_year_idx',
+                ),
+                migrations.RemoveIndex(
+                    model_name='dividend',
+                    name='dividend_year_idx',
+                ),
+                migrations.RemoveField(
+                    model_name='dividend',
+                    name='equity',
+                ),
+                migrations.RemoveField(
+                    model_name='dividend',
+                    name='year',
+                ),
+                migrations.AddField(
+                    model_name='dividend',
+                    name='label',
+                    field=models.CharField(default='', max_length=20, unique=True),
+                    preserve_default=False,
+                ),
+            ],
+        ),
+    ]
@@ -2,7 +2,6 @@ from django.db import models
 from django import forms
 from django.utils import timezone
 from djongo import models as djongo_models
-from apps.equities.models import Equity
 from datetime import date, datetime
 
 # Create your models here.
@@ -33,14 +32,13 @@ class DividendListForm(forms.ModelForm):
             'dividend'
         )
 
+# one document per label with its whole dividend history, the entries are
+# kept sorted by ex_div_date. Besides the unique label index, the migrations
+# create a multikey index on dividends.ex_div_date (an embedded field, which
+# cannot be declared in the Meta) for the ex_div_date range queries across labels
 class Dividend(models.Model):
-    year = models.CharField(max_length=4)
+    label = models.CharField(max_length=20, unique=True)
     date_time = models.DateTimeField(default=timezone.now())
-    
-    equity = models.ForeignKey(
-        Equity,
-        on_delete = models.CASCADE
-    )
 
     dividends = djongo_models.ArrayField(
         model_container=DividendList,
@@ -50,4 +48,4 @@ class Dividend(models.Model):
     #objects = djongo_models.DjongoManager()
 
     def __str__(self):
-        return self.equity
+        return self.label
@@ -1,3 +1,66 @@
+from datetime import date, datetime
 from django.test import TestCase
+from apps.equities.mongo import get_collection, get_database
+from .models import Dividend
+from .dividendstore import upsert_dividends
 
-# Create your tests here.
+# upsert_dividends writes with pymongo, the tests need the MongoDB server of
+# the DATABASES settings (python manage.py test apps)
+
+
+def get_sequence():
+    # last id reserved from the djongo sequence of the collection
+    return get_database()['__schema__'].find_one({'name': Dividend._meta.db_table})['auto']['seq']
+
+
+class UpsertDividendsTests(TestCase):
+    def setUp(self):
+        # the documents written with pymongo are not rolled back
+        get_collection(Dividend).delete_many({})
+
+    def get_document(self, label):
+        return get_collection(Dividend).find_one({'label': label})
+
+    def test_new_label_is_inserted_with_sorted_entries(self):
+        result = upsert_dividends(Dividend, [{'label': 'MSFT', 'dividends': [
+            {'ex_div_date': date(2021, 8, 18), 'dividend': 0.56},
+            {'ex_div_date': date(2021, 5, 19), 'dividend': 0.56}
+        ]}])
+        self.assertEqual(result, {'labels': 1, 'upserted': 1, 'dividends': 2})
+        document = self.get_document('MSFT')
+        self.assertEqual(document['id'], get_sequence())
+        self.assertEqual([entry['ex_div_date'] for entry in document['dividends']], [
+            datetime(2021, 5, 19), datetime(2021, 8, 18)
+        ])
+
+    def test_entries_are_merged_by_ex_div_date(self):
+        upsert_dividends(Dividend, [{'label': 'MSFT', 'dividends': [
+            {'ex_div_date': date(2021, 5, 19), 'dividend': 0.56},
+            {'ex_div_date': date(2021, 8, 18), 'dividend': 0.5}
+        ]}])
+        result = upsert_dividends(Dividend, [
+            {'label': 'MSFT', 'dividends': [{'ex_div_date': date(2021, 8, 18), 'dividend': 0.56}]},
+            {'label': 'MSFT', 'dividends': [{'ex_div_date': date(2021, 11, 17), 'dividend': 0.62}]}
+        ])
+        self.assertEqual(result, {'labels': 1, 'upserted': 0, 'dividends': 2})
+        document = self.get_document('MSFT')
+        self.assertEqual([(entry['ex_div_date'], entry['dividend']) for entry in document['dividends']], [
+            (datetime(2021, 5, 19), 0.56), (datetime(2021, 8, 18), 0.56), (datetime(2021, 11, 17), 0.62)
+        ])
+
+    def test_ids_are_only_reserved_for_new_labels(self):
+        upsert_dividends(Dividend, [{'label': 'MSFT', 'dividends': [{'ex_div_date': date(2021, 8, 18), 'dividend': 0.56}]}])
+        msft_id = self.get_document('MSFT')['id']
+        sequence = get_sequence()
+        upsert_dividends(Dividend, [
+            {'label': 'MSFT', 'dividends': [{'ex_div_date': date(2021, 11, 17), 'dividend': 0.62}]},
+            {'label': 'AAPL', 'dividends': [{'ex_div_date': date(2021, 8, 6), 'dividend': 0.22}]}
+        ])
+        self.assertEqual(get_sequence(), sequence + 1)
+        self.assertEqual(self.get_document('MSFT')['id'], msft_id)
+        self.assertEqual(self.get_document('AAPL')['id'], sequence + 1)
+
+    def test_nothing_to_write(self):
+        sequence = get_sequence()
+        self.assertEqual(upsert_dividends(Dividend, []), {'labels': 0, 'upserted': 0, 'dividends': 0})
+        self.assertEqual(get_sequence(), sequence)
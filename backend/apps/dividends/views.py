@@ -1,12 +1,28 @@
 from django.shortcuts import render
 from rest_framework import serializers
 from rest_framework.response import Response
-from rest_framework import viewsets
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from pymongo.errors import BulkWriteError
 from django_filters import rest_framework as filters
 from rest_framework.filters import OrderingFilter
+from rest_framework.exceptions import ValidationError
+from datetime import date, timedelta
 from .models import Dividend, DividendList
+from .dividendstore import upsert_dividends, dividends_pipeline, calendar_pipeline, to_calendar_entry, get_sort
+from apps.equities.cache import (
+    CachedReadMixin, invalidate_dividends, dividend_namespace, get_label, forget_label, DIVIDENDS_ALL
+)
+from apps.equities.mongo import get_collection
+from apps.equities.native import use_native_reads, to_representation, find_one
+from apps.equities.metrics import TimedSerializerMixin, phase
+from apps.equities.export import ExportSerializer, export_response
 
-class DividendSerializer(serializers.ModelSerializer):
+class DividendListSerializer(serializers.Serializer):
+    ex_div_date = serializers.DateField()
+    dividend = serializers.FloatField()
+
+class DividendSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     #dividend_list = DividendList()
     class Meta:
         model = Dividend
@@ -18,9 +34,139 @@ class DividendSerializer(serializers.ModelSerializer):
         dividend_instance = Dividend.objects.create(**data)
         return dividend_instance
 
-class DividendsViewSet(viewsets.ModelViewSet):
+# filters of the dividends list, the ex_div_date range returns only the
+# documents and the entries of the window
+class DividendFilterSerializer(serializers.Serializer):
+    label = serializers.CharField(required=False)
+    ex_div_date__gte = serializers.DateField(required=False)
+    ex_div_date__lte = serializers.DateField(required=False)
+    ordering = serializers.CharField(required=False, allow_blank=True)
+
+# all the ex_div_dates of the window across the labels, this week by default
+class DividendCalendarSerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    labels = serializers.CharField(required=False)
+
+    def validate(self, data):
+        data.setdefault('start', date.today() - timedelta(days=date.today().weekday()))
+        data.setdefault('end', data['start'] + timedelta(days=6))
+        if data['end'] < data['start']:
+            raise serializers.ValidationError({'end': 'end should be after start'})
+        if 'labels' in data:
+            data['labels'] = [label.strip() for label in data['labels'].split(',') if label.strip() != '']
+        return data
+
+class DividendUpsertSerializer(serializers.Serializer):
+    label = serializers.CharField(max_length=20)
+    date_time = serializers.DateTimeField(required=False)
+    dividends = DividendListSerializer(many=True)
+
+def build_dividends_pipeline(filters, ordering):
+    # aggregation pipeline of the validated DividendFilterSerializer filters
+    return dividends_pipeline(
+        filters.get('label'), filters.get('ex_div_date__gte'), filters.get('ex_div_date__lte'),
+        get_sort(filters.get('ordering'), ordering)
+    )
+
+def read_calendar(filters, using='default'):
+    pipeline = calendar_pipeline(filters['start'], filters['end'], filters.get('labels'))
+    return [to_calendar_entry(document) for document in get_collection(Dividend, using).aggregate(pipeline)]
+
+# the dividends created under /equities/:equity_id/dividends/ are the ones of
+# the label of the equity: the label of the payload defaults to it and must
+# be the same
+def with_equity_label(data, label):
+    if not isinstance(data, dict):
+        return data
+    data = data.copy()
+    if data.get('label') in (None, ''):
+        data['label'] = label
+    elif data['label'] != label:
+        raise ValidationError({'label': ['must be the label of the equity ({0}).'.format(label)]})
+    return data
+
+# the writes of the dividends invalidate the cached responses of their label
+class DividendWritesMixin:
+    def perform_create(self, serializer):
+        serializer.save()
+        invalidate_dividends([serializer.instance.label])
+
+    def perform_update(self, serializer):
+        label = serializer.instance.label
+        serializer.save()
+        if serializer.instance.label != label:
+            forget_label(Dividend, serializer.instance.pk)
+        invalidate_dividends([label, serializer.instance.label])
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        invalidate_dividends([instance.label])
+
+class DividendsViewSet(CachedReadMixin, DividendWritesMixin, viewsets.ModelViewSet):
     serializer_class = DividendSerializer
     queryset = Dividend.objects.all()
     filter_backends = (filters.DjangoFilterBackend, OrderingFilter)
-    filterset_fields = ('equity', 'year')
-    ordering = ('year')
+    filterset_fields = ('label',)
+    ordering = ('label')
+
+    # override methods of ModelViewSet, with the native read path the
+    # documents are read with pymongo (see apps/equities/native.py).
+    # The ORM cannot filter the embedded entries, the ex_div_date range
+    # filters are always read with pymongo
+    def list(self, request, *args, **kwargs):
+        serializer = DividendFilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        ranged = 'ex_div_date__gte' in params or 'ex_div_date__lte' in params
+        if not ranged and not use_native_reads(request):
+            return super().list(request, *args, **kwargs)
+        documents = get_collection(Dividend).aggregate(build_dividends_pipeline(params, self.ordering))
+        with phase('serialize'):
+            return Response([to_representation(Dividend, document) for document in documents])
+
+    def retrieve(self, request, *args, **kwargs):
+        if not use_native_reads(request):
+            return super().retrieve(request, *args, **kwargs)
+        return Response(to_representation(Dividend, find_one(Dividend, kwargs['pk'])))
+
+    # GET /dividends/calendar/?start=&end=&labels= ex_div_dates of all the labels
+    @action(detail=False, methods=['get'], url_path='calendar')
+    def calendar(self, request):
+        serializer = DividendCalendarSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(read_calendar(serializer.validated_data))
+
+    # GET /dividends/export/?labels=&start=&end=&encoding=csv|parquet|arrow
+    # one row per dividend streamed from a MongoDB cursor
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        serializer = ExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return export_response('dividends', serializer.validated_data)
+
+    # POST /dividends/bulk/ with a list of {label, dividends}, e.g. the whole
+    # history of the labels, merged by ex_div_date into their documents
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_upsert(self, request):
+        serializer = DividendUpsertSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        entries = serializer.validated_data
+        try:
+            result = upsert_dividends(Dividend, entries)
+        except BulkWriteError as err:
+            return Response(
+                {'errors': [e['errmsg'] for e in err.details['writeErrors']]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        finally:
+            invalidate_dividends([entry['label'] for entry in entries])
+        return Response(result, status=status.HTTP_200_OK)
+
+    def get_cache_namespaces(self, request, kwargs):
+        label = request.GET.get('label')
+        if label is None and 'pk' in kwargs:
+            label = get_label(Dividend, kwargs['pk'])
+        if label is not None:
+            return [dividend_namespace(label)]
+        return [DIVIDENDS_ALL]
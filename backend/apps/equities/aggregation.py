@@ -0,0 +1,189 @@
+import re
+from datetime import datetime, time, timedelta
+from .mongo import get_collection
+from .timeseries import to_float
+from .tickstore import TIMESTAMP_FORMAT, to_utc
+
+# resampling of the daily bars (Equity) and of the ticks (TickBucket) of a label
+# in arbitrary intervals, computed by MongoDB aggregation pipelines:
+# 5m, 15m, 1h, 4h (fixed length intervals in minutes/hours, from the ticks)
+# 1d, 1w (fixed length, from the bars or the ticks), 1mo, 3mo, 1y (calendar)
+#
+# every interval is a bar with open, high, low, close, the average price
+# (there are no volumes in the store so it is not volume weighted) and the
+# number of bars/ticks aggregated, returned as parallel arrays:
+# {
+#     "label": "MSFT",
+#     "interval": "1mo",
+#     "source": "bars",
+#     "start": ["2021-07-01T00:00:00.000000Z", "2021-08-01T00:00:00.000000Z"],
+#     "open": [...], "high": [...], "low": [...], "close": [...],
+#     "average": [...], "count": [21, 18]
+# }
+
+INTERVAL_REGEX = re.compile(r'^(\d+)(m|h|d|w|mo|y)$')
+
+INTERVAL_UNIT_MS = {
+    'm': 60 * 1000,
+    'h': 60 * 60 * 1000,
+    'd': 24 * 60 * 60 * 1000,
+    'w': 7 * 24 * 60 * 60 * 1000
+}
+
+EPOCH = datetime(1970, 1, 1)
+# weeks start on monday, 1970-01-05 is the first monday after the epoch
+WEEK_EPOCH = datetime(1970, 1, 5)
+
+
+class IntervalError(ValueError):
+    pass
+
+
+def parse_interval(interval):
+    match = INTERVAL_REGEX.match(interval)
+    if match is None or int(match.group(1)) == 0:
+        raise IntervalError("Invalid interval {0}, e.g. 5m, 1h, 1d, 1w, 1mo, 1y".format(interval))
+    return int(match.group(1)), match.group(2)
+
+
+def is_intraday(interval):
+    count, unit = parse_interval(interval)
+    return unit in ('m', 'h')
+
+
+def floor_mod(value, divisor):
+    # $mod keeps the sign of the dividend (the dates before the anchor have a
+    # negative remainder), this remainder of the floor division is always in
+    # [0, divisor)
+    return {'$mod': [{'$add': [{'$mod': [value, divisor]}, divisor]}, divisor]}
+
+
+def interval_key(field, interval):
+    # aggregation expression of the interval of the date in field
+    # fixed length intervals: the start date of the interval
+    # months and years: the number of months/years since year 0
+    count, unit = parse_interval(interval)
+    if unit in INTERVAL_UNIT_MS:
+        anchor = WEEK_EPOCH if unit == 'w' else EPOCH
+        ms = count * INTERVAL_UNIT_MS[unit]
+        return {'$subtract': [field, floor_mod({'$subtract': [field, anchor]}, ms)]}
+    if unit == 'mo':
+        months = {'$add': [{'$multiply': [{'$year': field}, 12]}, {'$subtract': [{'$month': field}, 1]}]}
+        return {'$subtract': [months, {'$mod': [months, count]}]}
+    years = {'$year': field}
+    return {'$subtract': [years, {'$mod': [years, count]}]}
+
+
+def key_to_datetime(key, interval):
+    count, unit = parse_interval(interval)
+    if unit == 'mo':
+        return datetime(key // 12, key % 12 + 1, 1)
+    if unit == 'y':
+        return datetime(key, 1, 1)
+    return key
+
+
+def to_day(value):
+    # midnight of the date of a date or a timestamp
+    return datetime.combine(value.date() if isinstance(value, datetime) else value, time())
+
+
+def bars_pipeline(label, interval, start, end):
+    # the bars of the days from start to end (both included)
+    query = {'label': label}
+    md_date = {}
+    if start is not None:
+        md_date['$gte'] = to_day(start)
+    if end is not None:
+        md_date['$lte'] = to_day(end)
+    if len(md_date) != 0:
+        query['md_date'] = md_date
+
+    return [
+        {'$match': query},
+        {'$sort': {'md_date': 1}},
+        {'$group': {
+            '_id': interval_key('$md_date', interval),
+            'open': {'$first': '$p_open'},
+            'high': {'$max': '$p_high'},
+            'low': {'$min': '$p_low'},
+            'close': {'$last': '$p_close'},
+            'average': {'$avg': '$p_close'},
+            'count': {'$sum': 1}
+        }},
+        {'$sort': {'_id': 1}}
+    ]
+
+
+def ticks_pipeline(label, interval, start, end):
+    # the parallel arrays of the buckets are zipped and unwound to one tick
+    # per document, only the buckets overlapping the window are read.
+    # start and end are included, an end date includes the ticks of the
+    # whole day as with the bars
+    bucket_query = {'label': label}
+    tick_query = {}
+    if start is not None:
+        start = to_utc(start if isinstance(start, datetime) else to_day(start))
+        bucket_query['bucket_end'] = {'$gt': start}
+        tick_query['$gte'] = start
+    if isinstance(end, datetime):
+        end = to_utc(end)
+        bucket_query['bucket_start'] = {'$lte': end}
+        tick_query['$lte'] = end
+    elif end is not None:
+        end = to_utc(to_day(end) + timedelta(days=1))
+        bucket_query['bucket_start'] = {'$lt': end}
+        tick_query['$lt'] = end
+
+    pipeline = [
+        {'$match': bucket_query},
+        {'$project': {'_id': 0, 'tick': {'$zip': {'inputs': ['$timestamps', '$prices']}}}},
+        {'$unwind': '$tick'},
+        {'$project': {
+            'timestamp': {'$arrayElemAt': ['$tick', 0]},
+            'price': {'$arrayElemAt': ['$tick', 1]}
+        }}
+    ]
+    if len(tick_query) != 0:
+        pipeline.append({'$match': {'timestamp': tick_query}})
+    pipeline.extend([
+        {'$sort': {'timestamp': 1}},
+        {'$group': {
+            '_id': interval_key('$timestamp', interval),
+            'open': {'$first': '$price'},
+            'high': {'$max': '$price'},
+            'low': {'$min': '$price'},
+            'close': {'$last': '$price'},
+            'average': {'$avg': '$price'},
+            'count': {'$sum': 1}
+        }},
+        {'$sort': {'_id': 1}}
+    ])
+    return pipeline
+
+
+def resample(equity_model, tickbucket_model, label, interval, start=None, end=None, source=None, using='default'):
+    # source is 'bars' (daily Equity documents) or 'ticks', by default
+    # intraday intervals are computed from the ticks and the others from the bars
+    parse_interval(interval)
+    if source is None:
+        source = 'ticks' if is_intraday(interval) else 'bars'
+    if source == 'bars' and is_intraday(interval):
+        raise IntervalError("Intraday interval {0} needs the ticks source".format(interval))
+
+    if source == 'bars':
+        collection = get_collection(equity_model, using)
+        pipeline = bars_pipeline(label, interval, start, end)
+    else:
+        collection = get_collection(tickbucket_model, using)
+        pipeline = ticks_pipeline(label, interval, start, end)
+
+    data = {'label': label, 'interval': interval, 'source': source}
+    for key in ('start', 'open', 'high', 'low', 'close', 'average', 'count'):
+        data[key] = []
+    for bar in collection.aggregate(pipeline, allowDiskUse=True):
+        data['start'].append(key_to_datetime(bar['_id'], interval).strftime(TIMESTAMP_FORMAT))
+        for key in ('open', 'high', 'low', 'close', 'average'):
+            data[key].append(to_float(bar[key]))
+        data['count'].append(bar['count'])
+    return data
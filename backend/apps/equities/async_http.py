@@ -0,0 +1,228 @@
+import asyncio
+import functools
+import json
+import logging
+import re
+import time
+from django.conf import settings
+from django.http import QueryDict
+from rest_framework.exceptions import ParseError
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from .motor_client import close_async_clients
+from .metrics import METRICS_ENABLED, REQUEST_DURATION, REQUESTS
+from .cache import (
+    API_CACHE_ENABLED, API_CACHE_TIMEOUT, get_cache, lookup, build_entry, is_not_modified, get_validators
+)
+
+# minimal ASGI layer of the async API: Django 3.0 (the last version
+# supported by djongo) has no async views, so the async endpoints are plain
+# ASGI handlers in front of the Django ASGI application. The requests
+# matching a route of the async API are handled in the event loop, all the
+# other ones (bulk upserts, ticks, range, admin, browsable API, ...) are
+# passed to Django
+#
+# a handler is a coroutine handler(request, **kwargs) returning the data
+# (or a (data, status) tuple). Its exceptions go through the DRF exception
+# handler (EXCEPTION_HANDLER) as in the Django views, the unhandled ones are
+# logged and returned as a JSON 500. Every request is counted in the
+# metrics of MetricsMiddleware, whatever its outcome
+#
+# the GET routes go through the response cache of the Django views
+# (cache.py): same keys, namespaces, ETag and 304 responses. The cache
+# backend is blocking, it is called in the threads of the event loop
+# executor like the other blocking calls (invalidations, label lookups).
+# The GET requests with ?read_path=orm (or API_READ_PATH = 'orm') are
+# passed to Django
+
+
+class AsyncRequest:
+    # the attributes of the DRF Request used by the shared helpers
+    # (query_params, build_absolute_uri for the pagination links, GET and
+    # META for the cache keys)
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'').decode('latin-1')
+        self.query_params = QueryDict(self.query_string)
+        self.GET = self.query_params
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+        self.META = {'HTTP_' + key.upper().replace('-', '_'): value for key, value in self.headers.items()}
+        self.body = body
+
+    @property
+    def data(self):
+        if len(self.body) == 0:
+            return {}
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError as e:
+            raise ParseError('JSON parse error - {0}'.format(e))
+
+    def build_absolute_uri(self):
+        scheme = self.scope.get('scheme', 'http')
+        host = self.headers.get('host')
+        if host is None:
+            server = self.scope.get('server') or ('localhost', 80)
+            host = '{0}:{1}'.format(server[0], server[1])
+        url = '{0}://{1}{2}'.format(scheme, host, self.scope.get('root_path', '') + self.path)
+        return url + '?' + self.query_string if self.query_string != '' else url
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+
+async def run_in_thread(func, *args, **kwargs):
+    # blocking call (cache backend, pymongo) out of the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def encode_json(data):
+    return json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode()
+
+
+async def send_content(send, status, headers, content=b''):
+    headers = [(key.lower().encode('latin-1'), str(value).encode('latin-1')) for key, value in headers.items()]
+    if status != 304:
+        headers.append((b'content-length', str(len(content)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': content})
+
+
+async def send_response(send, status, data=None, headers=None):
+    headers = dict(headers or {})
+    if data is None:
+        await send_content(send, status, headers)
+    else:
+        headers['Content-Type'] = 'application/json'
+        await send_content(send, status, headers, encode_json(data))
+
+
+def viewset_namespaces(viewset):
+    # cache namespaces of the requests of a route, as the Django viewset
+    return lambda request, kwargs: viewset().get_cache_namespaces(request, kwargs)
+
+
+def is_native_read(scope):
+    query = QueryDict(scope.get('query_string', b'').decode('latin-1'))
+    return query.get('read_path', getattr(settings, 'API_READ_PATH', 'native')) == 'native'
+
+
+# headers of the DRF exception responses (authentication, throttling)
+EXCEPTION_HEADERS = ('WWW-Authenticate', 'Retry-After')
+
+logger = logging.getLogger(__name__)
+
+
+def handle_exception(exc, request, kwargs):
+    # (data, status, headers) of an exception of a handler
+    response = api_settings.EXCEPTION_HANDLER(exc, {'request': request, 'args': (), 'kwargs': kwargs, 'view': None})
+    if response is None:
+        logger.error("Internal Server Error: %s", request.path, exc_info=exc)
+        return {'detail': 'A server error occurred.'}, 500, {}
+    headers = {key: response[key] for key in EXCEPTION_HEADERS if response.has_header(key)}
+    return response.data, response.status_code, headers
+
+
+class AsyncRouter:
+    # routes: list of (path regex, {method: handler}) or (path regex,
+    # {method: handler}, namespaces) where namespaces(request, kwargs) gives
+    # the cache namespaces of the GET requests (see viewset_namespaces),
+    # fallback: ASGI application of the requests without a route (Django)
+    # asgi_routes: list of (path regex, ASGI application) for the streaming
+    # responses and the WebSockets, which are not request/response handlers
+    def __init__(self, routes, fallback, asgi_routes=()):
+        self.routes = [
+            (re.compile(route[0]), route[1], route[2] if len(route) > 2 else None) for route in routes
+        ]
+        self.asgi_routes = [(re.compile(pattern), app) for pattern, app in asgi_routes]
+        self.fallback = fallback
+
+    def resolve(self, scope):
+        # the browsable API (text/html) is rendered by Django
+        accept = dict(scope['headers']).get(b'accept', b'')
+        if b'text/html' in accept:
+            return None, None, None
+        # the reads of the ORM path (and the invalid read_path errors) too
+        if scope['method'] == 'GET' and not is_native_read(scope):
+            return None, None, None
+        for pattern, handlers, namespaces in self.routes:
+            match = pattern.match(scope['path'])
+            if match is not None and scope['method'] in handlers:
+                return handlers[scope['method']], match.groupdict(), namespaces
+        return None, None, None
+
+    async def call(self, handler, request, kwargs):
+        # (data, status, headers) of the handler
+        try:
+            result = await handler(request, **kwargs)
+        except Exception as e:
+            return handle_exception(e, request, kwargs)
+        data, status = result if isinstance(result, tuple) else (result, 200)
+        return data, status, {}
+
+    async def call_cached(self, handler, request, kwargs, namespaces, send):
+        # GET through the response cache, same entries as CachedReadMixin
+        key, versions, entry = await run_in_thread(lambda: lookup(request, namespaces(request, kwargs)))
+        if entry is None:
+            data, status, headers = await self.call(handler, request, kwargs)
+            if status != 200:
+                await send_response(send, status, data, headers)
+                return status
+            entry = build_entry(encode_json(data), {'Content-Type': 'application/json'}, versions)
+            await run_in_thread(get_cache().set, key, entry, timeout=API_CACHE_TIMEOUT)
+        if is_not_modified(request, entry):
+            await send_content(send, 304, get_validators(entry))
+            return 304
+        await send_content(send, 200, dict(entry['headers'], **get_validators(entry)), entry['content'])
+        return 200
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        for pattern, app in self.asgi_routes:
+            if scope['type'] in ('http', 'websocket') and pattern.match(scope['path']):
+                await app(scope, receive, send)
+                return
+        handler = None
+        if scope['type'] == 'http':
+            handler, kwargs, namespaces = self.resolve(scope)
+        if handler is None:
+            await self.fallback(scope, receive, send)
+            return
+
+        request = AsyncRequest(scope, await read_body(receive))
+        started = time.perf_counter()
+        # an error of the cache backend fails the request (500 of the server)
+        status = 500
+        try:
+            if API_CACHE_ENABLED and namespaces is not None and request.method == 'GET':
+                status = await self.call_cached(handler, request, kwargs, namespaces, send)
+            else:
+                data, status, headers = await self.call(handler, request, kwargs)
+                await send_response(send, status, data, headers)
+        finally:
+            # the Motor commands run in its threads, the async requests are not split in phases
+            if METRICS_ENABLED:
+                endpoint = 'async:' + handler.__name__
+                REQUEST_DURATION.observe((endpoint, request.method), time.perf_counter() - started)
+                REQUESTS.inc((endpoint, request.method, str(status)))
+
+    async def lifespan(self, receive, send):
+        # Django 3.0 does not handle the lifespan messages
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                close_async_clients()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,151 @@
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from rest_framework.exceptions import NotFound, ValidationError
+from .models import Equity
+from .mongo import to_mongo
+from .motor_client import get_async_collection, allocate_ids_async
+from .native import to_representation, get_projection, get_sort
+from .pagination import KeysetPagination
+from .cache import invalidate_equities, forget_label
+from .async_http import run_in_thread, viewset_namespaces
+from .views import EquitiesViewSet, EquitySerializer, EquityFilterSerializer, parse_fields, build_equities_query
+from apps.securities.models import Security
+
+# async versions of the EquitiesViewSet CRUD endpoints (see async_http.py),
+# same filters, pagination, validation and responses as the native read path
+#
+#   GET/POST /equities/
+#   GET/PUT/PATCH/DELETE /equities/:id/
+
+
+def to_pk(pk):
+    try:
+        return int(pk)
+    except (TypeError, ValueError):
+        raise NotFound()
+
+
+def get_defaults(model, data):
+    # the model defaults of the fields missing from the payload, as the ORM does
+    document = {}
+    for field in model._meta.concrete_fields:
+        if field.attname not in data and field.name not in data and field.has_default():
+            document[field.attname] = field.get_default()
+    document.update(data)
+    return document
+
+
+async def find_securities(labels):
+    documents = get_async_collection(Security).find({'label': {'$in': list(labels)}}, get_projection(Security))
+    return {document['label']: document async for document in documents}
+
+
+async def represent_equities(request, documents, fields):
+    data = [to_representation(Equity, document, fields) for document in documents]
+    if 'security' in request.query_params.get('embed', '').split(','):
+        securities = await find_securities(set(document['label'] for document in documents))
+        for equity, document in zip(data, documents):
+            security = securities.get(document['label'])
+            equity['security'] = to_representation(Security, security) if security is not None else None
+    return data
+
+
+async def list_equities(request):
+    serializer = EquityFilterSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    fields = parse_fields(Equity, request.query_params.get('fields'))
+
+    query = build_equities_query(serializer.validated_data)
+    paginator = KeysetPagination()
+    if not paginator.is_requested(request):
+        sort = get_sort(Equity, request.query_params.get('ordering'), EquitiesViewSet.ordering)
+        documents = await get_async_collection(Equity).find(query, get_projection(Equity, fields)).sort(sort).to_list(None)
+        return await represent_equities(request, documents, fields)
+
+    query, projection, sort, page_size = paginator.get_collection_query(
+        query, get_projection(Equity, fields), request, Equity
+    )
+    documents = await get_async_collection(Equity).find(query, projection).sort(sort).to_list(page_size + 1)
+    documents = paginator.get_collection_page(documents, page_size)
+    return {
+        'next': paginator.get_next_link(),
+        'results': await represent_equities(request, documents, fields)
+    }
+
+
+async def retrieve_equity(request, pk):
+    fields = parse_fields(Equity, request.query_params.get('fields'))
+    document = await get_async_collection(Equity).find_one({'id': to_pk(pk)}, get_projection(Equity))
+    if document is None:
+        raise NotFound()
+    return (await represent_equities(request, [document], fields))[0]
+
+
+async def create_equities(request):
+    # one equity or a list of equities as the ModelViewSet create
+    data = request.data
+    many = isinstance(data, list)
+    serializer = EquitySerializer(data=data, many=many)
+    serializer.is_valid(raise_exception=True)
+    equities = serializer.validated_data if many else [serializer.validated_data]
+    if len(equities) == 0:
+        return [], 201
+
+    first_id = await allocate_ids_async(Equity, len(equities))
+    documents = []
+    for i, equity in enumerate(equities):
+        document = to_mongo(get_defaults(Equity, equity))
+        document['id'] = first_id + i
+        documents.append(document)
+    try:
+        await get_async_collection(Equity).insert_many(documents, ordered=True)
+    except BulkWriteError as err:
+        raise ValidationError({'non_field_errors': [e['errmsg'] for e in err.details['writeErrors']]})
+    finally:
+        await run_in_thread(invalidate_equities, [document['label'] for document in documents])
+
+    results = [to_representation(Equity, document) for document in documents]
+    return (results if many else results[0]), 201
+
+
+async def update_equity(request, pk, partial=False):
+    serializer = EquitySerializer(data=request.data, partial=partial)
+    serializer.is_valid(raise_exception=True)
+    values = to_mongo(dict(serializer.validated_data))
+    try:
+        before = await get_async_collection(Equity).find_one_and_update(
+            {'id': to_pk(pk)}, {'$set': values}, projection=get_projection(Equity),
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError as e:
+        raise ValidationError({'non_field_errors': [str(e)]})
+    if before is None:
+        raise NotFound()
+    document = dict(before, **values)
+    if before['label'] != document['label']:
+        await run_in_thread(forget_label, Equity, pk)
+    await run_in_thread(invalidate_equities, [before['label'], document['label']])
+    return to_representation(Equity, document)
+
+
+async def partial_update_equity(request, pk):
+    return await update_equity(request, pk, partial=True)
+
+
+async def destroy_equity(request, pk):
+    document = await get_async_collection(Equity).find_one_and_delete({'id': to_pk(pk)}, projection={'label': 1})
+    if document is None:
+        raise NotFound()
+    await run_in_thread(invalidate_equities, [document['label']])
+    return None, 204
+
+
+ROUTES = [
+    (r'^/equities/$', {'GET': list_equities, 'POST': create_equities}, viewset_namespaces(EquitiesViewSet)),
+    (r'^/equities/(?P<pk>\d+)/$', {
+        'GET': retrieve_equity,
+        'PUT': update_equity,
+        'PATCH': partial_update_equity,
+        'DELETE': destroy_equity
+    }, viewset_namespaces(EquitiesViewSet))
+]
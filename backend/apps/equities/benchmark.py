@@ -0,0 +1,194 @@
+import json
+import math
+import platform
+import random
+import subprocess
+from bson.decimal128 import Decimal128
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.conf import settings
+from django.utils import timezone
+
+# helpers of the seed_benchmark and run_benchmark management commands
+#
+# the synthetic dataset is deterministic: the same --seed, --labels and
+# --days always give the same documents, so the reports of two commits are
+# measured on the same data. The synthetic labels start with SYNTHETIC_PREFIX
+# and can be removed without touching the real ones
+#
+# a report is a JSON document with one result per access pattern:
+# {
+#     "kind": "api",
+#     "commit": "19d76d8",
+#     "created": "2021-08-25T18:14:44Z",
+#     "dataset": {"equities": 5000000, ...},
+#     "options": {"iterations": 200, ...},
+#     "results": [
+#         {"name": "equities_list_label", "method": "GET", "path": "/equities/?label=",
+#          "iterations": 200, "errors": 0, "p50_ms": 4.1, "p90_ms": 5.3, "p99_ms": 9.8,
+#          "mean_ms": 4.4, "max_ms": 12.0, "throughput_rps": 225.3}
+#     ]
+# }
+
+SYNTHETIC_PREFIX = 'SYN'
+BENCHMARK_START = date(2010, 1, 4)
+
+
+def get_labels(count):
+    return ['{0}{1:05d}'.format(SYNTHETIC_PREFIX, i) for i in range(count)]
+
+
+def get_days(count, start=BENCHMARK_START):
+    # count weekdays from start
+    days = []
+    day = start
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def to_decimal128(value):
+    return Decimal128(Decimal(value).quantize(Decimal('0.000001')))
+
+
+def generate_equities(seed, label, days, date_time):
+    # daily bars of a label as a random walk, seeded by the seed and the label
+    rng = random.Random('{0}:{1}'.format(seed, label))
+    price = rng.uniform(5, 500)
+    shares = rng.randint(10 ** 7, 10 ** 10)
+    documents = []
+    for day in days:
+        p_open = price
+        p_close = max(0.01, p_open * (1 + rng.gauss(0, 0.02)))
+        p_high = max(p_open, p_close) * (1 + abs(rng.gauss(0, 0.005)))
+        p_low = min(p_open, p_close) * (1 - abs(rng.gauss(0, 0.005)))
+        documents.append({
+            'label': label,
+            'md_date': datetime.combine(day, time()),
+            'date_time': date_time,
+            'market_cap': to_decimal128(p_close * shares),
+            'p_open': to_decimal128(p_open),
+            'p_high': to_decimal128(p_high),
+            'p_low': to_decimal128(p_low),
+            'p_close': to_decimal128(p_close)
+        })
+        price = p_close
+    return documents
+
+
+def generate_security(label):
+    return {
+        'label': label,
+        'description': 'Synthetic security {0}'.format(label),
+        'industry': 'Benchmark',
+        'country': 'United States',
+        'currency': 'USD',
+        'market': 'us_market',
+        'exchange': 'NMS'
+    }
+
+
+def generate_dividends(seed, label, days):
+    # one dividend per quarter on the first weekday of the quarter, for half of the labels
+    rng = random.Random('{0}:{1}:dividends'.format(seed, label))
+    if rng.random() < 0.5:
+        return None
+    amount = round(rng.uniform(0.05, 2), 2)
+    dividends = [
+        {'ex_div_date': day, 'dividend': amount}
+        for i, day in enumerate(days) if i == 0 or day.month != days[i - 1].month and day.month % 3 == 2
+    ]
+    return {'label': label, 'dividends': dividends}
+
+
+def generate_ticks(seed, label, day, count):
+    # count ticks of a label during the trading session (14:30-21:00 UTC)
+    rng = random.Random('{0}:{1}:{2}'.format(seed, label, day.isoformat()))
+    session_start = datetime.combine(day, time(14, 30), tzinfo=dt_timezone.utc)
+    price = rng.uniform(5, 500)
+    ticks = []
+    for i in range(count):
+        price = max(0.01, price * (1 + rng.gauss(0, 0.001)))
+        ticks.append((label, session_start + timedelta(seconds=i * 23400 / count), round(price, 4)))
+    return ticks
+
+
+# percentile, summarize and compare_reports have a copy in
+# datafeeders/benchmark_feeder.py (percentile, summarize, compare), which
+# runs without Django: the reports of both must keep the same format
+def percentile(values, q):
+    # nearest rank percentile of the sorted values
+    if len(values) == 0:
+        return None
+    return values[max(0, int(math.ceil(q / 100 * len(values))) - 1)]
+
+
+def summarize(name, method, path, latencies, errors, elapsed):
+    latencies = sorted(latency * 1000 for latency in latencies)
+    return {
+        'name': name,
+        'method': method,
+        'path': path,
+        'iterations': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'p90_ms': round(percentile(latencies, 90), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'max_ms': round(latencies[-1], 3) if latencies else None,
+        'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed > 0 else None
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=str(settings.BASE_DIR), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(kind, dataset, options, results):
+    return {
+        'kind': kind,
+        'commit': get_commit(),
+        'created': timezone.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dataset': dataset,
+        'options': options,
+        'results': results
+    }
+
+
+def compare_reports(baseline, report, threshold):
+    # (name, baseline p50, p50, change) of the results of both reports and
+    # the names of the regressions: p50 slower or throughput lower by more
+    # than threshold (0.2 = 20%)
+    baseline_results = {result['name']: result for result in baseline['results']}
+    rows = []
+    regressions = []
+    for result in report['results']:
+        before = baseline_results.get(result['name'])
+        if before is None or not before['p50_ms'] or not result['p50_ms']:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1
+        rows.append((result['name'], before['p50_ms'], result['p50_ms'], change))
+        slower = change > threshold
+        lower = before['throughput_rps'] and result['throughput_rps'] < before['throughput_rps'] * (1 - threshold)
+        if slower or lower:
+            regressions.append(result['name'])
+    return rows, regressions
+
+
+def read_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4, sort_keys=True)
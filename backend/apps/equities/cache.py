@@ -0,0 +1,215 @@
+import hashlib
+import logging
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from .metrics import phase
+from .mongo import get_collection
+
+# read-through cache of the GET responses of the API
+#
+# the cache backend is the API_CACHE_ALIAS entry of CACHES in settings.py:
+# LocMemCache (in process LRU) by default, memcached or Redis when more than
+# one process serves the API (the invalidations must be seen by all of them).
+# A LocMemCache with more than API_CACHE_WORKERS = 1 worker would serve
+# stale responses from the workers which did not see a write, the cache is
+# disabled then
+#
+# every response belongs to one or more namespaces, e.g. equities:label:MSFT
+# for the requests filtered by label or for a document of the label
+# (/equities/:id/, the label of the id is kept in the cache) and
+# equities:all for the other ones (unfiltered lists, summary, ...). The
+# writes of ticks only (without daily prices) do not change the documents,
+# they only invalidate the namespaces of their labels.
+# The cache key contains the current version of its namespaces and a write
+# bumps the versions of the namespaces it affects, so exactly the responses
+# depending on the written labels are
+# invalidated. The version is the time of the write (microseconds), used as
+# Last-Modified
+#
+# every response has a strong ETag (hash of the content) and Last-Modified,
+# If-None-Match and If-Modified-Since return 304 Not Modified
+
+API_CACHE_ALIAS = getattr(settings, 'API_CACHE_ALIAS', 'default')
+API_CACHE_TIMEOUT = getattr(settings, 'API_CACHE_TIMEOUT', 3600)
+API_CACHE_WORKERS = getattr(settings, 'API_CACHE_WORKERS', 1)
+
+# headers of the rendered response stored with the content
+CACHED_HEADERS = ('Content-Type', 'Content-Encoding', 'Vary', 'Allow')
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache():
+    return caches[API_CACHE_ALIAS]
+
+
+def is_shared_cache():
+    # a LocMemCache (and its invalidations) is only seen by its process
+    return not isinstance(get_cache(), LocMemCache)
+
+
+API_CACHE_ENABLED = getattr(settings, 'API_CACHE_ENABLED', True)
+if API_CACHE_ENABLED and API_CACHE_WORKERS > 1 and not is_shared_cache():
+    logger.warning("API cache disabled: %s workers with a LocMemCache, set API_CACHE_LOCATION", API_CACHE_WORKERS)
+    API_CACHE_ENABLED = False
+
+
+def equity_namespace(label):
+    return 'equities:label:{0}'.format(label)
+
+
+def dividend_namespace(label):
+    return 'dividends:label:{0}'.format(label)
+
+
+EQUITIES_ALL = 'equities:all'
+DIVIDENDS_ALL = 'dividends:all'
+
+
+def invalidate(namespaces):
+    # new version for each namespace
+    if not API_CACHE_ENABLED or len(namespaces) == 0:
+        return
+    version = int(time.time() * 1000000)
+    get_cache().set_many({'version:' + namespace: version for namespace in namespaces}, timeout=None)
+
+
+def invalidate_equities(labels, ticks_only=False):
+    namespaces = [equity_namespace(label) for label in set(labels)]
+    invalidate(namespaces if ticks_only else namespaces + [EQUITIES_ALL])
+
+
+def invalidate_dividends(labels):
+    invalidate([dividend_namespace(label) for label in set(labels)] + [DIVIDENDS_ALL])
+
+
+def get_label_key(model, pk):
+    return 'label:{0}:{1}'.format(model._meta.db_table, pk)
+
+
+def get_label(model, pk):
+    # label of the document of a detail request, None if it does not exist
+    # (the request is then cached in the all namespace)
+    key = get_label_key(model, pk)
+    label = get_cache().get(key)
+    if label is None:
+        try:
+            document = get_collection(model).find_one({'id': int(pk)}, {'label': 1})
+        except (TypeError, ValueError):
+            return None
+        if document is None:
+            return None
+        label = document['label']
+        get_cache().set(key, label, timeout=None)
+    return label
+
+
+def forget_label(model, pk):
+    # after the label of a document is updated
+    get_cache().delete(get_label_key(model, pk))
+
+
+def get_versions(namespaces):
+    # a namespace never written since the cache started gets a version now
+    # (add does not overwrite the version set in the meantime by another process)
+    cache = get_cache()
+    keys = ['version:' + namespace for namespace in namespaces]
+    versions = cache.get_many(keys)
+    if len(versions) != len(keys):
+        version = int(time.time() * 1000000)
+        for key in keys:
+            if key not in versions:
+                cache.add(key, version, timeout=None)
+        versions = cache.get_many(keys)
+    return [versions.get(key, 0) for key in keys]
+
+
+def get_cache_key(request, namespaces, versions):
+    # the same URL can be rendered differently (JSON, browsable API, gzip)
+    parts = [
+        request.path,
+        '&'.join(sorted(request.GET.urlencode().split('&'))),
+        request.META.get('HTTP_ACCEPT', ''),
+        'gzip' if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '') else ''
+    ]
+    parts.extend('{0}={1}'.format(namespace, version) for namespace, version in zip(namespaces, versions))
+    return 'response:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def lookup(request, namespaces):
+    # (key, versions, cached entry or None) of a GET request
+    versions = get_versions(namespaces)
+    key = get_cache_key(request, namespaces, versions)
+    return key, versions, get_cache().get(key)
+
+
+def build_entry(content, headers, versions):
+    return {
+        'content': content,
+        'headers': headers,
+        'etag': quote_etag(hashlib.md5(content).hexdigest()),
+        'last_modified': max(versions) / 1000000
+    }
+
+
+def is_not_modified(request, entry):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return (
+        (if_none_match is not None and entry['etag'] in [e.strip() for e in if_none_match.split(',')])
+        or (if_none_match is None and if_modified_since is not None and int(entry['last_modified']) <= if_modified_since)
+    )
+
+
+def get_validators(entry):
+    return {
+        'ETag': entry['etag'],
+        'Last-Modified': http_date(entry['last_modified']),
+        # the clients can keep the responses but need to revalidate them
+        'Cache-Control': 'no-cache'
+    }
+
+
+def build_response(request, entry):
+    if is_not_modified(request, entry):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entry['content'])
+        for header, value in entry['headers'].items():
+            response[header] = value
+    for header, value in get_validators(entry).items():
+        response[header] = value
+    return response
+
+
+class CachedReadMixin:
+    # viewset mixin: GET requests are served from the cache, the viewset
+    # defines get_cache_namespaces(request, kwargs) for its requests
+    cache_timeout = API_CACHE_TIMEOUT
+
+    def get_cache_namespaces(self, request, kwargs):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        if not API_CACHE_ENABLED or request.method != 'GET':
+            return super().dispatch(request, *args, **kwargs)
+
+        key, versions, entry = lookup(request, self.get_cache_namespaces(request, kwargs))
+        if entry is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming:
+                return response
+            if hasattr(response, 'render'):
+                with phase('render'):
+                    response.render()
+            entry = build_entry(
+                response.content,
+                {header: response[header] for header in CACHED_HEADERS if response.has_header(header)},
+                versions
+            )
+            get_cache().set(key, entry, timeout=self.cache_timeout)
+        return build_response(request, entry)
@@ -0,0 +1,37 @@
+import gzip
+import json
+from django.http import HttpResponse
+from .metrics import phase
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# responses of the columnar endpoints, built without the DRF renderers:
+# compact JSON by default, MessagePack with ?encoding=msgpack (if installed)
+# (?format= is taken by the DRF content negotiation)
+# and gzip compressed when the client accepts it
+
+GZIP_MIN_SIZE = 1024
+
+
+def encode_response(request, data):
+    if request.query_params.get('encoding') == 'msgpack' and msgpack is None:
+        return HttpResponse('msgpack is not installed', status=406, content_type='text/plain')
+
+    with phase('render'):
+        if request.query_params.get('encoding') == 'msgpack':
+            content = msgpack.packb(data, use_bin_type=True)
+            content_type = 'application/msgpack'
+        else:
+            content = json.dumps(data, separators=(',', ':')).encode()
+            content_type = 'application/json'
+
+        response = HttpResponse(content_type=content_type)
+        response['Vary'] = 'Accept-Encoding'
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '') and len(content) >= GZIP_MIN_SIZE:
+            content = gzip.compress(content, compresslevel=6)
+            response['Content-Encoding'] = 'gzip'
+        response.content = content
+    return response
@@ -0,0 +1,284 @@
+import asyncio
+import csv
+import io
+from datetime import datetime, time
+from django.conf import settings
+from django.http import HttpResponse, QueryDict, StreamingHttpResponse
+from rest_framework import serializers
+from .models import Equity
+from .mongo import get_collection
+from .timeseries import to_float
+from apps.dividends.models import Dividend
+from apps.dividends.dividendstore import export_pipeline
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# bulk exports of the equities and dividends of a set of labels and a date
+# range, streamed from a MongoDB cursor without the ORM and the serializers:
+#
+#   GET /equities/export/?labels=MSFT,AAPL&start=2001-01-01&end=2021-08-25&encoding=parquet
+#   GET /dividends/export/?start=2020-01-01&encoding=csv
+#
+# the documents are read EXPORT_BATCH_SIZE at a time, converted column by
+# column and encoded as CSV, Parquet (one row group per batch, requires
+# pyarrow) or Arrow IPC stream (one record batch per batch, requires
+# pyarrow). Each batch is sent as soon as it is encoded, so the memory used
+# does not depend on the size of the export. The rows are sorted by label
+# then date (label/md_date index, label index for the dividends), all the
+# labels are exported when labels is missing
+
+EXPORT_BATCH_SIZE = getattr(settings, 'EXPORT_BATCH_SIZE', 10000)
+
+# content type and file extension of each ?encoding=
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows')
+}
+
+EQUITY_COLUMNS = (
+    ('label', 'string'),
+    ('md_date', 'date'),
+    ('p_open', 'float'),
+    ('p_high', 'float'),
+    ('p_low', 'float'),
+    ('p_close', 'float'),
+    ('market_cap', 'float')
+)
+
+DIVIDEND_COLUMNS = (
+    ('label', 'string'),
+    ('ex_div_date', 'date'),
+    ('dividend', 'float')
+)
+
+
+def to_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+CONVERTERS = {
+    'string': lambda value: value,
+    'date': to_date,
+    'float': to_float
+}
+
+
+class ExportSerializer(serializers.Serializer):
+    labels = serializers.CharField(required=False)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    encoding = serializers.ChoiceField(choices=list(EXPORT_FORMATS), required=False, default='csv')
+
+    def validate(self, data):
+        if 'labels' in data:
+            data['labels'] = [label.strip() for label in data['labels'].split(',') if label.strip() != '']
+        if 'start' in data and 'end' in data and data['end'] < data['start']:
+            raise serializers.ValidationError({'end': 'end should be after start'})
+        return data
+
+
+def read_equities(labels=None, start=None, end=None, using='default'):
+    query = {}
+    if labels:
+        query['label'] = {'$in': labels}
+    md_date = {}
+    if start is not None:
+        md_date['$gte'] = datetime.combine(start, time())
+    if end is not None:
+        md_date['$lte'] = datetime.combine(end, time())
+    if len(md_date) != 0:
+        query['md_date'] = md_date
+    projection = dict({'_id': 0}, **{name: 1 for name, kind in EQUITY_COLUMNS})
+    return get_collection(Equity, using).find(query, projection).sort(
+        [('label', 1), ('md_date', 1)]
+    ).batch_size(EXPORT_BATCH_SIZE)
+
+
+def read_dividends(labels=None, start=None, end=None, using='default'):
+    return get_collection(Dividend, using).aggregate(
+        export_pipeline(labels or None, start, end), batchSize=EXPORT_BATCH_SIZE
+    )
+
+
+# documents and columns of each export
+EXPORTS = {
+    'equities': (read_equities, EQUITY_COLUMNS),
+    'dividends': (read_dividends, DIVIDEND_COLUMNS)
+}
+
+
+def read_batches(documents, columns, batch_size=EXPORT_BATCH_SIZE):
+    # batches of batch_size documents as {column: [values]}
+    converters = [(name, CONVERTERS[kind]) for name, kind in columns]
+    batch = {name: [] for name, kind in columns}
+    count = 0
+    for document in documents:
+        for name, convert in converters:
+            batch[name].append(convert(document.get(name)))
+        count += 1
+        if count == batch_size:
+            yield batch
+            batch = {name: [] for name, kind in columns}
+            count = 0
+    if count != 0:
+        yield batch
+
+
+def encode_csv(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow([name for name, kind in columns])
+    for batch in batches:
+        values = [
+            [value.isoformat() if value is not None else None for value in batch[name]] if kind == 'date' else batch[name]
+            for name, kind in columns
+        ]
+        writer.writerows(zip(*values))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # header only for an empty export
+    if buffer.tell() != 0:
+        yield buffer.getvalue().encode()
+
+
+class ChunkSink:
+    # write-only file object of the pyarrow writers, the bytes written are
+    # taken after each batch
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+ARROW_TYPES = {
+    'string': lambda: pyarrow.string(),
+    'date': lambda: pyarrow.date32(),
+    'float': lambda: pyarrow.float64()
+}
+
+
+def encode_arrow(batches, columns, encoding):
+    schema = pyarrow.schema([(name, ARROW_TYPES[kind]()) for name, kind in columns])
+    sink = ChunkSink()
+    if encoding == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    for batch in batches:
+        writer.write_batch(pyarrow.record_batch(
+            [pyarrow.array(batch[name], field.type) for name, field in zip(schema.names, schema)], schema=schema
+        ))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def get_export_filename(name, filters):
+    parts = [name] + [filters[key].isoformat() for key in ('start', 'end') if key in filters]
+    return '-'.join(parts) + '.' + EXPORT_FORMATS[filters['encoding']][1]
+
+
+def export_content(name, filters):
+    # generator of the encoded bytes of the export
+    read, columns = EXPORTS[name]
+    documents = read(filters.get('labels'), filters.get('start'), filters.get('end'))
+    batches = read_batches(documents, columns)
+    if filters['encoding'] == 'csv':
+        return encode_csv(batches, columns)
+    return encode_arrow(batches, columns, filters['encoding'])
+
+
+def export_response(name, filters):
+    # streaming response of the validated ExportSerializer filters
+    if filters['encoding'] != 'csv' and pyarrow is None:
+        return HttpResponse('pyarrow is not installed', status=406, content_type='text/plain')
+    response = StreamingHttpResponse(export_content(name, filters), content_type=EXPORT_FORMATS[filters['encoding']][0])
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(get_export_filename(name, filters))
+    return response
+
+
+async def stream_export(scope, receive, send):
+    # ASGI application of the exports: Django 3.0 iterates the streaming
+    # responses in the event loop, here the cursor is read and the batches
+    # are encoded in a thread of the default executor
+    if scope['type'] != 'http':
+        # no WebSocket export, the handshake is rejected
+        await send({'type': 'websocket.close'})
+        return
+    name = scope['path'].strip('/').split('/')[0]
+    serializer = ExportSerializer(data=QueryDict(scope.get('query_string', b'').decode('latin-1')))
+    if not serializer.is_valid():
+        content = str(serializer.errors).encode()
+        await send({'type': 'http.response.start', 'status': 400, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': content})
+        return
+    filters = serializer.validated_data
+    if filters['encoding'] != 'csv' and pyarrow is None:
+        await send({'type': 'http.response.start', 'status': 406, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'pyarrow is not installed'})
+        return
+
+    loop = asyncio.get_running_loop()
+    content = await loop.run_in_executor(None, export_content, name, filters)
+    # the server does not fail the sends after a disconnect, the export
+    # stops when the client is gone instead of reading the whole cursor
+    disconnected = asyncio.Event()
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(wait_disconnect())
+    reading = None
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', EXPORT_FORMATS[filters['encoding']][0].encode()),
+            (b'content-disposition', 'attachment; filename="{0}"'.format(get_export_filename(name, filters)).encode())
+        ]})
+        while not disconnected.is_set():
+            reading = loop.run_in_executor(None, next, content, None)
+            # shielded, a cancelled request still waits for the batch being read
+            chunk = await asyncio.shield(reading)
+            if chunk is None or disconnected.is_set():
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        # the generator cannot be closed while a batch is read in a thread,
+        # closing it closes the cursor
+        if reading is not None and not reading.done():
+            await asyncio.wait([reading])
+        await loop.run_in_executor(None, content.close)
@@ -0,0 +1,266 @@
+import csv
+import json
+import os
+import django
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from pymongo.errors import BulkWriteError, PyMongoError
+from .models import Equity
+from .mongo import bulk_upsert_equities
+from apps.dividends.models import Dividend
+from apps.dividends.dividendstore import upsert_dividends
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# helpers of the import_history management command, which loads vendor files
+# of daily bars and dividends directly into MongoDB without the REST API:
+#
+#   equities:  label, md_date, p_open, p_high, p_low, p_close, market_cap
+#   dividends: label, ex_div_date, dividend
+#
+# (the columns of the export endpoints, so an export can be imported back).
+# The files are CSV or Parquet (requires pyarrow) and are read chunk by
+# chunk as {column: [values]}. Each chunk is validated column by column
+# instead of one serializer per row, the invalid rows are rejected with
+# their row number (1 is the first row after the header) and the valid ones
+# are written with the bulk upserts of the API: bulk_upsert_equities (one
+# unordered bulk write matched on label/md_date) and upsert_dividends.
+# The writes are upserts, so a chunk can be imported twice
+
+SIX_PLACES = Decimal('0.000001')
+
+
+def to_label(value):
+    label = str(value).strip() if value is not None else ''
+    if label == '' or len(label) > 20:
+        raise ValueError('should have 1 to 20 characters')
+    return label
+
+
+def to_date(value):
+    # ISO dates, or the dates and timestamps of the Parquet files
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).strip()[:10])
+
+
+def to_decimal(value, max_digits):
+    # same checks as the DecimalFields of the models (6 decimal places)
+    try:
+        number = Decimal(value.strip() if isinstance(value, str) else str(value)).quantize(SIX_PLACES)
+    except InvalidOperation:
+        raise ValueError('{0} is not a number'.format(value))
+    if not number.is_finite() or number < 0:
+        raise ValueError('{0} is not a positive number'.format(value))
+    if len(number.as_tuple().digits) > max_digits:
+        raise ValueError('{0} has more than {1} digits'.format(value, max_digits))
+    return number
+
+
+CONVERTERS = {
+    'label': to_label,
+    'date': to_date,
+    'price': lambda value: to_decimal(value, 16),
+    'market_cap': lambda value: to_decimal(value, 22),
+    # FloatField of the embedded DividendList
+    'dividend': lambda value: float(to_decimal(value, 16))
+}
+
+EQUITY_FIELDS = (
+    ('label', 'label'),
+    ('md_date', 'date'),
+    ('p_open', 'price'),
+    ('p_high', 'price'),
+    ('p_low', 'price'),
+    ('p_close', 'price'),
+    ('market_cap', 'market_cap')
+)
+
+DIVIDEND_FIELDS = (
+    ('label', 'label'),
+    ('ex_div_date', 'date'),
+    ('dividend', 'dividend')
+)
+
+
+def check_equity(document):
+    if document['p_low'] > document['p_high']:
+        return 'p_low: greater than p_high'
+    return None
+
+
+def validate_columns(fields, columns, first_row, check=None):
+    # documents of the valid rows of a chunk and (row, error) of the others
+    values = []
+    errors = {}
+    for name, kind in fields:
+        convert = CONVERTERS[kind]
+        converted = []
+        for i, value in enumerate(columns[name]):
+            try:
+                converted.append(convert(value))
+            except (ValueError, TypeError) as e:
+                converted.append(None)
+                errors.setdefault(i, '{0}: {1}'.format(name, e))
+        values.append(converted)
+
+    names = [name for name, kind in fields]
+    documents = []
+    for i, row in enumerate(zip(*values)):
+        if i in errors:
+            continue
+        document = dict(zip(names, row))
+        error = check(document) if check is not None else None
+        if error is not None:
+            errors[i] = error
+            continue
+        documents.append(document)
+    return documents, [(first_row + i, error) for i, error in sorted(errors.items())]
+
+
+#=================================================================================
+# Files
+#=================================================================================
+def get_file_format(path):
+    return 'parquet' if path.lower().endswith(('.parquet', '.pq')) else 'csv'
+
+
+def read_header(path):
+    if get_file_format(path) == 'parquet':
+        return pyarrow.parquet.ParquetFile(path).schema_arrow.names
+    with open(path, newline='') as f:
+        return [name.strip() for name in next(csv.reader(f), [])]
+
+
+def read_csv_chunks(path, chunk_size):
+    # rows of the file after the header, chunk_size at a time
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        rows = []
+        chunk = 0
+        for row in reader:
+            rows.append(row)
+            if len(rows) == chunk_size:
+                yield chunk, rows
+                chunk += 1
+                rows = []
+        if len(rows) != 0:
+            yield chunk, rows
+
+
+def read_chunks(path, names, chunk_size, skip=()):
+    # (chunk number, first row, {column: [values]}) of the chunks of a file,
+    # the columns are None for the chunks in skip (already imported)
+    if get_file_format(path) == 'parquet':
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for chunk, batch in enumerate(parquet_file.iter_batches(batch_size=chunk_size, columns=list(names))):
+            yield chunk, chunk * chunk_size + 1, None if chunk in skip else batch.to_pydict()
+        return
+
+    header = read_header(path)
+    indexes = [(name, header.index(name)) for name in names]
+    for chunk, rows in read_csv_chunks(path, chunk_size):
+        if chunk in skip:
+            yield chunk, chunk * chunk_size + 1, None
+            continue
+        # short rows give None values, rejected by the converters
+        yield chunk, chunk * chunk_size + 1, {
+            name: [row[index] if index < len(row) else None for row in rows] for name, index in indexes
+        }
+
+
+class ImportProgress:
+    # completed chunks of each file, saved after every chunk so that an
+    # interrupted import starts again after the chunks already written. The
+    # chunks of a file are only skipped if the file (size, modification
+    # time) and the chunk size did not change
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f)
+
+    def start(self, path, chunk_size):
+        # chunks of the file already imported
+        stat = os.stat(path)
+        signature = {'size': stat.st_size, 'mtime': stat.st_mtime, 'chunk_size': chunk_size}
+        key = os.path.abspath(path)
+        entry = self.files.get(key)
+        if entry is None or entry['signature'] != signature:
+            entry = self.files[key] = {'signature': signature, 'done': []}
+        return set(entry['done'])
+
+    def complete(self, path, chunk):
+        self.files[os.path.abspath(path)]['done'].append(chunk)
+        self.save()
+
+    def save(self):
+        # written then renamed, an interruption never leaves a partial file
+        if self.path is None:
+            return
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.files, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+#=================================================================================
+# Workers
+#=================================================================================
+def init_worker():
+    # worker processes started without fork need the Django setup, the forked
+    # ones create their own MongoDB connection on the first write
+    django.setup()
+
+
+def write_equities(documents):
+    return bulk_upsert_equities(Equity, documents)
+
+
+def write_dividends(documents):
+    entries = {}
+    for document in documents:
+        entries.setdefault(document['label'], []).append(
+            {'ex_div_date': document['ex_div_date'], 'dividend': document['dividend']}
+        )
+    return upsert_dividends(Dividend, [{'label': label, 'dividends': dividends} for label, dividends in entries.items()])
+
+
+IMPORTS = {
+    'equities': (EQUITY_FIELDS, check_equity, write_equities),
+    'dividends': (DIVIDEND_FIELDS, None, write_dividends)
+}
+
+
+def import_chunk(name, chunk, first_row, columns, label=None):
+    # validates and writes a chunk in a worker process, the label (if given)
+    # is the label of the files without a label column
+    fields, check, write = IMPORTS[name]
+    if label is not None:
+        columns['label'] = [label] * len(next(iter(columns.values())))
+    documents, rejects = validate_columns(fields, columns, first_row, check)
+    result = {
+        'chunk': chunk,
+        'rows': len(documents) + len(rejects),
+        'documents': len(documents),
+        'rejects': rejects,
+        'labels': sorted(set(document['label'] for document in documents)),
+        'error': None
+    }
+    if len(documents) == 0:
+        return result
+    try:
+        result['write'] = write(documents)
+    except BulkWriteError as err:
+        errors = err.details['writeErrors']
+        result['error'] = '{0} write errors, first: {1}'.format(len(errors), errors[0]['errmsg'] if errors else '')
+    except PyMongoError as err:
+        result['error'] = str(err)
+    return result
@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import datetime, timedelta
+from apps.equities.models import Equity, TickBucket
+from apps.equities.mongo import get_collection
+from apps.dividends.models import Dividend
+
+# runs explain() on the MongoDB query of each API endpoint and reports the
+# winning plan, flagging the ones doing a collection scan (COLLSCAN)
+#
+#   python manage.py explain_queries
+#   python manage.py explain_queries --label MSFT --md-date 2021-08-25 --ex-div-date 2021-08-18 --fail-on-collscan
+
+
+def plan_stages(plan):
+    # stages of the winning plan tree from the root down
+    stages = [plan['stage']]
+    if 'inputStage' in plan:
+        stages.extend(plan_stages(plan['inputStage']))
+    for input_stage in plan.get('inputStages', []):
+        stages.extend(plan_stages(input_stage))
+    return stages
+
+
+def plan_indexes(plan):
+    indexes = [plan['indexName']] if 'indexName' in plan else []
+    if 'inputStage' in plan:
+        indexes.extend(plan_indexes(plan['inputStage']))
+    for input_stage in plan.get('inputStages', []):
+        indexes.extend(plan_indexes(input_stage))
+    return indexes
+
+
+class Command(BaseCommand):
+    help = 'Explains the MongoDB queries of the API endpoints and reports collection scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--label', type=str)
+        parser.add_argument('--md-date', type=str)
+        parser.add_argument('--ex-div-date', type=str)
+        parser.add_argument('--fail-on-collscan', action='store_true')
+
+    def sample_values(self, options):
+        # values of the filters taken from existing documents unless provided
+        equity = get_collection(Equity).find_one({}, {'id': 1, 'label': 1, 'md_date': 1}) or {}
+        dividend = get_collection(Dividend).find_one({}, {'dividends': {'$slice': -1}}) or {}
+        md_date = options['md_date']
+        ex_div_date = options['ex_div_date']
+        last_dividends = dividend.get('dividends') or [{'ex_div_date': datetime(2021, 8, 18)}]
+        return {
+            'label': options['label'] or equity.get('label', 'MSFT'),
+            'md_date': datetime.fromisoformat(md_date) if md_date else equity.get('md_date', datetime(2021, 8, 25)),
+            'ex_div_date': datetime.fromisoformat(ex_div_date) if ex_div_date else last_dividends[-1]['ex_div_date'],
+        }
+
+    def queries(self, values):
+        # (endpoint, model, filter, sort) as executed for the API filters
+        start = values['md_date']
+        return [
+            ('GET /equities/?label=', Equity, {'label': values['label']}, [('md_date', 1)]),
+            ('GET /equities/?md_date=', Equity, {'md_date': values['md_date']}, [('md_date', 1)]),
+            ('GET /equities/?label=&md_date=', Equity, {'label': values['label'], 'md_date': values['md_date']}, [('md_date', 1)]),
+            ('GET /equities/ticks/?label=&start=&end=', TickBucket, {
+                'label': values['label'],
+                'bucket_start': {'$lt': start + timedelta(days=1)},
+                'bucket_end': {'$gt': start}
+            }, None),
+            ('GET /dividends/?label=', Dividend, {'label': values['label']}, [('label', 1)]),
+            ('GET /dividends/calendar/?start=&end=', Dividend, {'dividends': {'$elemMatch': {'ex_div_date': {
+                '$gte': values['ex_div_date'] - timedelta(days=values['ex_div_date'].weekday()),
+                '$lte': values['ex_div_date'] + timedelta(days=6 - values['ex_div_date'].weekday())
+            }}}}, None),
+            ('GET /equities/:id/dividends/', Dividend, {'label': values['label']}, None),
+        ]
+
+    def handle(self, *args, **options):
+        collscans = []
+        for endpoint, model, query, sort in self.queries(self.sample_values(options)):
+            cursor = get_collection(model).find(query)
+            if sort is not None:
+                cursor = cursor.sort(sort)
+            explain = cursor.explain()
+            plan = explain['queryPlanner']['winningPlan']
+            stages = plan_stages(plan)
+            stats = explain.get('executionStats', {})
+
+            line = "{0:<42} {1:<36} indexes: {2:<40} returned: {3} examined: {4}".format(
+                endpoint,
+                ' <- '.join(stages),
+                ', '.join(plan_indexes(plan)) or '-',
+                stats.get('nReturned', '-'),
+                stats.get('totalDocsExamined', '-')
+            )
+            if 'COLLSCAN' in stages:
+                collscans.append(endpoint)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(self.style.SUCCESS(line))
+
+        if len(collscans) != 0:
+            message = "{0} queries with a collection scan: {1}".format(len(collscans), ', '.join(collscans))
+            if options['fail_on_collscan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
@@ -0,0 +1,142 @@
+import csv
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from apps.equities.cache import API_CACHE_ENABLED, is_shared_cache, invalidate_equities, invalidate_dividends
+from apps.equities.importer import (
+    IMPORTS, ImportProgress, read_header, read_chunks, get_file_format, import_chunk, init_worker, pyarrow
+)
+
+# imports vendor files of daily bars and/or dividends (CSV or Parquet, see
+# apps/equities/importer.py) straight into MongoDB, without the REST API:
+#
+#   python manage.py import_history --equities bars.parquet --dividends dividends.csv
+#   python manage.py import_history --equities msft.csv --label MSFT --workers 8 --rejects rejects.csv
+#
+# the chunks of --chunk-size rows are validated and written by --workers
+# processes, at most two chunks per worker are read ahead. The dividend
+# chunks are written one at a time in the order of the file, since
+# upsert_dividends replaces the entries of a label with two updates that
+# must not interleave with the ones of another chunk. The completed chunks
+# are saved in the --progress file: running the same command again after an
+# interruption or a failed chunk only imports the remaining chunks (--restart
+# imports everything again)
+#
+# the cached API responses of the imported labels are invalidated when the
+# API cache is shared with the API processes (API_CACHE_LOCATION). With the
+# default LocMemCache each API process has its own cache, which this
+# command cannot reach: the API processes must be restarted after an import
+
+
+class Command(BaseCommand):
+    help = 'Imports CSV/Parquet files of daily bars and dividends with bulk upserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--equities', type=str)
+        parser.add_argument('--dividends', type=str)
+        parser.add_argument('--label', type=str, help='label of the files without a label column')
+        parser.add_argument('--chunk-size', type=int, default=50000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--progress', type=str, default='import_history.progress.json')
+        parser.add_argument('--restart', action='store_true')
+        parser.add_argument('--rejects', type=str, help='CSV file of the rejected rows')
+
+    def check_file(self, name, path, label):
+        if get_file_format(path) == 'parquet' and pyarrow is None:
+            raise CommandError("pyarrow is not installed, {0} cannot be read".format(path))
+        try:
+            header = read_header(path)
+        except OSError as e:
+            raise CommandError(str(e))
+        fields = IMPORTS[name][0]
+        missing = [field for field, kind in fields if field not in header and not (field == 'label' and label)]
+        if len(missing) != 0:
+            raise CommandError("{0}: missing columns {1}".format(path, ','.join(missing)))
+        # the label column of the file has precedence over --label
+        return [field for field, kind in fields if field in header], None if 'label' in header else label
+
+    def import_file(self, pool, name, path, label, options, progress):
+        columns, label = self.check_file(name, path, label)
+        chunk_size = options['chunk_size']
+        done = progress.start(path, chunk_size)
+        in_flight = options['workers'] * 2 if name == 'equities' else 1
+        totals = {'chunks': 0, 'skipped': 0, 'failed': 0, 'documents': 0, 'rejects': 0}
+        labels = set()
+        started = time.time()
+
+        def collect(futures):
+            for future in futures:
+                result = future.result()
+                totals['chunks'] += 1
+                totals['documents'] += result['documents']
+                totals['rejects'] += len(result['rejects'])
+                labels.update(result['labels'])
+                if self.rejects_writer is not None:
+                    self.rejects_writer.writerows((path, row, error) for row, error in result['rejects'])
+                if result['error'] is not None:
+                    totals['failed'] += 1
+                    self.stderr.write("{0} chunk {1}: {2}".format(name, result['chunk'], result['error']))
+                    continue
+                progress.complete(path, result['chunk'])
+                self.stdout.write("{0} chunk {1}: {2} rows written, {3} rejected ({4:.0f} rows/s)".format(
+                    name, result['chunk'], result['documents'], len(result['rejects']),
+                    totals['documents'] / (time.time() - started)
+                ))
+
+        pending = set()
+        for chunk, first_row, chunk_columns in read_chunks(path, columns, chunk_size, done):
+            if chunk_columns is None:
+                totals['skipped'] += 1
+                continue
+            if len(pending) >= in_flight:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending.add(pool.submit(import_chunk, name, chunk, first_row, chunk_columns, label))
+        collect(wait(pending).done)
+
+        if API_CACHE_ENABLED and is_shared_cache():
+            if name == 'equities':
+                invalidate_equities(labels)
+            else:
+                invalidate_dividends(labels)
+        self.stdout.write(self.style.SUCCESS(
+            "{0}: {1} rows written and {2} rejected in {3:.1f}s, {4} chunks skipped (already imported)".format(
+                path, totals['documents'], totals['rejects'], time.time() - started, totals['skipped']
+            )
+        ))
+        return totals['failed']
+
+    def handle(self, *args, **options):
+        files = [(name, options[name]) for name in ('equities', 'dividends') if options[name] is not None]
+        if len(files) == 0:
+            raise CommandError("nothing to import, use --equities and/or --dividends")
+        for name, path in files:
+            self.check_file(name, path, options['label'])
+
+        progress = ImportProgress(options['progress'])
+        if options['restart']:
+            progress.files = {}
+
+        rejects_file = open(options['rejects'], 'w', newline='') if options['rejects'] is not None else None
+        self.rejects_writer = csv.writer(rejects_file) if rejects_file is not None else None
+        if self.rejects_writer is not None:
+            self.rejects_writer.writerow(('file', 'row', 'error'))
+
+        # the workers open their own MongoDB connections, none is inherited
+        connections.close_all()
+        failed = 0
+        try:
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+                for name, path in files:
+                    failed += self.import_file(pool, name, path, options['label'], options, progress)
+        finally:
+            if rejects_file is not None:
+                rejects_file.close()
+
+        if not is_shared_cache():
+            self.stdout.write(self.style.WARNING(
+                "the API cache is local to each process, restart the API processes to serve the imported data"
+            ))
+        if failed != 0:
+            raise CommandError("{0} chunks failed, run the same command again to import them".format(failed))
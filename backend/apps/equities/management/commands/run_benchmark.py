@@ -0,0 +1,317 @@
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dt_time, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from apps.equities import cache
+from apps.equities.models import Equity, TickBucket
+from apps.equities.mongo import get_collection
+from apps.equities.benchmark import (
+    SYNTHETIC_PREFIX, generate_equities, generate_ticks, generate_dividends,
+    summarize, build_report, compare_reports, read_report, write_report
+)
+from apps.dividends.models import Dividend
+
+# latency percentiles and throughput of every access pattern of the
+# EquitiesViewSet, EquityDividendsViewSet and DividendsViewSet on the
+# dataset of seed_benchmark. The requests go through the Django stack in
+# process (middleware, views, serializers, MongoDB) or, with --url, over HTTP
+# to a running server (ASGI or WSGI) with --concurrency clients. The response
+# cache is disabled unless --cache is given (in process only, a server uses
+# its own API_CACHE_ENABLED), the list and detail endpoints are measured on
+# both read paths (native and orm). The ticks appended by the benchmark are
+# written to a day after the dataset and removed after the run, so the
+# dataset read by the other patterns does not grow from run to run
+#
+#   python manage.py run_benchmark --output reports/19d76d8.json
+#   python manage.py run_benchmark --url http://localhost:8000 --concurrency 16 --compare reports/main.json --fail-on-regression
+
+READ_PATHS = ('native', 'orm')
+
+
+def to_payload(document):
+    # JSON payload of the bulk upsert from a synthetic equity document
+    payload = {'label': document['label'], 'md_date': document['md_date'].date().isoformat()}
+    for field in ('market_cap', 'p_open', 'p_high', 'p_low', 'p_close'):
+        payload[field] = str(document[field].to_decimal())
+    return payload
+
+
+def get_context(seed):
+    # labels, ids and dates of the seeded dataset the requests are built from
+    synthetic = {'label': {'$regex': '^' + SYNTHETIC_PREFIX}}
+    equities = get_collection(Equity)
+    first = equities.find_one(synthetic, {'label': 1}, sort=[('label', 1)])
+    if first is None:
+        raise CommandError("No synthetic dataset, run seed_benchmark first")
+    md_dates = [document['md_date'] for document in equities.find({'label': first['label']}, {'md_date': 1}).sort('md_date', 1)]
+    last_day = md_dates[-1]
+    labels = sorted(equities.distinct('label', dict(synthetic, md_date=last_day)))
+    ticks_bucket = get_collection(TickBucket).find_one(synthetic, {'label': 1, 'bucket_start': 1}, sort=[('bucket_start', -1)])
+    tick_day = ticks_bucket['bucket_start'].date() if ticks_bucket is not None else None
+    return {
+        'seed': seed,
+        'labels': labels,
+        'days': [md_date.date() for md_date in md_dates],
+        'equity_ids': [document['id'] for document in equities.find(dict(synthetic, md_date=last_day), {'id': 1})],
+        'dividend_ids': [document['id'] for document in get_collection(Dividend).find(synthetic, {'id': 1})],
+        'dividend_labels': sorted(get_collection(Dividend).distinct('label', synthetic)),
+        'tick_labels': sorted(get_collection(TickBucket).distinct('label', synthetic)),
+        'tick_day': tick_day,
+        # the day of the appended ticks, never read by the other patterns
+        'append_day': max(tick_day or md_dates[-1].date(), md_dates[-1].date()) + timedelta(days=7)
+    }
+
+
+def pick_window(context, rng, days):
+    # [start, end] of days consecutive dates of the dataset
+    start = rng.randrange(0, max(1, len(context['days']) - days))
+    return context['days'][start], context['days'][min(len(context['days']) - 1, start + days - 1)]
+
+
+def bulk_upsert_body(context, rng):
+    label = rng.choice(context['labels'])
+    documents = generate_equities(context['seed'], label, context['days'], None)
+    start = rng.randrange(0, max(1, len(documents) - 1000))
+    return [to_payload(document) for document in documents[start:start + 1000]]
+
+
+def remove_appended_ticks(context):
+    # the buckets of the ticks appended by equities_ticks_append_100
+    start = datetime.combine(context['append_day'], dt_time())
+    get_collection(TickBucket).delete_many({
+        'label': {'$regex': '^' + SYNTHETIC_PREFIX},
+        'bucket_start': {'$gte': start, '$lt': start + timedelta(days=1)}
+    })
+
+
+def ticks_body(context, rng):
+    label = rng.choice(context['tick_labels'] or context['labels'])
+    day = context['append_day']
+    ticks = generate_ticks(rng.random(), label, day, 100)
+    return [{
+        'label': label,
+        'md_date': day.isoformat(),
+        'tickdata': [{'timestamp': timestamp.isoformat(), 'p_mkt': price} for label, timestamp, price in ticks]
+    }]
+
+
+def dividends_body(context, rng):
+    entries = []
+    for label in rng.sample(context['labels'], min(100, len(context['labels']))):
+        entry = generate_dividends(context['seed'], label, context['days'])
+        if entry is not None:
+            entries.append({'label': label, 'dividends': [
+                {'ex_div_date': dividend['ex_div_date'].isoformat(), 'dividend': dividend['dividend']}
+                for dividend in entry['dividends']
+            ]})
+    return entries
+
+
+# (name, method, path, build) where build(context, rng) returns the url and
+# the body of a request. The names of PATTERNS_WITH_READ_PATH are measured
+# once per read path
+PATTERNS = [
+    ('equities_list_label', 'GET', '/equities/?label=',
+        lambda c, r: ('/equities/?label={0}'.format(r.choice(c['labels'])), None)),
+    ('equities_list_label_desc', 'GET', '/equities/?label=&ordering=-md_date',
+        lambda c, r: ('/equities/?label={0}&ordering=-md_date'.format(r.choice(c['labels'])), None)),
+    ('equities_list_label_page', 'GET', '/equities/?label=&page_size=1000',
+        lambda c, r: ('/equities/?label={0}&page_size=1000'.format(r.choice(c['labels'])), None)),
+    ('equities_list_fields', 'GET', '/equities/?label=&fields=md_date,p_close',
+        lambda c, r: ('/equities/?label={0}&fields=md_date,p_close'.format(r.choice(c['labels'])), None)),
+    ('equities_list_embed', 'GET', '/equities/?label=&embed=security',
+        lambda c, r: ('/equities/?label={0}&embed=security'.format(r.choice(c['labels'])), None)),
+    ('equities_list_md_date', 'GET', '/equities/?md_date=',
+        lambda c, r: ('/equities/?md_date={0}'.format(r.choice(c['days'])), None)),
+    ('equities_list_label_md_date', 'GET', '/equities/?label=&md_date=',
+        lambda c, r: ('/equities/?label={0}&md_date={1}'.format(r.choice(c['labels']), r.choice(c['days'])), None)),
+    ('equities_search', 'GET', '/equities/?search=',
+        lambda c, r: ('/equities/?search={0}'.format(r.choice(c['labels'])[:6]), None)),
+    ('equities_retrieve', 'GET', '/equities/:id/',
+        lambda c, r: ('/equities/{0}/'.format(r.choice(c['equity_ids'])), None)),
+    ('equities_range_1y', 'GET', '/equities/range/?label=&start=&end=',
+        lambda c, r: ('/equities/range/?label={0}&start={1}&end={2}'.format(r.choice(c['labels']), *pick_window(c, r, 252)), None)),
+    ('equities_range_all', 'GET', '/equities/range/?label=',
+        lambda c, r: ('/equities/range/?label={0}'.format(r.choice(c['labels'])), None)),
+    ('equities_resample_1w', 'GET', '/equities/resample/?label=&interval=1w',
+        lambda c, r: ('/equities/resample/?label={0}&interval=1w'.format(r.choice(c['labels'])), None)),
+    ('equities_resample_1mo', 'GET', '/equities/resample/?label=&interval=1mo',
+        lambda c, r: ('/equities/resample/?label={0}&interval=1mo'.format(r.choice(c['labels'])), None)),
+    ('equities_ticks_day', 'GET', '/equities/ticks/?label=&start=&end=',
+        lambda c, r: ('/equities/ticks/?label={0}&start={1}T00:00:00Z&end={2}T00:00:00Z'.format(
+            r.choice(c['tick_labels'] or c['labels']), c['tick_day'] or c['days'][-1],
+            (c['tick_day'] or c['days'][-1]) + timedelta(days=1)), None)),
+    ('equities_summary_50', 'GET', '/equities/summary/?labels=',
+        lambda c, r: ('/equities/summary/?labels={0}'.format(','.join(r.sample(c['labels'], min(50, len(c['labels']))))), None)),
+    ('equity_dividends', 'GET', '/equities/:id/dividends/',
+        lambda c, r: ('/equities/{0}/dividends/'.format(r.choice(c['equity_ids'])), None)),
+    ('dividends_list_label', 'GET', '/dividends/?label=',
+        lambda c, r: ('/dividends/?label={0}'.format(r.choice(c['dividend_labels'] or c['labels'])), None)),
+    ('dividends_list_range_1mo', 'GET', '/dividends/?ex_div_date__gte=&ex_div_date__lte=',
+        lambda c, r: ('/dividends/?ex_div_date__gte={0}&ex_div_date__lte={1}'.format(*pick_window(c, r, 21)), None)),
+    ('dividends_calendar_week', 'GET', '/dividends/calendar/?start=&end=',
+        lambda c, r: ('/dividends/calendar/?start={0}&end={1}'.format(*pick_window(c, r, 5)), None)),
+    ('dividends_retrieve', 'GET', '/dividends/:id/',
+        lambda c, r: ('/dividends/{0}/'.format(r.choice(c['dividend_ids'] or [0])), None)),
+    ('equities_patch', 'PATCH', '/equities/:id/',
+        lambda c, r: ('/equities/{0}/'.format(r.choice(c['equity_ids'])), {'p_close': round(r.uniform(5, 500), 6)})),
+    ('equities_bulk_upsert_1000', 'POST', '/equities/bulk/',
+        lambda c, r: ('/equities/bulk/', bulk_upsert_body(c, r))),
+    ('equities_ticks_append_100', 'POST', '/equities/ticks/',
+        lambda c, r: ('/equities/ticks/', ticks_body(c, r))),
+    ('dividends_bulk_upsert_100', 'POST', '/dividends/bulk/',
+        lambda c, r: ('/dividends/bulk/', dividends_body(c, r))),
+]
+
+PATTERNS_WITH_READ_PATH = (
+    'equities_list_label', 'equities_list_label_desc', 'equities_list_label_page', 'equities_list_fields',
+    'equities_list_embed', 'equities_list_md_date', 'equities_list_label_md_date', 'equities_search',
+    'equities_retrieve', 'equity_dividends', 'dividends_list_label', 'dividends_retrieve'
+)
+
+
+class InProcessSender:
+    # requests through the Django stack without a server
+    def __init__(self):
+        self.client = Client(HTTP_HOST='localhost')
+
+    def __call__(self, method, url, body):
+        data = json.dumps(body) if body is not None else ''
+        response = self.client.generic(method, url, data, content_type='application/json', HTTP_ACCEPT='application/json')
+        return response.status_code
+
+
+class HTTPSender:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def __call__(self, method, url, body):
+        request = urllib.request.Request(
+            self.base_url + url, method=method,
+            data=json.dumps(body).encode() if body is not None else None,
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class Command(BaseCommand):
+    help = 'Measures the latency and throughput of the API access patterns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--url', type=str)
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--patterns', type=str)
+        parser.add_argument('--cache', action='store_true')
+        parser.add_argument('--output', type=str)
+        parser.add_argument('--compare', type=str)
+        parser.add_argument('--threshold', type=float, default=0.2)
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def get_patterns(self, options):
+        selected = options['patterns'].split(',') if options['patterns'] else None
+        patterns = []
+        for name, method, path, build in PATTERNS:
+            if selected is not None and name not in selected:
+                continue
+            if name in PATTERNS_WITH_READ_PATH:
+                for read_path in READ_PATHS:
+                    patterns.append(('{0}[{1}]'.format(name, read_path), method, path, build, read_path))
+            else:
+                patterns.append((name, method, path, build, None))
+        return patterns
+
+    def run_pattern(self, send, pattern, context, options):
+        name, method, path, build, read_path = pattern
+        # the requests are built before the measure, with a generator per pattern
+        rng = random.Random('{0}:{1}'.format(options['seed'], name))
+        requests = []
+        for i in range(options['warmup'] + options['iterations']):
+            url, body = build(context, rng)
+            if read_path is not None:
+                url += ('&' if '?' in url else '?') + 'read_path=' + read_path
+            requests.append((url, body))
+        for url, body in requests[:options['warmup']]:
+            send(method, url, body)
+
+        def measure(request):
+            started = time.perf_counter()
+            status = send(method, request[0], request[1])
+            return time.perf_counter() - started, status
+
+        started = time.perf_counter()
+        if options['concurrency'] > 1:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                measures = list(executor.map(measure, requests[options['warmup']:]))
+        else:
+            measures = [measure(request) for request in requests[options['warmup']:]]
+        elapsed = time.perf_counter() - started
+
+        errors = sum(1 for latency, status in measures if status >= 400)
+        return summarize(name, method, path, [latency for latency, status in measures], errors, elapsed)
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations should be at least 1")
+        if options['url'] is None and options['concurrency'] > 1:
+            raise CommandError("--concurrency requires --url")
+        if options['url'] is not None and options['cache']:
+            raise CommandError("--cache has no effect with --url, the server uses its own API_CACHE_ENABLED")
+        context = get_context(options['seed'])
+        send = HTTPSender(options['url']) if options['url'] is not None else InProcessSender()
+
+        # DEBUG keeps every query in memory, which is not what is measured
+        if options['url'] is None:
+            cache.API_CACHE_ENABLED = options['cache']
+        results = []
+        remove_appended_ticks(context)
+        try:
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost']):
+                for pattern in self.get_patterns(options):
+                    result = self.run_pattern(send, pattern, context, options)
+                    results.append(result)
+                    line = "{name:<44} p50 {p50_ms:>9.3f}ms  p90 {p90_ms:>9.3f}ms  p99 {p99_ms:>9.3f}ms  {throughput_rps:>9.1f} req/s  errors {errors}".format(**result)
+                    self.stdout.write(self.style.ERROR(line) if result['errors'] != 0 else line)
+        finally:
+            remove_appended_ticks(context)
+
+        dataset = {
+            'labels': len(context['labels']),
+            'days': len(context['days']),
+            'equities': get_collection(Equity).estimated_document_count(),
+            'tick_buckets': get_collection(TickBucket).estimated_document_count(),
+            'dividends': get_collection(Dividend).estimated_document_count()
+        }
+        report_options = {key: options[key] for key in ('iterations', 'warmup', 'seed', 'concurrency', 'cache')}
+        report_options['target'] = options['url'] or 'in-process'
+        # the cache of a server is not known
+        if options['url'] is not None:
+            report_options['cache'] = None
+        report = build_report('api', dataset, report_options, results)
+        if options['output'] is not None:
+            write_report(options['output'], report)
+            self.stdout.write("Report written to {0}".format(options['output']))
+
+        if options['compare'] is not None:
+            rows, regressions = compare_reports(read_report(options['compare']), report, options['threshold'])
+            for name, before, after, change in rows:
+                line = "{0:<44} p50 {1:>9.3f}ms -> {2:>9.3f}ms  {3:+.1%}".format(name, before, after, change)
+                self.stdout.write(self.style.ERROR(line) if name in regressions else line)
+            if len(regressions) != 0:
+                message = "{0} regressions: {1}".format(len(regressions), ', '.join(regressions))
+                if options['fail_on_regression']:
+                    raise CommandError(message)
+                self.stdout.write(self.style.WARNING(message))
@@ -0,0 +1,92 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.equities.models import Equity, TickBucket
+from apps.equities.mongo import get_collection, allocate_ids, bulk_upsert
+from apps.equities.tickstore import write_ticks
+from apps.equities.benchmark import (
+    SYNTHETIC_PREFIX, get_labels, get_days, generate_equities, generate_security,
+    generate_dividends, generate_ticks
+)
+from apps.dividends.models import Dividend
+from apps.dividends.dividendstore import upsert_dividends
+from apps.securities.models import Security
+
+# seeds the database with the deterministic synthetic dataset of the
+# benchmarks (see apps/equities/benchmark.py): daily bars, securities and
+# dividends of --labels labels over --days weekdays, and --ticks-per-day
+# ticks for the last --tick-days days of the first --tick-labels labels
+#
+#   python manage.py seed_benchmark --labels 2000 --days 2500
+#   python manage.py seed_benchmark --clear
+#
+# use a dedicated database, the synthetic labels start with SYN and --clear
+# removes only them
+
+
+class Command(BaseCommand):
+    help = 'Seeds the synthetic dataset of the benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--labels', type=int, default=2000)
+        parser.add_argument('--days', type=int, default=2500)
+        parser.add_argument('--tick-labels', type=int, default=100)
+        parser.add_argument('--tick-days', type=int, default=5)
+        parser.add_argument('--ticks-per-day', type=int, default=390)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--clear', action='store_true')
+
+    def clear(self):
+        query = {'label': {'$regex': '^' + SYNTHETIC_PREFIX}}
+        for model in (Equity, TickBucket, Dividend, Security):
+            result = get_collection(model).delete_many(query)
+            self.stdout.write("{0}: {1} documents deleted".format(model._meta.db_table, result.deleted_count))
+
+    def insert_equities(self, documents):
+        next_id = allocate_ids(Equity, len(documents))
+        for i, document in enumerate(documents):
+            document['id'] = next_id + i
+        get_collection(Equity).insert_many(documents, ordered=False)
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.clear()
+            return
+
+        labels = get_labels(options['labels'])
+        days = get_days(options['days'])
+        date_time = timezone.now()
+        started = time.time()
+
+        # existing synthetic documents would break the unique label/md_date index
+        if get_collection(Equity).find_one({'label': {'$regex': '^' + SYNTHETIC_PREFIX}}, {'_id': 1}) is not None:
+            self.stdout.write(self.style.WARNING("Synthetic documents found, run with --clear first"))
+            return
+
+        bulk_upsert(Security, [generate_security(label) for label in labels], ('label',))
+        upsert_dividends(Dividend, [
+            entry for entry in (generate_dividends(options['seed'], label, days) for label in labels) if entry is not None
+        ])
+
+        pending = []
+        count = 0
+        for label in labels:
+            pending.extend(generate_equities(options['seed'], label, days, date_time))
+            if len(pending) >= options['batch_size']:
+                self.insert_equities(pending)
+                count += len(pending)
+                pending = []
+                self.stdout.write("{0} equities inserted ({1:.0f}/s)".format(count, count / (time.time() - started)))
+        if len(pending) != 0:
+            self.insert_equities(pending)
+            count += len(pending)
+
+        ticks = 0
+        for label in labels[:options['tick_labels']]:
+            for day in days[-options['tick_days']:]:
+                ticks += write_ticks(TickBucket, generate_ticks(options['seed'], label, day, options['ticks_per_day']))['ticks']
+
+        self.stdout.write(self.style.SUCCESS(
+            "{0} labels, {1} equities, {2} ticks seeded in {3:.1f}s".format(len(labels), count, ticks, time.time() - started)
+        ))
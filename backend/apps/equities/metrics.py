@@ -0,0 +1,238 @@
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, Http404
+from pymongo import monitoring
+
+# common/ at the root of the repository, shared with the feeders
+sys.path.append(str(settings.BASE_DIR.parent))
+from common.prometheus import Counter, Histogram, render_metrics as render_registry
+
+# timings of the hot paths exposed in the Prometheus text format on
+# /metrics/ (only to METRICS_ALLOWED_IPS, local by default)
+#
+# MetricsMiddleware measures each request and splits its time in phases:
+#
+#   djongo     SQL parsing and translation to MongoDB of the ORM queries
+#              (DB execution wrapper, without the MongoDB time inside it)
+#   mongo      MongoDB commands, ORM and pymongo (command listener)
+#   serialize  serializers and native representations (Decimal128, dates)
+#   render     JSON rendering of the response
+#   other      the rest: views, filters, pagination, conversion of the
+#              djongo results to models, middlewares
+#
+#   django_request_duration_seconds{endpoint, method}
+#   django_request_phase_seconds{endpoint, phase}
+#   django_requests_total{endpoint, method, status}
+#   django_db_queries_total{endpoint}
+#   mongo_command_duration_seconds{command, outcome}
+#
+# the endpoint is the URL name (equity-list, equity-range, dividend-calendar,
+# ...). With METRICS_PROFILE_RATE a fraction of the requests is run under
+# cProfile and the profiles of the ones slower than
+# METRICS_PROFILE_MIN_DURATION seconds are written to METRICS_PROFILE_DIR
+# (python -m pstats <file>). The metrics are kept per process, each
+# process of a deployment is scraped on its own
+
+METRICS_ENABLED = getattr(settings, 'METRICS_ENABLED', True)
+METRICS_ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+METRICS_PROFILE_RATE = getattr(settings, 'METRICS_PROFILE_RATE', 0)
+METRICS_PROFILE_MIN_DURATION = getattr(settings, 'METRICS_PROFILE_MIN_DURATION', 0.5)
+METRICS_PROFILE_DIR = getattr(settings, 'METRICS_PROFILE_DIR', 'profiles')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PHASES = ('djongo', 'mongo', 'serialize', 'render', 'other')
+
+
+REGISTRY = []
+
+REQUEST_DURATION = Histogram('django_request_duration_seconds', 'Duration of the requests', ('endpoint', 'method'), DEFAULT_BUCKETS, REGISTRY)
+REQUEST_PHASE = Histogram('django_request_phase_seconds', 'Time of the requests spent in each phase', ('endpoint', 'phase'), DEFAULT_BUCKETS, REGISTRY)
+REQUESTS = Counter('django_requests_total', 'Requests by status code', ('endpoint', 'method', 'status'), REGISTRY)
+DB_QUERIES = Counter('django_db_queries_total', 'ORM queries executed', ('endpoint',), REGISTRY)
+MONGO_COMMAND_DURATION = Histogram('mongo_command_duration_seconds', 'Duration of the MongoDB commands', ('command', 'outcome'), DEFAULT_BUCKETS, REGISTRY)
+PROFILES = Counter('django_request_profiles_total', 'Request profiles written', ('endpoint',), REGISTRY)
+
+
+def render_metrics():
+    return render_registry(REGISTRY)
+
+
+#=================================================================================
+# Phases of the current request
+#=================================================================================
+state = threading.local()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.active = set()
+        self.queries = 0
+
+
+def get_timings():
+    # timings of the request of the current thread, None outside of a request
+    return getattr(state, 'timings', None)
+
+
+class phase:
+    # adds the time of the block to a phase of the current request, the
+    # blocks nested in a block of the same phase are not counted twice and
+    # the queries run in the block (e.g. the securities read while
+    # serializing with ?embed=security) stay in the djongo/mongo phases
+    # with phase('serialize'):
+    #     data = [to_representation(Equity, document) for document in documents]
+    def __init__(self, name):
+        self.name = name
+        self.timings = None
+
+    def __enter__(self):
+        timings = get_timings()
+        if timings is not None and self.name not in timings.active:
+            timings.active.add(self.name)
+            self.timings = timings
+            self.db_before = timings.phases['djongo'] + timings.phases['mongo']
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            elapsed = time.perf_counter() - self.started
+            db = self.timings.phases['djongo'] + self.timings.phases['mongo'] - self.db_before
+            self.timings.phases[self.name] += max(0, elapsed - db)
+            self.timings.active.discard(self.name)
+            self.timings = None
+        return False
+
+
+class TimedSerializerMixin:
+    # serializer mixin: to_representation is counted in the serialize phase
+    def to_representation(self, instance):
+        with phase('serialize'):
+            return super().to_representation(instance)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    # published in the thread running the command, so the time is added
+    # to the request of the thread (the Motor commands of the async API
+    # are only counted in mongo_command_duration_seconds)
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.record(event, 'success')
+
+    def failed(self, event):
+        self.record(event, 'failure')
+
+    def record(self, event, outcome):
+        seconds = event.duration_micros / 1000000
+        MONGO_COMMAND_DURATION.observe((event.command_name, outcome), seconds)
+        timings = get_timings()
+        if timings is not None:
+            timings.phases['mongo'] += seconds
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    # DB execution wrapper of the ORM queries: the djongo time is the time of
+    # the execution without the MongoDB commands it runs
+    timings = get_timings()
+    if timings is None:
+        return execute(sql, params, many, context)
+    mongo_before = timings.phases['mongo']
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        timings.phases['djongo'] += max(0, elapsed - (timings.phases['mongo'] - mongo_before))
+        timings.queries += 1
+
+
+# the listeners are only given to the MongoClients created after register()
+# (djongo and Motor create them on the first query)
+if METRICS_ENABLED:
+    monitoring.register(MongoCommandListener())
+
+
+#=================================================================================
+# Middleware
+#=================================================================================
+def get_endpoint(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.url_name or 'unnamed'
+
+
+profile_lock = threading.Lock()
+
+
+class MetricsMiddleware:
+    # first middleware of MIDDLEWARE: the time of the other middlewares is
+    # counted in the request and its template responses (DRF) are rendered
+    # last in process_template_response
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not METRICS_ENABLED or request.path == '/metrics/':
+            return self.get_response(request)
+
+        # one profiled request at a time, a profiler is per process
+        profiler = None
+        if METRICS_PROFILE_RATE > 0 and random.random() < METRICS_PROFILE_RATE and profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+
+        state.timings = RequestTimings()
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            with connections['default'].execute_wrapper(execute_wrapper):
+                response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profile_lock.release()
+            duration = time.perf_counter() - started
+            timings = state.timings
+            state.timings = None
+
+        endpoint = get_endpoint(request)
+        timings.phases['other'] = max(0, duration - sum(timings.phases.values()))
+        REQUEST_DURATION.observe((endpoint, request.method), duration)
+        for name, seconds in timings.phases.items():
+            REQUEST_PHASE.observe((endpoint, name), seconds)
+        REQUESTS.inc((endpoint, request.method, str(response.status_code)))
+        if timings.queries != 0:
+            DB_QUERIES.inc((endpoint,), timings.queries)
+        if profiler is not None and duration >= METRICS_PROFILE_MIN_DURATION:
+            self.write_profile(profiler, endpoint, duration)
+        return response
+
+    def process_template_response(self, request, response):
+        with phase('render'):
+            response.render()
+        return response
+
+    def write_profile(self, profiler, endpoint, duration):
+        os.makedirs(METRICS_PROFILE_DIR, exist_ok=True)
+        path = os.path.join(METRICS_PROFILE_DIR, '{0}-{1}-{2:.0f}ms.prof'.format(
+            time.strftime('%Y%m%dT%H%M%S'), endpoint.replace(':', '_'), duration * 1000
+        ))
+        profiler.dump_stats(path)
+        PROFILES.inc((endpoint,))
+
+
+def metrics_view(request):
+    # GET /metrics/ for the local Prometheus scraper
+    if not METRICS_ENABLED or request.META.get('REMOTE_ADDR') not in METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,124 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import djongo.models.fields
+from datetime import datetime, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from pymongo import ReturnDocument, UpdateOne
+
+# the bucketing of the tick store (apps/equities/tickstore.py) as it was when
+# the buckets were introduced, frozen here so that later changes of the tick
+# store or of its settings do not change what this migration writes
+BUCKET_SECONDS = 3600
+BUCKET_SIZE = 1000
+
+
+def to_utc(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = parse_datetime(timestamp)
+    if timezone.is_naive(timestamp):
+        return timezone.make_aware(timestamp, timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def get_bucket_start(timestamp):
+    epoch = int(timestamp.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % BUCKET_SECONDS, tz=timezone.utc)
+
+
+def allocate_ids(database, collection_name, count):
+    # ids reserved from the djongo AutoField sequence of the collection
+    schema = database['__schema__'].find_one_and_update(
+        {'name': collection_name, 'auto': {'$exists': True}},
+        {'$inc': {'auto.seq': count}},
+        return_document=ReturnDocument.AFTER
+    )
+    return schema['auto']['seq'] - count + 1
+
+
+def write_ticks(database, collection_name, ticks):
+    # (label, timestamp, price) ticks appended to their buckets, grouped by
+    # bucket with one $push/$each upserting the bucket
+    buckets = {}
+    for label, timestamp, price in ticks:
+        timestamp = to_utc(timestamp)
+        buckets.setdefault((label, get_bucket_start(timestamp)), []).append((timestamp, float(price)))
+
+    groups = []
+    for (label, bucket_start), bucket_ticks in buckets.items():
+        bucket_ticks.sort()
+        for i in range(0, len(bucket_ticks), BUCKET_SIZE):
+            groups.append((label, bucket_start, bucket_ticks[i:i + BUCKET_SIZE]))
+    if len(groups) == 0:
+        return
+
+    next_id = allocate_ids(database, collection_name, len(groups))
+    operations = []
+    for label, bucket_start, group in groups:
+        prices = [price for timestamp, price in group]
+        operations.append(UpdateOne(
+            {'label': label, 'bucket_start': bucket_start, 'count': {'$lte': BUCKET_SIZE - len(group)}},
+            {
+                '$push': {
+                    'timestamps': {'$each': [timestamp for timestamp, price in group]},
+                    'prices': {'$each': prices}
+                },
+                '$inc': {'count': len(group)},
+                '$min': {'p_low': min(prices)},
+                '$max': {'p_high': max(prices)},
+                '$setOnInsert': {'id': next_id, 'bucket_end': bucket_start + timedelta(seconds=BUCKET_SECONDS)}
+            },
+            upsert=True
+        ))
+        next_id += 1
+    database[collection_name].bulk_write(operations, ordered=False)
+
+
+def move_tickdata_to_buckets(apps, schema_editor):
+    # the tickdata of every daily document is written to the tick buckets
+    # one document at a time before the field is removed
+    Equity = apps.get_model('equities', 'Equity')
+    TickBucket = apps.get_model('equities', 'TickBucket')
+    # the djongo connection is the pymongo Database object
+    schema_editor.connection.ensure_connection()
+    database = schema_editor.connection.connection
+    equities = database[Equity._meta.db_table].find(
+        {'tickdata.0': {'$exists': True}},
+        {'label': 1, 'tickdata': 1}
+    )
+    for equity in equities:
+        ticks = [
+            (equity['label'], tick['timestamp'], tick['p_mkt'])
+            for tick in equity['tickdata']
+        ]
+        write_ticks(database, TickBucket._meta.db_table, ticks)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equities', '0002_auto_20210825_1725'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TickBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=20)),
+                ('bucket_start', models.DateTimeField()),
+                ('bucket_end', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('p_low', models.FloatField(null=True)),
+                ('p_high', models.FloatField(null=True)),
+                ('timestamps', djongo.models.fields.JSONField(default=list)),
+                ('prices', djongo.models.fields.JSONField(default=list)),
+            ],
+        ),
+        migrations.RunPython(move_tickdata_to_buckets, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='equity',
+            name='tickdata',
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+# djongo does not reliably translate AddIndex/AddConstraint into MongoDB indexes
+# so the indexes are created with pymongo and the operations only change the state.
+# The pymongo helpers are frozen here, as the ones of 0003_tickbucket
+
+EQUITY_INDEXES = [
+    ('unique_label_md_date', [('label', 1), ('md_date', 1)], {'unique': True}),
+    ('equity_md_date_idx', [('md_date', 1)], {}),
+]
+
+TICKBUCKET_INDEXES = [
+    ('tickbucket_label_start_idx', [('label', 1), ('bucket_start', 1)], {}),
+]
+
+
+def get_database(schema_editor):
+    # the djongo connection is the pymongo Database object
+    schema_editor.connection.ensure_connection()
+    return schema_editor.connection.connection
+
+
+def create_indexes(collection, indexes):
+    # indexes is a list of (name, keys, options) with pymongo keys,
+    # create_index does nothing if the same index already exists
+    for name, keys, options in indexes:
+        collection.create_index(keys, name=name, **options)
+
+
+def drop_indexes(collection, names):
+    existing = collection.index_information()
+    for name in names:
+        if name in existing:
+            collection.drop_index(name)
+
+
+def forwards(apps, schema_editor):
+    Equity = apps.get_model('equities', 'Equity')
+    TickBucket = apps.get_model('equities', 'TickBucket')
+    database = get_database(schema_editor)
+
+    # the unique index cannot be built over duplicated label/md_date documents
+    duplicates = list(database[Equity._meta.db_table].aggregate([
+        {'$group': {'_id': {'label': '$label', 'md_date': '$md_date'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+        {'$limit': 10}
+    ], allowDiskUse=True))
+    if len(duplicates) != 0:
+        raise RuntimeError(
+            "Duplicated label/md_date Equity documents must be removed first: {0}".format(
+                ', '.join('{0} {1}'.format(d['_id']['label'], d['_id']['md_date'].date()) for d in duplicates)
+            )
+        )
+
+    create_indexes(database[Equity._meta.db_table], EQUITY_INDEXES)
+    create_indexes(database[TickBucket._meta.db_table], TICKBUCKET_INDEXES)
+
+
+def backwards(apps, schema_editor):
+    database = get_database(schema_editor)
+    drop_indexes(
+        database[apps.get_model('equities', 'Equity')._meta.db_table],
+        [name for name, keys, options in EQUITY_INDEXES]
+    )
+    drop_indexes(
+        database[apps.get_model('equities', 'TickBucket')._meta.db_table],
+        [name for name, keys, options in TICKBUCKET_INDEXES]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equities', '0003_tickbucket'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(forwards, backwards),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='equity',
+                    constraint=models.UniqueConstraint(fields=('label', 'md_date'), name='unique_label_md_date'),
+                ),
+                migrations.AddIndex(
+                    model_name='equity',
+                    index=models.Index(fields=['md_date'], name='equity_md_date_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='tickbucket',
+                    index=models.Index(fields=['label', 'bucket_start'], name='tickbucket_label_start_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:20
+
+from django.db import migrations
+from django.utils import timezone
+from pymongo import ReturnDocument, UpdateOne
+
+SECURITY_FIELDS = ('description', 'industry', 'country', 'currency', 'market', 'exchange')
+
+# the pymongo helpers are frozen here, as the ones of 0003_tickbucket
+
+
+def get_database(schema_editor):
+    # the djongo connection is the pymongo Database object
+    schema_editor.connection.ensure_connection()
+    return schema_editor.connection.connection
+
+
+def allocate_ids(database, collection_name, count):
+    # ids reserved from the djongo AutoField sequence of the collection
+    schema = database['__schema__'].find_one_and_update(
+        {'name': collection_name, 'auto': {'$exists': True}},
+        {'$inc': {'auto.seq': count}},
+        return_document=ReturnDocument.AFTER
+    )
+    return schema['auto']['seq'] - count + 1
+
+
+def upsert_securities(database, collection_name, securities):
+    # matched on the label, the ids are only reserved for the new labels
+    collection = database[collection_name]
+    existing = set(document['label'] for document in collection.find(
+        {'label': {'$in': [security['label'] for security in securities]}}, {'label': 1}
+    ))
+    new_labels = [security['label'] for security in securities if security['label'] not in existing]
+    next_id = allocate_ids(database, collection_name, len(new_labels)) if len(new_labels) != 0 else None
+    operations = []
+    for security in securities:
+        security = dict(security, date_time=timezone.now())
+        update = {'$set': security}
+        if security['label'] not in existing:
+            update['$setOnInsert'] = {'id': next_id}
+            next_id += 1
+        operations.append(UpdateOne({'label': security['label']}, update, upsert=True))
+    if len(operations) != 0:
+        collection.bulk_write(operations, ordered=False)
+
+
+def copy_security_fields(apps, schema_editor):
+    # one Security for each label with the fields of its most recent Equity
+    Equity = apps.get_model('equities', 'Equity')
+    Security = apps.get_model('securities', 'Security')
+    database = get_database(schema_editor)
+
+    group = {'_id': '$label'}
+    for field in SECURITY_FIELDS:
+        group[field] = {'$first': '$' + field}
+    securities = []
+    for security in database[Equity._meta.db_table].aggregate([
+        {'$sort': {'label': 1, 'md_date': -1}},
+        {'$group': group}
+    ], allowDiskUse=True):
+        security['label'] = security.pop('_id')
+        securities.append(security)
+    upsert_securities(database, Security._meta.db_table, securities)
+
+
+def copy_security_fields_back(apps, schema_editor):
+    # the fields are restored on every Equity of the label
+    Equity = apps.get_model('equities', 'Equity')
+    Security = apps.get_model('securities', 'Security')
+    database = get_database(schema_editor)
+
+    equities = database[Equity._meta.db_table]
+    for security in database[Security._meta.db_table].find({}, {'_id': 0, 'label': 1, **{f: 1 for f in SECURITY_FIELDS}}):
+        label = security.pop('label')
+        equities.update_many({'label': label}, {'$set': security})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equities', '0004_indexes'),
+        ('securities', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_security_fields, copy_security_fields_back),
+        migrations.RemoveField(
+            model_name='equity',
+            name='country',
+        ),
+        migrations.RemoveField(
+            model_name='equity',
+            name='currency',
+        ),
+        migrations.RemoveField(
+            model_name='equity',
+            name='description',
+        ),
+        migrations.RemoveField(
+            model_name='equity',
+            name='exchange',
+        ),
+        migrations.RemoveField(
+            model_name='equity',
+            name='industry',
+        ),
+        migrations.RemoveField(
+            model_name='equity',
+            name='market',
+        ),
+    ]
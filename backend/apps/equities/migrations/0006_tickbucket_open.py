@@ -0,0 +1,69 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+# only the last bucket of an interval receives the new ticks (open: true),
+# with a partial unique index on label/bucket_start of the open buckets so
+# that concurrent writers cannot open two buckets of the same interval
+# (see apps/equities/tickstore.py). The existing buckets are closed, the
+# next ticks of their interval open a new bucket. As in 0004_indexes the
+# index is created with pymongo and the operations only change the state
+
+OPEN_INDEXES = [
+    ('tickbucket_open_uniq', [('label', 1), ('bucket_start', 1)], {
+        'unique': True,
+        'partialFilterExpression': {'open': True}
+    }),
+]
+
+
+def get_database(schema_editor):
+    # the djongo connection is the pymongo Database object
+    schema_editor.connection.ensure_connection()
+    return schema_editor.connection.connection
+
+
+def forwards(apps, schema_editor):
+    TickBucket = apps.get_model('equities', 'TickBucket')
+    collection = get_database(schema_editor)[TickBucket._meta.db_table]
+    collection.update_many({'open': {'$exists': False}}, {'$set': {'open': False}})
+    for name, keys, options in OPEN_INDEXES:
+        collection.create_index(keys, name=name, **options)
+
+
+def backwards(apps, schema_editor):
+    TickBucket = apps.get_model('equities', 'TickBucket')
+    collection = get_database(schema_editor)[TickBucket._meta.db_table]
+    existing = collection.index_information()
+    for name, keys, options in OPEN_INDEXES:
+        if name in existing:
+            collection.drop_index(name)
+    collection.update_many({}, {'$unset': {'open': ''}})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equities', '0005_security_reference'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(forwards, backwards),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='tickbucket',
+                    name='open',
+                    field=models.BooleanField(default=True),
+                ),
+                migrations.AddConstraint(
+                    model_name='tickbucket',
+                    constraint=models.UniqueConstraint(
+                        condition=models.Q(open=True), fields=('label', 'bucket_start'), name='tickbucket_open_uniq'
+                    ),
+                ),
+            ],
+        ),
+    ]
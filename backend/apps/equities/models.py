@@ -4,6 +4,8 @@ from django.utils import timezone
 from djongo import models as djongo_models
 
 # Create your models here.
+# the ticks are now stored in TickBucket documents, TickData is kept
+# since it is referenced by the initial migration of the Equity tickdata
 class TickData(models.Model):
     timestamp = models.DateTimeField(default=timezone.now())
     p_mkt = models.FloatField()
@@ -14,26 +16,51 @@ class TickData(models.Model):
 class Equity(models.Model):
     date_time = models.DateTimeField(default=timezone.now())
     md_date = models.DateField(default=date.fromisoformat('1900-01-01'))
+    # the reference data of the label (description, industry, ...) is stored
+    # once in apps.securities.models.Security
     label = models.CharField(max_length=20)
-    description = models.CharField(max_length=255)
-    industry = models.CharField(max_length=255)
-    country = models.CharField(max_length=50)
-    currency = models.CharField(max_length=5)
-    market = models.CharField(max_length=50)
-    exchange = models.CharField(max_length=20)
     market_cap = models.DecimalField(max_digits=22, decimal_places=6)
     p_high = models.DecimalField(max_digits=16, decimal_places=6)
     p_close = models.DecimalField(max_digits=16, decimal_places=6)
     p_low = models.DecimalField(max_digits=16, decimal_places=6)
     p_open = models.DecimalField(max_digits=16, decimal_places=6)
 
-    tickdata = djongo_models.ArrayField(
-        model_container=TickData
-    )
+    class Meta:
+        # the unique label/md_date index also serves the label filter ordered by md_date
+        constraints = [
+            models.UniqueConstraint(fields=['label', 'md_date'], name='unique_label_md_date')
+        ]
+        indexes = [
+            models.Index(fields=['md_date'], name='equity_md_date_idx')
+        ]
+
+    def __str__(self):
+        return self.label
 
-    constraints = [
-        models.UniqueConstraint(fields=['label', 'md_date'], name='unique_label_md_date')
-    ]
+
+# intraday ticks of a label for a fixed time interval (see tickstore.py)
+# timestamps and prices are parallel arrays written with pymongo, only the
+# last bucket of an interval is open to new ticks
+class TickBucket(models.Model):
+    label = models.CharField(max_length=20)
+    bucket_start = models.DateTimeField()
+    bucket_end = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    p_low = models.FloatField(null=True)
+    p_high = models.FloatField(null=True)
+    timestamps = djongo_models.JSONField(default=list)
+    prices = djongo_models.JSONField(default=list)
+    open = models.BooleanField(default=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['label', 'bucket_start'], condition=models.Q(open=True), name='tickbucket_open_uniq'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['label', 'bucket_start'], name='tickbucket_label_start_idx')
+        ]
 
     def __str__(self):
         return self.label
@@ -0,0 +1,140 @@
+from django.db import connections
+from django.utils import timezone
+from bson.decimal128 import Decimal128
+from pymongo import ReturnDocument, UpdateOne
+from datetime import date, datetime, time
+from decimal import Decimal
+
+# helpers to work directly with the pymongo collections behind the djongo models
+# when the ORM would need one query (or more) per document
+
+
+def get_database(using='default'):
+    # the djongo connection is the pymongo Database object
+    connection = connections[using]
+    connection.ensure_connection()
+    return connection.connection
+
+
+def get_collection(model, using='default'):
+    # each Django model is a MongoDB collection named <app_name>_<model>
+    return get_database(using)[model._meta.db_table]
+
+
+def allocate_ids(model, count, using='default'):
+    # djongo keeps the AutoField sequence of each collection in the __schema__
+    # collection, documents inserted without the ORM need to reserve their ids
+    # from the same sequence. Returns the first id of the reserved block
+    if count == 0:
+        return None
+    schema = get_database(using)['__schema__'].find_one_and_update(
+        {'name': model._meta.db_table, 'auto': {'$exists': True}},
+        {'$inc': {'auto.seq': count}},
+        return_document=ReturnDocument.AFTER
+    )
+    return schema['auto']['seq'] - count + 1
+
+
+def to_mongo(value):
+    # same conversions djongo does when inserting a document:
+    # BSON has no date type and decimals are stored as Decimal128
+    if isinstance(value, Decimal):
+        return Decimal128(value)
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, time())
+    if isinstance(value, dict):
+        return {k: to_mongo(v) for k,v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_mongo(v) for v in value]
+    return value
+
+
+def bulk_upsert(model, documents, key_fields, using='default'):
+    # documents is a list of validated dicts matched on the key_fields values:
+    # missing documents are inserted and the fields of the existing ones
+    # are overwritten, with a single unordered bulk write
+    merged = {}
+    for document in documents:
+        document = dict(document)
+        document.setdefault('date_time', timezone.now())
+        # same key twice in one request: last fields win
+        key = tuple(document[field] for field in key_fields)
+        merged.setdefault(key, {}).update(document)
+
+    next_id = allocate_ids(model, len(merged), using)
+    operations = []
+    for document in merged.values():
+        document = to_mongo(document)
+        operations.append(UpdateOne(
+            {field: document[field] for field in key_fields},
+            {'$set': document, '$setOnInsert': {'id': next_id}},
+            upsert=True
+        ))
+        next_id += 1
+
+    if len(operations) == 0:
+        return {'matched': 0, 'modified': 0, 'upserted': 0}
+
+    # unordered: a failing document does not stop the others
+    result = get_collection(model, using).bulk_write(operations, ordered=False)
+    return {
+        'matched': result.matched_count,
+        'modified': result.modified_count,
+        'upserted': result.upserted_count
+    }
+
+
+def bulk_upsert_equities(model, equities, using='default'):
+    # matched on the unique label/md_date key
+    return bulk_upsert(model, equities, ('label', 'md_date'), using)
+
+
+def update_snapshots(model, entries, using='default'):
+    # entries are validated dicts with label, md_date and optionally the daily
+    # prices of an intraday snapshot, which are set on the existing documents.
+    # Returns the label/md_date pairs that do not have a document yet
+    keys = []
+    operations = []
+    for entry in entries:
+        entry = to_mongo(dict(entry))
+        key = {'label': entry.pop('label'), 'md_date': entry.pop('md_date')}
+        keys.append(key)
+        if len(entry) != 0:
+            operations.append(UpdateOne(key, {'$set': entry}))
+
+    if len(keys) == 0:
+        return []
+
+    collection = get_collection(model, using)
+    if len(operations) != 0:
+        result = collection.bulk_write(operations, ordered=False)
+        if result.matched_count == len(keys):
+            return []
+
+    found = set(
+        (document['label'], document['md_date'])
+        for document in collection.find({'$or': keys}, {'label': 1, 'md_date': 1})
+    )
+    return [
+        {'label': key['label'], 'md_date': key['md_date'].date().isoformat()}
+        for key in keys if (key['label'], key['md_date']) not in found
+    ]
+
+
+def create_indexes(model, indexes, using='default'):
+    # indexes is a list of (name, keys, options) with pymongo keys
+    # e.g. ('unique_label_md_date', [('label', 1), ('md_date', 1)], {'unique': True})
+    # create_index does nothing if the same index already exists
+    collection = get_collection(model, using)
+    for name, keys, options in indexes:
+        collection.create_index(keys, name=name, **options)
+
+
+def drop_indexes(model, names, using='default'):
+    collection = get_collection(model, using)
+    existing = collection.index_information()
+    for name in names:
+        if name in existing:
+            collection.drop_index(name)
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from pymongo import ReturnDocument
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+# non blocking MongoDB access for the async API (config/asgi.py), the
+# asyncio counterpart of the helpers of mongo.py. One Motor client (and one
+# connection pool, ASYNC_MONGO_CLIENT in settings.py) per process and
+# database alias, created on the first request in the event loop of the server
+
+clients = {}
+
+
+def get_async_database(using='default'):
+    if using not in clients:
+        if AsyncIOMotorClient is None:
+            raise ImproperlyConfigured('The async API needs the motor package')
+        clients[using] = AsyncIOMotorClient(**getattr(settings, 'ASYNC_MONGO_CLIENT', {}))
+    return clients[using][settings.DATABASES[using]['NAME']]
+
+
+def get_async_collection(model, using='default'):
+    return get_async_database(using)[model._meta.db_table]
+
+
+def close_async_clients():
+    for client in clients.values():
+        client.close()
+    clients.clear()
+
+
+async def allocate_ids_async(model, count, using='default'):
+    # same sequence of the djongo AutoField as allocate_ids
+    if count == 0:
+        return None
+    schema = await get_async_database(using)['__schema__'].find_one_and_update(
+        {'name': model._meta.db_table, 'auto': {'$exists': True}},
+        {'$inc': {'auto.seq': count}},
+        return_document=ReturnDocument.AFTER
+    )
+    return schema['auto']['seq'] - count + 1
@@ -0,0 +1,161 @@
+import re
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+from bson.decimal128 import Decimal128
+from django.conf import settings
+from django.db import models
+from rest_framework.exceptions import NotFound, ValidationError
+from .mongo import get_collection
+
+# native read path: the read endpoints query MongoDB with pymongo and build
+# the response from the documents, skipping the djongo SQL to MongoDB
+# translation and the DRF field by field serialization. The responses are
+# the same as the ORM ones (same filters, ordering and representation of
+# the fields, e.g. decimals as strings with 6 decimal places)
+#
+# API_READ_PATH in settings.py selects the path ('native' or 'orm'),
+# ?read_path=orm|native overrides it for a request (for the benchmarks)
+
+READ_PATHS = ('native', 'orm')
+
+# representation functions of the fields of each model, built once
+representations = {}
+
+
+def get_read_path(request):
+    read_path = request.query_params.get('read_path', getattr(settings, 'API_READ_PATH', 'native'))
+    if read_path not in READ_PATHS:
+        raise ValidationError({'read_path': 'Unknown read path {0}, one of {1}'.format(read_path, ', '.join(READ_PATHS))})
+    return read_path
+
+
+def use_native_reads(request):
+    return get_read_path(request) == 'native'
+
+
+def to_date(value):
+    # the dates are stored as midnight datetimes
+    return value.date().isoformat() if isinstance(value, datetime) else value.isoformat()
+
+
+def to_datetime(value):
+    # same representation as DRF: UTC datetimes (naive from pymongo) end with Z
+    if value.tzinfo is None:
+        return value.isoformat() + 'Z'
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def to_decimal(decimal_places):
+    quantum = Decimal(1).scaleb(-decimal_places)
+    def represent(value):
+        if isinstance(value, Decimal128):
+            value = value.to_decimal()
+        elif not isinstance(value, Decimal):
+            value = Decimal(str(value))
+        try:
+            return '{0:f}'.format(value.quantize(quantum))
+        except InvalidOperation:
+            return '{0:f}'.format(value)
+    return represent
+
+
+def to_embedded(model):
+    # djongo ArrayField of embedded documents
+    def represent(value):
+        return [to_representation(model, document) for document in value]
+    return represent
+
+
+def get_representations(model):
+    # list of (output name, document key, function) for the concrete fields
+    if model not in representations:
+        fields = []
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.DateTimeField):
+                represent = to_datetime
+            elif isinstance(field, models.DateField):
+                represent = to_date
+            elif isinstance(field, models.DecimalField):
+                represent = to_decimal(field.decimal_places)
+            elif isinstance(field, models.FloatField):
+                represent = float
+            elif isinstance(field, (models.IntegerField, models.AutoField)) or field.is_relation:
+                represent = int
+            elif getattr(field, 'model_container', None) is not None:
+                represent = to_embedded(field.model_container)
+            else:
+                represent = None
+            fields.append((field.name, field.attname, represent))
+        representations[model] = fields
+    return representations[model]
+
+
+def to_representation(model, document, fields=None):
+    # document as returned by the serializer of the model, fields (optional)
+    # limits the output to a subset of the fields
+    data = {}
+    for name, key, represent in get_representations(model):
+        if fields is not None and name not in fields:
+            continue
+        value = document.get(key)
+        if value is not None and represent is not None:
+            value = represent(value)
+        data[name] = value
+    return data
+
+
+def get_projection(model, fields=None, extra=()):
+    # MongoDB projection of the fields (all of them if fields is None)
+    names = set(fields) | set(extra) if fields is not None else None
+    projection = {'_id': 0}
+    for name, key, represent in get_representations(model):
+        if names is None or name in names:
+            projection[key] = 1
+    return projection
+
+
+def to_mongo_date(value):
+    return datetime.combine(value, time())
+
+
+def get_sort(model, ordering, default):
+    # same as the OrderingFilter: ?ordering=-md_date,label on the fields of
+    # the model, the unknown fields are ignored
+    fields = {field.name: field.attname for field in model._meta.concrete_fields}
+    sort = []
+    for name in (ordering or '').split(','):
+        name = name.strip()
+        if name.lstrip('-') in fields:
+            sort.append((fields[name.lstrip('-')], -1 if name.startswith('-') else 1))
+    return sort or [(default, 1)]
+
+
+def search_query(terms, fields):
+    # same matching as the SearchFilter: every term is contained
+    # (case insensitive) in at least one of the fields
+    conditions = []
+    for term in re.split(r'[\s,]+', terms.strip()):
+        if term == '':
+            continue
+        pattern = re.compile(re.escape(term), re.IGNORECASE)
+        conditions.append({'$or': [{field: pattern} for field in fields]})
+    return {'$and': conditions} if len(conditions) != 0 else {}
+
+
+def find_one(model, pk, using='default'):
+    # document of the primary key in the URL or 404 as with the ORM
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        raise NotFound()
+    document = get_collection(model, using).find_one({'id': pk}, get_projection(model))
+    if document is None:
+        raise NotFound()
+    return document
+
+
+def find_by_labels(model, labels, using='default'):
+    # documents of a model with a unique label (e.g. Security) by label
+    documents = get_collection(model, using).find({'label': {'$in': list(labels)}}, get_projection(model))
+    return {document['label']: document for document in documents}
@@ -0,0 +1,148 @@
+import base64
+import json
+from collections import OrderedDict
+from datetime import datetime, time
+from pymongo import ASCENDING, DESCENDING
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import exceptions
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# keyset pagination: the next page starts after the (ordering field, id) of the
+# last document of the current page, so every page is an index range scan no
+# matter how deep the client goes (no skip/offset)
+#
+#   GET /equities/?label=MSFT&page_size=500
+#   {"next": "http://.../equities/?label=MSFT&page_size=500&cursor=WyIyMDIxLTA4LTI1IiwgMzFd", "results": [...]}
+#
+# the pagination is opt-in: only the requests with page_size or cursor are
+# paginated, the other ones return the list of all the documents as before.
+# ordering=-md_date returns the pages from the most recent md_date, the
+# other orderings of the paginated requests are rejected (400) since the
+# pages are ranges of md_date
+# the pages of the native read path (native.py) are read in the same way
+# with pymongo, the cursors are the same for both paths
+
+
+class KeysetPagination(BasePagination):
+    page_size = getattr(settings, 'EQUITY_PAGE_SIZE', 100)
+    max_page_size = getattr(settings, 'EQUITY_MAX_PAGE_SIZE', 1000)
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    ordering_field = 'md_date'
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.page_size_query_param in params or self.cursor_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_descending(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, '')
+        if ordering not in ('', self.ordering_field, '-' + self.ordering_field):
+            raise exceptions.ValidationError({self.ordering_query_param: 'Only {0} and -{0} are supported'.format(
+                self.ordering_field
+            )})
+        return ordering == '-' + self.ordering_field
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            value = model._meta.get_field(self.ordering_field).to_python(value)
+            return value, int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound('Invalid cursor')
+
+    def encode_cursor(self, value, pk):
+        # value is a date, or a datetime for the documents read with pymongo
+        if isinstance(value, datetime):
+            value = value.date()
+        cursor = json.dumps([value.isoformat(), pk])
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # None: the list is not paginated (see GenericAPIView.paginate_queryset)
+        if not self.is_requested(request):
+            return None
+        self.request = request
+        page_size = self.get_page_size(request)
+        descending = self.get_descending(request)
+        field = self.ordering_field
+
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            value, pk = cursor
+            lookup = '__lt' if descending else '__gt'
+            queryset = queryset.filter(
+                Q(**{field + lookup: value}) | Q(**{field: value, 'id' + lookup: pk})
+            )
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(prefix + field, prefix + 'id')
+
+        # one more document to know if there is a next page
+        results = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_cursor = self.encode_cursor(getattr(results[-1], field), results[-1].pk)
+        return results
+
+    def paginate_collection(self, collection, query, projection, request, model):
+        # same pages as paginate_queryset read directly with pymongo
+        # (native read path), the documents keep their MongoDB types
+        query, projection, sort, page_size = self.get_collection_query(query, projection, request, model)
+        documents = collection.find(query, projection).sort(sort).limit(page_size + 1)
+        return self.get_collection_page(list(documents), page_size)
+
+    def get_collection_query(self, query, projection, request, model):
+        # MongoDB query, projection and sort of the page, the page_size + 1
+        # documents read are passed to get_collection_page (see the async API)
+        self.request = request
+        page_size = self.get_page_size(request)
+        descending = self.get_descending(request)
+        field = self.ordering_field
+
+        cursor = self.decode_cursor(request, model)
+        if cursor is not None:
+            value, pk = cursor
+            value = datetime.combine(value, time())
+            operator = '$lt' if descending else '$gt'
+            query = {'$and': [query, {'$or': [
+                {field: {operator: value}},
+                {field: value, 'id': {operator: pk}}
+            ]}]}
+        direction = DESCENDING if descending else ASCENDING
+        projection = dict(projection, **{field: 1, 'id': 1})
+        return query, projection, [(field, direction), ('id', direction)], page_size
+
+    def get_collection_page(self, results, page_size):
+        self.next_cursor = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_cursor = self.encode_cursor(results[-1][self.ordering_field], results[-1]['id'])
+        return results
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import logging
+from datetime import timedelta
+from urllib.parse import parse_qs
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+from .models import TickBucket
+from .motor_client import get_async_collection
+from .tickstore import TIMESTAMP_FORMAT, to_utc
+
+# live ticks pushed to the clients instead of being polled:
+#
+#   GET /equities/stream/?labels=MSFT,TSLA   Server-Sent Events
+#   ws://<host>:<port>/equities/stream/?labels=MSFT,TSLA   WebSocket, the client
+#   can then send {"subscribe": ["AAPL"], "unsubscribe": ["TSLA"]}
+#
+# every message is the delta of the ticks of a label appended since the
+# previous message of that label:
+# {"label": "TSLA", "timestamps": ["2021-08-25T19:06:42.776799Z"], "prices": [713.66], "conflated": 0}
+#
+# one TickHub per process reads the new ticks of all the subscribed labels
+# from the tick store, by polling (TICK_STREAM_SOURCE = 'poll', one query for
+# all the labels every TICK_STREAM_POLL_INTERVAL seconds) or with a MongoDB
+# change stream ('changestream', replica set only), and fans them out to the
+# subscriptions. The new ticks of a bucket are the ones after its position
+# (length of its arrays) at the previous read, not the ones after the last
+# timestamp published, so the late ticks appended with an older timestamp
+# are published too (up to TICK_STREAM_LATE_WINDOW seconds after the end of
+# their bucket). A slow consumer keeps at most TICK_STREAM_MAX_PENDING ticks
+# per label, the oldest ones are conflated (dropped, and counted in the
+# conflated field of the next message) so it always gets the latest prices
+
+TICK_STREAM_SOURCE = getattr(settings, 'TICK_STREAM_SOURCE', 'poll')
+TICK_STREAM_POLL_INTERVAL = getattr(settings, 'TICK_STREAM_POLL_INTERVAL', 1)
+TICK_STREAM_MAX_PENDING = getattr(settings, 'TICK_STREAM_MAX_PENDING', 100)
+TICK_STREAM_HEARTBEAT = getattr(settings, 'TICK_STREAM_HEARTBEAT', 15)
+TICK_STREAM_LATE_WINDOW = getattr(settings, 'TICK_STREAM_LATE_WINDOW', 3600)
+
+BUCKET_PROJECTION = {'_id': 1, 'label': 1, 'bucket_end': 1, 'timestamps': 1, 'prices': 1}
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, labels, max_pending=TICK_STREAM_MAX_PENDING):
+        self.labels = set(labels)
+        self.max_pending = max_pending
+        # label -> ticks not sent yet and number of ticks conflated
+        self.pending = {}
+        self.conflated = {}
+        self.ready = asyncio.Event()
+        self.closed = False
+
+    def push(self, label, ticks):
+        pending = self.pending.setdefault(label, [])
+        pending.extend(ticks)
+        if len(pending) > self.max_pending:
+            dropped = len(pending) - self.max_pending
+            del pending[:dropped]
+            self.conflated[label] = self.conflated.get(label, 0) + dropped
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    async def next(self, timeout):
+        # messages of the pending ticks, [] after timeout seconds without ticks
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        pending, self.pending = self.pending, {}
+        conflated, self.conflated = self.conflated, {}
+        return [
+            {
+                'label': label,
+                'timestamps': [timestamp.strftime(TIMESTAMP_FORMAT) for timestamp, price in ticks],
+                'prices': [price for timestamp, price in ticks],
+                'conflated': conflated.get(label, 0)
+            }
+            for label, ticks in pending.items()
+        ]
+
+
+class TickHub:
+    def __init__(self, source=TICK_STREAM_SOURCE):
+        self.source = source
+        self.subscriptions = set()
+        # label -> time of the subscription to the label, the ticks written
+        # before it are not published
+        self.since = {}
+        # label -> {bucket _id: (bucket_end, number of ticks read)}, the ids
+        # of the buckets are set after their insert
+        self.positions = {}
+        self.task = None
+
+    def get_labels(self):
+        labels = set()
+        for subscription in self.subscriptions:
+            labels |= subscription.labels
+        return labels
+
+    def subscribe(self, labels):
+        subscription = Subscription(labels)
+        self.subscriptions.add(subscription)
+        self.update(subscription)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return subscription
+
+    def update(self, subscription, subscribe=(), unsubscribe=()):
+        subscription.labels |= set(subscribe)
+        subscription.labels -= set(unsubscribe)
+        labels = self.get_labels()
+        now = timezone.now()
+        for label in labels - set(self.since):
+            self.since[label] = now
+            self.positions[label] = {}
+        for label in set(self.since) - labels:
+            del self.since[label]
+            del self.positions[label]
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        self.subscriptions.discard(subscription)
+        self.update(subscription)
+        if len(self.subscriptions) == 0 and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def get_new_ticks(self, bucket):
+        # ticks of the bucket document after its position at the previous read
+        label = bucket['label']
+        if label not in self.since:
+            return []
+        timestamps = bucket.get('timestamps', [])
+        prices = bucket.get('prices', [])
+        positions = self.positions[label]
+        since = self.since[label]
+        if bucket['_id'] in positions:
+            position = positions[bucket['_id']][1]
+            ticks = list(zip(timestamps[position:], prices[position:]))
+        elif isinstance(bucket.get('_id'), ObjectId) and bucket['_id'].generation_time >= since.replace(microsecond=0):
+            # bucket created after the subscription, all its ticks are new
+            ticks = list(zip(timestamps, prices))
+        else:
+            # bucket read for the first time, its ticks written before the
+            # subscription are only known by their timestamps
+            ticks = [(timestamp, price) for timestamp, price in zip(timestamps, prices) if to_utc(timestamp) > since]
+        positions[bucket['_id']] = (to_utc(bucket['bucket_end']), len(timestamps))
+        return [(to_utc(timestamp), price) for timestamp, price in ticks]
+
+    def forget(self, horizon):
+        # positions of the buckets ended before the late ticks window
+        for positions in self.positions.values():
+            for bucket_id in [bucket_id for bucket_id, (bucket_end, count) in positions.items() if bucket_end <= horizon]:
+                del positions[bucket_id]
+
+    def publish(self, label, ticks):
+        if len(ticks) == 0 or label not in self.since:
+            return
+        ticks.sort()
+        for subscription in self.subscriptions:
+            if label in subscription.labels:
+                subscription.push(label, ticks)
+
+    async def run(self):
+        while True:
+            try:
+                if self.source == 'changestream':
+                    await self.watch()
+                else:
+                    await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Tick stream %s failed, restarting", self.source)
+                await asyncio.sleep(TICK_STREAM_POLL_INTERVAL)
+
+    def get_horizon(self):
+        return timezone.now() - timedelta(seconds=TICK_STREAM_LATE_WINDOW)
+
+    async def poll(self):
+        # the counts of the buckets of the late ticks window are read first,
+        # the arrays only of the buckets with new ticks
+        collection = get_async_collection(TickBucket)
+        while True:
+            if len(self.since) != 0:
+                horizon = self.get_horizon()
+                self.forget(horizon)
+                query = {'label': {'$in': list(self.since)}, 'bucket_end': {'$gt': horizon}}
+                changed = []
+                async for bucket in collection.find(query, {'_id': 1, 'label': 1, 'count': 1}):
+                    position = self.positions.get(bucket['label'], {}).get(bucket['_id'])
+                    if position is None or bucket.get('count') != position[1]:
+                        changed.append(bucket['_id'])
+                # several buckets of a label can hold new ticks
+                ticks = {}
+                if len(changed) != 0:
+                    async for bucket in collection.find({'_id': {'$in': changed}}, BUCKET_PROJECTION):
+                        ticks.setdefault(bucket['label'], []).extend(self.get_new_ticks(bucket))
+                for label, label_ticks in ticks.items():
+                    self.publish(label, label_ticks)
+            await asyncio.sleep(TICK_STREAM_POLL_INTERVAL)
+
+    async def watch(self):
+        # inserts and $push of the buckets with the document after the update
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace']}}}]
+        collection = get_async_collection(TickBucket)
+        async with collection.watch(pipeline, full_document='updateLookup') as stream:
+            async for change in stream:
+                if change['operationType'] == 'insert':
+                    self.forget(self.get_horizon())
+                bucket = change.get('fullDocument')
+                if bucket is not None:
+                    self.publish(bucket['label'], self.get_new_ticks(bucket))
+
+
+hub = TickHub()
+
+
+def parse_labels(query_string):
+    labels = parse_qs(query_string.decode('latin-1')).get('labels', [])
+    return set(label.strip() for value in labels for label in value.split(',') if label.strip() != '')
+
+
+async def stream_events(scope, receive, send):
+    # Server-Sent Events, a comment line every TICK_STREAM_HEARTBEAT seconds
+    # keeps the connection open through the proxies
+    labels = parse_labels(scope.get('query_string', b''))
+    if len(labels) == 0:
+        body = json.dumps({'labels': ['This query parameter is required.']}).encode()
+        await send({'type': 'http.response.start', 'status': 400, 'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': body})
+        return
+
+    subscription = hub.subscribe(labels)
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        subscription.close()
+
+    disconnect = asyncio.ensure_future(wait_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]})
+        await send({'type': 'http.response.body', 'body': b': subscribed\n\n', 'more_body': True})
+        while not subscription.closed:
+            messages = await subscription.next(TICK_STREAM_HEARTBEAT)
+            if subscription.closed:
+                break
+            body = ''.join('event: ticks\ndata: {0}\n\n'.format(json.dumps(message)) for message in messages)
+            await send({'type': 'http.response.body', 'body': (body or ': keepalive\n\n').encode(), 'more_body': True})
+    finally:
+        disconnect.cancel()
+        hub.unsubscribe(subscription)
+
+
+async def stream_websocket(scope, receive, send):
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+    subscription = hub.subscribe(parse_labels(scope.get('query_string', b'')))
+
+    async def read_messages():
+        # {"subscribe": [...], "unsubscribe": [...]}, invalid messages are ignored
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                subscription.close()
+                return
+            try:
+                request = json.loads(message.get('text') or message.get('bytes') or '')
+                hub.update(subscription, request.get('subscribe', []), request.get('unsubscribe', []))
+            except (ValueError, TypeError, AttributeError):
+                continue
+
+    reader = asyncio.ensure_future(read_messages())
+    try:
+        while not subscription.closed:
+            messages = await subscription.next(TICK_STREAM_HEARTBEAT)
+            if subscription.closed:
+                break
+            for message in messages:
+                await send({'type': 'websocket.send', 'text': json.dumps(message)})
+    finally:
+        reader.cancel()
+        hub.unsubscribe(subscription)
+
+
+async def stream_ticks(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await stream_websocket(scope, receive, send)
+    else:
+        await stream_events(scope, receive, send)
@@ -1,3 +1,402 @@
-from django.test import TestCase
+import asyncio
+import math
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlsplit
+from django.http import QueryDict
+from bson import ObjectId
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from pymongo.errors import BulkWriteError
+from rest_framework.exceptions import NotFound, ValidationError
+from . import cache, tickstore
+from .aggregation import interval_key
+from .importer import validate_columns, check_equity, EQUITY_FIELDS
+from .models import Equity, TickBucket
+from .native import get_sort
+from .mongo import get_collection, get_database
+from .pagination import KeysetPagination
+from .streaming import Subscription, TickHub
+from .tickstore import write_ticks, read_ticks
 
-# Create your tests here.
+# the tick store tests need the MongoDB server of the DATABASES settings,
+# the test database is created and dropped by the test runner
+#
+#   python manage.py test apps
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+def get_sequence(model):
+    # last id reserved from the djongo sequence of the collection
+    return get_database()['__schema__'].find_one({'name': model._meta.db_table})['auto']['seq']
+
+
+class FakeRequest:
+    # the attributes of the requests used by the pagination
+    def __init__(self, query=''):
+        self.query_params = QueryDict(query)
+
+    def build_absolute_uri(self):
+        return 'http://testserver/equities/?' + self.query_params.urlencode()
+
+
+class KeysetPaginationTests(SimpleTestCase):
+    def test_pagination_is_requested(self):
+        paginator = KeysetPagination()
+        self.assertFalse(paginator.is_requested(FakeRequest('label=MSFT&ordering=label')))
+        self.assertIsNone(paginator.paginate_queryset(Equity.objects.none(), FakeRequest('ordering=label')))
+        self.assertTrue(paginator.is_requested(FakeRequest('label=MSFT&page_size=500')))
+        self.assertTrue(paginator.is_requested(FakeRequest('cursor=WyIyMDIxLTA4LTI1IiwgMzFd')))
+
+    def test_cursor_round_trip(self):
+        paginator = KeysetPagination()
+        cursor = paginator.encode_cursor(date(2021, 8, 25), 31)
+        self.assertEqual(paginator.decode_cursor(FakeRequest('cursor=' + cursor), Equity), (date(2021, 8, 25), 31))
+        # the documents read with pymongo have datetimes
+        self.assertEqual(paginator.encode_cursor(datetime(2021, 8, 25), 31), cursor)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(NotFound):
+            KeysetPagination().decode_cursor(FakeRequest('cursor=notacursor'), Equity)
+
+    def test_page_size(self):
+        paginator = KeysetPagination()
+        self.assertEqual(paginator.get_page_size(FakeRequest()), paginator.page_size)
+        self.assertEqual(paginator.get_page_size(FakeRequest('page_size=abc')), paginator.page_size)
+        self.assertEqual(paginator.get_page_size(FakeRequest('page_size=0')), 1)
+        self.assertEqual(paginator.get_page_size(FakeRequest('page_size=1000000')), paginator.max_page_size)
+
+    def test_ordering(self):
+        paginator = KeysetPagination()
+        self.assertFalse(paginator.get_descending(FakeRequest()))
+        self.assertFalse(paginator.get_descending(FakeRequest('ordering=md_date')))
+        self.assertTrue(paginator.get_descending(FakeRequest('ordering=-md_date')))
+        with self.assertRaises(ValidationError):
+            paginator.get_descending(FakeRequest('ordering=label'))
+
+    def test_collection_query_after_cursor(self):
+        paginator = KeysetPagination()
+        cursor = paginator.encode_cursor(date(2021, 8, 25), 31)
+        query, projection, sort, page_size = paginator.get_collection_query(
+            {'label': 'MSFT'}, {'label': 1}, FakeRequest('ordering=-md_date&page_size=2&cursor=' + cursor), Equity
+        )
+        self.assertEqual(query, {'$and': [{'label': 'MSFT'}, {'$or': [
+            {'md_date': {'$lt': datetime(2021, 8, 25)}},
+            {'md_date': datetime(2021, 8, 25), 'id': {'$lt': 31}}
+        ]}]})
+        self.assertEqual(projection, {'label': 1, 'md_date': 1, 'id': 1})
+        self.assertEqual(sort, [('md_date', -1), ('id', -1)])
+        self.assertEqual(page_size, 2)
+
+    def test_collection_page(self):
+        paginator = KeysetPagination()
+        paginator.request = FakeRequest('label=MSFT&page_size=2')
+        documents = [{'id': i, 'md_date': datetime(2021, 8, 23 + i)} for i in range(3)]
+        self.assertEqual(paginator.get_collection_page(documents, 2), documents[:2])
+        self.assertEqual(paginator.next_cursor, paginator.encode_cursor(date(2021, 8, 24), 1))
+        self.assertEqual(QueryDict(urlsplit(paginator.get_next_link()).query)['cursor'], paginator.next_cursor)
+        self.assertEqual(paginator.get_collection_page(documents[:2], 2), documents[:2])
+        self.assertIsNone(paginator.get_next_link())
+
+    def test_sort_of_the_lists_without_pagination(self):
+        self.assertEqual(get_sort(Equity, None, 'md_date'), [('md_date', 1)])
+        self.assertEqual(get_sort(Equity, '-md_date,label', 'md_date'), [('md_date', -1), ('label', 1)])
+        self.assertEqual(get_sort(Equity, 'unknown', 'md_date'), [('md_date', 1)])
+
+
+def evaluate(expression, document):
+    # the aggregation operators of interval_key, with the MongoDB semantics
+    # ($mod keeps the sign of the dividend, date - date is in milliseconds)
+    if isinstance(expression, str) and expression.startswith('$'):
+        return document[expression[1:]]
+    if not isinstance(expression, dict):
+        return expression
+    (operator, args), = expression.items()
+    if operator in ('$year', '$month'):
+        return getattr(evaluate(args, document), operator[1:])
+    a, b = [evaluate(arg, document) for arg in args]
+    if operator == '$subtract':
+        if isinstance(a, datetime) and isinstance(b, datetime):
+            return (a - b) // timedelta(milliseconds=1)
+        if isinstance(a, datetime):
+            return a - timedelta(milliseconds=b)
+        return a - b
+    if operator == '$add':
+        return a + b
+    if operator == '$multiply':
+        return a * b
+    if operator == '$mod':
+        return int(math.fmod(a, b))
+    raise ValueError(operator)
+
+
+class IntervalKeyTests(SimpleTestCase):
+    def get_key(self, interval, value):
+        return evaluate(interval_key('$md_date', interval), {'md_date': value})
+
+    def test_fixed_length_intervals(self):
+        self.assertEqual(self.get_key('1d', datetime(2021, 8, 25, 18, 30)), datetime(2021, 8, 25))
+        self.assertEqual(self.get_key('4h', datetime(2021, 8, 25, 18, 30)), datetime(2021, 8, 25, 16))
+        self.assertEqual(self.get_key('15m', datetime(2021, 8, 25, 18, 44)), datetime(2021, 8, 25, 18, 30))
+        # weeks start on monday
+        self.assertEqual(self.get_key('1w', datetime(2021, 8, 29)), datetime(2021, 8, 23))
+
+    def test_dates_before_the_anchor(self):
+        self.assertEqual(self.get_key('1d', datetime(1969, 12, 31, 12)), datetime(1969, 12, 31))
+        self.assertEqual(self.get_key('1d', datetime(1960, 3, 1)), datetime(1960, 3, 1))
+        self.assertEqual(self.get_key('1w', datetime(1970, 1, 4)), datetime(1969, 12, 29))
+        self.assertEqual(self.get_key('1w', datetime(1965, 6, 30)), datetime(1965, 6, 28))
+
+    def test_calendar_intervals(self):
+        self.assertEqual(self.get_key('1mo', datetime(2021, 8, 25)), 2021 * 12 + 7)
+        self.assertEqual(self.get_key('3mo', datetime(2021, 8, 25)), 2021 * 12 + 6)
+        self.assertEqual(self.get_key('1y', datetime(1969, 8, 25)), 1969)
+
+
+@mock.patch.object(cache, 'API_CACHE_ENABLED', True)
+class ResponseCacheTests(SimpleTestCase):
+    # the LocMemCache of the API_CACHE_ALIAS settings
+    def setUp(self):
+        cache.get_cache().clear()
+        self.factory = RequestFactory()
+
+    def get_key(self, path, namespaces, **headers):
+        request = self.factory.get(path, **headers)
+        return cache.get_cache_key(request, namespaces, cache.get_versions(namespaces))
+
+    def test_key_does_not_depend_on_the_order_of_the_parameters(self):
+        namespaces = [cache.equity_namespace('MSFT')]
+        self.assertEqual(
+            self.get_key('/equities/?label=MSFT&ordering=-md_date', namespaces),
+            self.get_key('/equities/?ordering=-md_date&label=MSFT', namespaces)
+        )
+        self.assertNotEqual(
+            self.get_key('/equities/?label=MSFT', namespaces),
+            self.get_key('/equities/?label=MSFT', namespaces, HTTP_ACCEPT_ENCODING='gzip')
+        )
+
+    def test_writes_change_the_versions_of_their_labels(self):
+        msft, tsla = cache.equity_namespace('MSFT'), cache.equity_namespace('TSLA')
+        versions = cache.get_versions([msft, tsla, cache.EQUITIES_ALL])
+        key = self.get_key('/equities/?label=MSFT', [msft])
+        with mock.patch.object(cache.time, 'time', return_value=versions[0] / 1000000 + 1):
+            cache.invalidate_equities(['MSFT'], ticks_only=True)
+        new_versions = cache.get_versions([msft, tsla, cache.EQUITIES_ALL])
+        self.assertGreater(new_versions[0], versions[0])
+        self.assertEqual(new_versions[1:], versions[1:])
+        self.assertNotEqual(self.get_key('/equities/?label=MSFT', [msft]), key)
+
+    def test_not_modified(self):
+        entry = cache.build_entry(b'[]', {'Content-Type': 'application/json'}, [1629918402000000])
+        response = cache.build_response(self.factory.get('/equities/', HTTP_IF_NONE_MATCH=entry['etag']), entry)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], entry['etag'])
+        response = cache.build_response(self.factory.get('/equities/', HTTP_IF_NONE_MATCH='"other"'), entry)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'[]')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        last_modified = response['Last-Modified']
+        response = cache.build_response(self.factory.get('/equities/', HTTP_IF_MODIFIED_SINCE=last_modified), entry)
+        self.assertEqual(response.status_code, 304)
+
+
+class SubscriptionTests(SimpleTestCase):
+    def read(self, pushes, max_pending):
+        # messages of the pushes, then of an empty wait
+        async def read():
+            subscription = Subscription(['MSFT', 'TSLA'], max_pending)
+            for label, ticks in pushes:
+                subscription.push(label, ticks)
+            return await subscription.next(1), await subscription.next(0.01)
+        return asyncio.run(read())
+
+    def test_oldest_ticks_are_conflated(self):
+        ticks = [(utc(2021, 8, 25, 19, 6, i), 713 + i) for i in range(3)]
+        messages, empty = self.read([('MSFT', ticks[:2]), ('MSFT', ticks[2:])], 2)
+        self.assertEqual(messages, [{
+            'label': 'MSFT',
+            'timestamps': ['2021-08-25T19:06:01.000000Z', '2021-08-25T19:06:02.000000Z'],
+            'prices': [714, 715],
+            'conflated': 1
+        }])
+        self.assertEqual(empty, [])
+
+
+class TickHubTests(SimpleTestCase):
+    def setUp(self):
+        self.hub = TickHub()
+        self.since = utc(2021, 8, 25, 19, 30)
+        self.hub.since['MSFT'] = self.since
+        self.hub.positions['MSFT'] = {}
+
+    def get_bucket(self, _id, minutes):
+        # pymongo returns naive UTC datetimes
+        return {
+            '_id': _id, 'label': 'MSFT', 'bucket_end': datetime(2021, 8, 25, 20, 0),
+            'timestamps': [datetime(2021, 8, 25, 19, minute) for minute in minutes],
+            'prices': [float(minute) for minute in minutes]
+        }
+
+    def test_ticks_after_the_subscription_then_after_the_position(self):
+        self.assertEqual(self.hub.get_new_ticks(self.get_bucket(1, [28, 29, 31])), [(utc(2021, 8, 25, 19, 31), 31.0)])
+        # the late tick (older timestamp) is after the position
+        self.assertEqual(
+            self.hub.get_new_ticks(self.get_bucket(1, [28, 29, 31, 33, 32])),
+            [(utc(2021, 8, 25, 19, 33), 33.0), (utc(2021, 8, 25, 19, 32), 32.0)]
+        )
+        self.assertEqual(self.hub.get_new_ticks(self.get_bucket(1, [28, 29, 31, 33, 32])), [])
+
+    def test_buckets_created_after_the_subscription(self):
+        bucket_id = ObjectId.from_datetime(utc(2021, 8, 25, 19, 35))
+        bucket = self.get_bucket(bucket_id, [34, 35])
+        self.assertEqual(self.hub.get_new_ticks(bucket), [(utc(2021, 8, 25, 19, 34), 34.0), (utc(2021, 8, 25, 19, 35), 35.0)])
+
+    def test_labels_without_subscription(self):
+        bucket = dict(self.get_bucket(1, [1]), label='TSLA')
+        self.assertEqual(self.hub.get_new_ticks(bucket), [])
+
+
+class ValidateColumnsTests(SimpleTestCase):
+    def get_columns(self, rows):
+        names = [name for name, kind in EQUITY_FIELDS]
+        return {name: [row[i] for row in rows] for i, name in enumerate(names)}
+
+    def test_valid_rows(self):
+        columns = self.get_columns([('MSFT', '2021-08-25', '300.1', '302.5', '299.0', '301.4', '2260000000000')])
+        documents, rejects = validate_columns(EQUITY_FIELDS, columns, 1, check_equity)
+        self.assertEqual(rejects, [])
+        self.assertEqual(documents, [{
+            'label': 'MSFT',
+            'md_date': date(2021, 8, 25),
+            'p_open': Decimal('300.100000'),
+            'p_high': Decimal('302.500000'),
+            'p_low': Decimal('299.000000'),
+            'p_close': Decimal('301.400000'),
+            'market_cap': Decimal('2260000000000.000000')
+        }])
+
+    def test_invalid_rows_are_rejected_with_their_row_number(self):
+        columns = self.get_columns([
+            ('MSFT', '2021-08-25', '300', '302', '299', '301', '1000'),
+            ('MSFT', '2021-08-26', '300', '302', '299', 'abc', '1000'),
+            ('MSFT', '2021-08-27', '300', '298', '299', '301', '1000'),
+            ('MSFT', '2021-08-30', '300', '302', '299', '301', None),
+            ('', 'not a date', '300', '302', '299', '301', '1000'),
+        ])
+        documents, rejects = validate_columns(EQUITY_FIELDS, columns, 101, check_equity)
+        self.assertEqual([document['md_date'] for document in documents], [date(2021, 8, 25)])
+        self.assertEqual([row for row, error in rejects], [102, 103, 104, 105])
+        self.assertEqual(rejects[0][1], 'p_close: abc is not a number')
+        self.assertEqual(rejects[1][1], 'p_low: greater than p_high')
+        # the first error of a row is reported
+        self.assertTrue(rejects[3][1].startswith('label: '))
+
+    def test_negative_and_oversized_numbers(self):
+        columns = self.get_columns([
+            ('MSFT', '2021-08-25', '-1', '302', '299', '301', '1000'),
+            ('MSFT', '2021-08-26', '300', '302', '299', '301', '1' * 20),
+        ])
+        documents, rejects = validate_columns(EQUITY_FIELDS, columns, 1)
+        self.assertEqual(documents, [])
+        self.assertEqual(rejects, [
+            (1, 'p_open: -1 is not a positive number'),
+            (2, 'market_cap: {0} has more than 22 digits'.format('1' * 20))
+        ])
+
+
+class RacingCollection:
+    # another writer inserts the open bucket of the interval at the same time
+    # as the upsert of the first group: the upsert fails with a duplicate key
+    def __init__(self, collection, bucket):
+        self.collection = collection
+        self.bucket = bucket
+
+    def bulk_write(self, operations, ordered=True):
+        if self.bucket is None:
+            return self.collection.bulk_write(operations, ordered=ordered)
+        self.collection.bulk_write(operations[:1], ordered=ordered)
+        self.collection.insert_one(self.bucket)
+        self.bucket = None
+        raise BulkWriteError({
+            'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': 'E11000 duplicate key error'}],
+            'writeConcernErrors': [], 'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0,
+            'nRemoved': 0, 'upserted': []
+        })
+
+
+class TickStoreTests(TestCase):
+    def setUp(self):
+        # the documents written with pymongo are not rolled back
+        get_collection(TickBucket).delete_many({})
+
+    def test_ticks_are_grouped_by_bucket(self):
+        result = write_ticks(TickBucket, [
+            ('MSFT', utc(2021, 8, 25, 18, 59, 42), 301.5),
+            ('MSFT', utc(2021, 8, 25, 18, 10), 300.0),
+            ('MSFT', utc(2021, 8, 25, 19, 0, 1), 302.0),
+            ('TSLA', utc(2021, 8, 25, 18, 30), 713.66),
+        ])
+        self.assertEqual(result, {'ticks': 4, 'buckets': 3})
+        bucket = get_collection(TickBucket).find_one({'label': 'MSFT', 'bucket_start': datetime(2021, 8, 25, 18)})
+        self.assertEqual(bucket['count'], 2)
+        self.assertEqual(bucket['prices'], [300.0, 301.5])
+        self.assertEqual((bucket['p_low'], bucket['p_high']), (300.0, 301.5))
+        self.assertEqual(bucket['bucket_end'], datetime(2021, 8, 25, 19))
+
+    def test_read_window(self):
+        write_ticks(TickBucket, [
+            ('MSFT', utc(2021, 8, 25, 18, 10), 300.0),
+            ('MSFT', utc(2021, 8, 25, 18, 40), 301.0),
+            ('MSFT', utc(2021, 8, 25, 19, 0), 302.0),
+            ('MSFT', utc(2021, 8, 25, 19, 20), 303.0),
+        ])
+        ticks = read_ticks(TickBucket, 'MSFT', utc(2021, 8, 25, 18, 40), utc(2021, 8, 25, 19, 20))
+        self.assertEqual(ticks, {
+            'label': 'MSFT',
+            'timestamps': ['2021-08-25T18:40:00.000000Z', '2021-08-25T19:00:00.000000Z'],
+            'prices': [301.0, 302.0]
+        })
+
+    def test_late_ticks_are_read_in_order(self):
+        write_ticks(TickBucket, [('MSFT', utc(2021, 8, 25, 18, 40), 301.0)])
+        write_ticks(TickBucket, [('MSFT', utc(2021, 8, 25, 18, 10), 300.0)])
+        ticks = read_ticks(TickBucket, 'MSFT', utc(2021, 8, 25), utc(2021, 8, 26))
+        self.assertEqual(ticks['prices'], [300.0, 301.0])
+
+    def test_full_bucket_overflows(self):
+        with mock.patch.object(tickstore, 'TICK_BUCKET_SIZE', 2):
+            write_ticks(TickBucket, [('MSFT', utc(2021, 8, 25, 18, minute), 300.0 + minute) for minute in (1, 2)])
+            write_ticks(TickBucket, [('MSFT', utc(2021, 8, 25, 18, 3), 303.0)])
+        self.assertEqual(get_collection(TickBucket).count_documents({'label': 'MSFT'}), 2)
+        # only the last bucket of the interval receives the new ticks
+        self.assertEqual(get_collection(TickBucket).find_one({'label': 'MSFT', 'open': True})['prices'], [303.0])
+        ticks = read_ticks(TickBucket, 'MSFT', utc(2021, 8, 25), utc(2021, 8, 26))
+        self.assertEqual(ticks['prices'], [301.0, 302.0, 303.0])
+
+    def test_ids_are_only_reserved_for_new_buckets(self):
+        write_ticks(TickBucket, [('MSFT', utc(2021, 8, 25, 18, 10), 300.0)])
+        bucket_id = get_collection(TickBucket).find_one({'label': 'MSFT'})['id']
+        sequence = get_sequence(TickBucket)
+        write_ticks(TickBucket, [
+            ('MSFT', utc(2021, 8, 25, 18, 20), 301.0),
+            ('MSFT', utc(2021, 8, 25, 19, 10), 302.0),
+        ])
+        self.assertEqual(get_sequence(TickBucket), sequence + 1)
+        buckets = get_collection(TickBucket).find({'label': 'MSFT'}, sort=[('bucket_start', 1)])
+        self.assertEqual([bucket['id'] for bucket in buckets], [bucket_id, sequence + 1])
+
+    def test_bucket_opened_by_another_writer(self):
+        collection = RacingCollection(get_collection(TickBucket), {
+            'label': 'MSFT', 'bucket_start': datetime(2021, 8, 25, 18), 'bucket_end': datetime(2021, 8, 25, 19),
+            'open': True, 'count': 1, 'p_low': 300.0, 'p_high': 300.0,
+            'timestamps': [datetime(2021, 8, 25, 18, 10)], 'prices': [300.0]
+        })
+        with mock.patch.object(tickstore, 'get_collection', return_value=collection):
+            write_ticks(TickBucket, [('MSFT', utc(2021, 8, 25, 18, 20), 301.0)])
+        # the group is written again into the bucket of the other writer
+        buckets = list(get_collection(TickBucket).find({'label': 'MSFT'}))
+        self.assertEqual(len(buckets), 1)
+        self.assertEqual((buckets[0]['count'], buckets[0]['prices']), (2, [300.0, 301.0]))
@@ -0,0 +1,162 @@
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta
+from .mongo import get_collection, allocate_ids
+
+# intraday ticks are stored outside of the daily Equity documents in bucket
+# documents, one for each label and fixed time interval, holding parallel
+# arrays of timestamps and prices (the MongoDB time series bucket pattern):
+# {
+#     "label": "TSLA",
+#     "bucket_start": "2021-08-25T18:00:00Z",
+#     "bucket_end": "2021-08-25T19:00:00Z",
+#     "count": 2,
+#     "p_low": 713.66,
+#     "p_high": 715.57,
+#     "timestamps": ["2021-08-25T18:59:16.512000Z", "2021-08-25T18:59:42.776799Z"],
+#     "prices": [715.57, 713.66]
+# }
+# a bucket holds at most TICK_BUCKET_SIZE ticks, once full a new bucket
+# is created for the same interval. Only the last bucket of an interval is
+# open (open: true) and receives the ticks, a partial unique index on
+# label/bucket_start of the open buckets (migration 0006) keeps concurrent
+# writers from opening two buckets for the same interval: the writer whose
+# insert fails with a duplicate key writes its group again, into the bucket
+# opened by the other one
+TICK_BUCKET_SECONDS = getattr(settings, 'TICK_BUCKET_SECONDS', 3600)
+TICK_BUCKET_SIZE = getattr(settings, 'TICK_BUCKET_SIZE', 1000)
+TICK_WRITE_RETRIES = 5
+DUPLICATE_KEY_ERROR = 11000
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def to_utc(timestamp):
+    # pymongo returns naive UTC datetimes, old documents may have strings
+    if isinstance(timestamp, str):
+        timestamp = parse_datetime(timestamp)
+    if timezone.is_naive(timestamp):
+        return timezone.make_aware(timestamp, timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def get_bucket_start(timestamp):
+    epoch = int(timestamp.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % TICK_BUCKET_SECONDS, tz=timezone.utc)
+
+
+def get_group_operations(label, bucket_start, group):
+    # the open bucket without room for the group is closed, then the group is
+    # appended to the open bucket or inserted in a new one
+    prices = [price for timestamp, price in group]
+    return [
+        UpdateOne(
+            {
+                'label': label,
+                'bucket_start': bucket_start,
+                'open': True,
+                'count': {'$gt': TICK_BUCKET_SIZE - len(group)}
+            },
+            {'$set': {'open': False}}
+        ),
+        UpdateOne(
+            {
+                'label': label,
+                'bucket_start': bucket_start,
+                'open': True
+            },
+            {
+                '$push': {
+                    'timestamps': {'$each': [timestamp for timestamp, price in group]},
+                    'prices': {'$each': prices}
+                },
+                '$inc': {'count': len(group)},
+                '$min': {'p_low': min(prices)},
+                '$max': {'p_high': max(prices)},
+                '$setOnInsert': {'bucket_end': bucket_start + timedelta(seconds=TICK_BUCKET_SECONDS)}
+            },
+            upsert=True
+        )
+    ]
+
+
+def write_ticks(model, ticks, using='default'):
+    # ticks is a list of (label, timestamp, price) tuples in any order.
+    # They are grouped by bucket and each group is appended with one $push/$each,
+    # upserting the bucket if there is none for the interval with enough room.
+    # The ids are only reserved for the inserted buckets, after the write
+    buckets = {}
+    for label, timestamp, price in ticks:
+        timestamp = to_utc(timestamp)
+        key = (label, get_bucket_start(timestamp))
+        buckets.setdefault(key, []).append((timestamp, float(price)))
+
+    groups = []
+    for (label, bucket_start), bucket_ticks in buckets.items():
+        bucket_ticks.sort()
+        for i in range(0, len(bucket_ticks), TICK_BUCKET_SIZE):
+            groups.append((label, bucket_start, bucket_ticks[i:i + TICK_BUCKET_SIZE]))
+
+    if len(groups) == 0:
+        return {'ticks': 0, 'buckets': 0}
+    operations = []
+    for label, bucket_start, group in groups:
+        operations.extend(get_group_operations(label, bucket_start, group))
+
+    # ordered: the close of a bucket runs before the upsert of its group
+    collection = get_collection(model, using)
+    inserted = []
+    start = 0
+    for attempt in range(TICK_WRITE_RETRIES + 1):
+        try:
+            result = collection.bulk_write(operations[start:], ordered=True)
+            inserted.extend(upsert['_id'] for upsert in result.bulk_api_result['upserted'])
+            break
+        except BulkWriteError as err:
+            inserted.extend(upsert['_id'] for upsert in err.details['upserted'])
+            error = err.details['writeErrors'][0]
+            if error['code'] != DUPLICATE_KEY_ERROR or attempt == TICK_WRITE_RETRIES:
+                raise
+            # another writer opened a bucket of the interval between the close
+            # and the upsert: the group is written again from its close
+            start += error['index'] - error['index'] % 2
+
+    if len(inserted) != 0:
+        next_id = allocate_ids(model, len(inserted), using)
+        collection.bulk_write([
+            UpdateOne({'_id': _id}, {'$set': {'id': next_id + i}}) for i, _id in enumerate(inserted)
+        ], ordered=False)
+    return {'ticks': len(ticks), 'buckets': len(groups)}
+
+
+def read_ticks(model, label, start, end, using='default'):
+    # ticks of a label with start <= timestamp < end as parallel arrays
+    # only the buckets overlapping the window are read
+    start = to_utc(start)
+    end = to_utc(end)
+    buckets = get_collection(model, using).find(
+        {
+            'label': label,
+            'bucket_start': {'$lt': end},
+            'bucket_end': {'$gt': start}
+        },
+        {'_id': 0, 'timestamps': 1, 'prices': 1}
+    )
+
+    ticks = []
+    for bucket in buckets:
+        for timestamp, price in zip(bucket['timestamps'], bucket['prices']):
+            timestamp = to_utc(timestamp)
+            if start <= timestamp < end:
+                ticks.append((timestamp, price))
+    # overflow buckets of the same interval can overlap in time
+    ticks.sort()
+
+    return {
+        'label': label,
+        'timestamps': [timestamp.strftime(TIMESTAMP_FORMAT) for timestamp, price in ticks],
+        'prices': [price for timestamp, price in ticks]
+    }
@@ -0,0 +1,83 @@
+from bson.decimal128 import Decimal128
+from bson.son import SON
+from datetime import datetime, time
+from .mongo import get_collection
+
+# daily bars of a label as parallel arrays read directly from MongoDB,
+# without the ORM and the per row serializer:
+# {
+#     "label": "MSFT",
+#     "dates": ["2021-08-23", "2021-08-24", "2021-08-25"],
+#     "open": [303.25, 305.02, 304.3],
+#     "high": [305.4, 305.65, 304.59],
+#     "low": [301.85, 302.0, 300.42],
+#     "close": [304.36, 302.62, 302.01]
+# }
+
+OHLC_FIELDS = {
+    'open': 'p_open',
+    'high': 'p_high',
+    'low': 'p_low',
+    'close': 'p_close'
+}
+
+
+def to_float(value):
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    return float(value) if value is not None else None
+
+
+def read_ohlc(model, label, start=None, end=None, using='default'):
+    # start and end are dates (inclusive), served by the label/md_date index
+    query = {'label': label}
+    md_date = {}
+    if start is not None:
+        md_date['$gte'] = datetime.combine(start, time())
+    if end is not None:
+        md_date['$lte'] = datetime.combine(end, time())
+    if len(md_date) != 0:
+        query['md_date'] = md_date
+
+    projection = {'_id': 0, 'md_date': 1}
+    for field in OHLC_FIELDS.values():
+        projection[field] = 1
+
+    data = {'label': label, 'dates': []}
+    for key in OHLC_FIELDS:
+        data[key] = []
+    for document in get_collection(model, using).find(query, projection).sort('md_date', 1):
+        data['dates'].append(document['md_date'].date().isoformat())
+        for key, field in OHLC_FIELDS.items():
+            data[key].append(to_float(document.get(field)))
+    return data
+
+
+def read_summary(model, labels=None, using='default'):
+    # first/last md_date and number of documents of every label (or of the
+    # labels given), the high-water marks of the incremental feeds. Only the
+    # label and md_date fields are read so the pipeline is covered by the
+    # label/md_date index and no document is fetched
+    pipeline = []
+    if labels is not None:
+        pipeline.append({'$match': {'label': {'$in': list(labels)}}})
+    pipeline.extend([
+        {'$sort': SON([('label', 1), ('md_date', 1)])},
+        {'$project': {'_id': 0, 'label': 1, 'md_date': 1}},
+        {'$group': {
+            '_id': '$label',
+            'first_md_date': {'$first': '$md_date'},
+            'last_md_date': {'$last': '$md_date'},
+            'count': {'$sum': 1}
+        }},
+        {'$sort': {'_id': 1}}
+    ])
+    return [
+        {
+            'label': document['_id'],
+            'first_md_date': document['first_md_date'].date().isoformat(),
+            'last_md_date': document['last_md_date'].date().isoformat(),
+            'count': document['count']
+        }
+        for document in get_collection(model, using).aggregate(pipeline)
+    ]
@@ -1,34 +1,427 @@
 from django.shortcuts import render
+from django.utils.dateparse import parse_date
+from datetime import datetime, time, timedelta
 from rest_framework import serializers
 from rest_framework.response import Response
-from rest_framework import viewsets
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from pymongo.errors import BulkWriteError
 from django_filters import rest_framework as filters
 from rest_framework.filters import SearchFilter, OrderingFilter
-from .models import Equity
+from rest_framework.exceptions import ValidationError
+from .models import Equity, TickBucket
+from .mongo import bulk_upsert_equities, update_snapshots, get_collection
+from .tickstore import write_ticks, read_ticks
+from .pagination import KeysetPagination
+from .timeseries import read_ohlc, read_summary
+from .encoding import encode_response
+from .aggregation import resample, IntervalError
+from .cache import (
+    CachedReadMixin, invalidate_equities, equity_namespace, dividend_namespace, get_label, forget_label,
+    EQUITIES_ALL, DIVIDENDS_ALL
+)
+from .metrics import TimedSerializerMixin, phase
+from .export import ExportSerializer, export_response
+from .native import (
+    use_native_reads, to_representation, get_projection, to_mongo_date,
+    search_query, find_one, find_by_labels, get_sort
+)
 from apps.dividends.models import Dividend
-from apps.dividends.views import DividendSerializer
+from apps.dividends.views import DividendSerializer, DividendWritesMixin, with_equity_label
+from apps.securities.models import Security
+from apps.securities.views import SecuritySerializer, SECURITY_FIELDS, upsert_securities
 
-class EquitySerializer(serializers.ModelSerializer):
+class EquitySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Equity
         fields = '__all__'
 
+    # fields (optional) limits the output to a subset of the model fields
+    # embed_security adds the Security of the label, the securities are
+    # passed in the context by label so that they are read once per page
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        embed_security = kwargs.pop('embed_security', False)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+        if embed_security:
+            self.fields['security'] = serializers.SerializerMethodField()
+
+    def get_security(self, equity):
+        security = self.context['securities'].get(equity.label)
+        return SecuritySerializer(security).data if security is not None else None
+
+class TickDataSerializer(serializers.Serializer):
+    timestamp = serializers.DateTimeField()
+    p_mkt = serializers.FloatField()
+
+# used only to validate the payloads of the bulk upsert, the documents
+# are written with pymongo and never go through the ORM
+class EquityUpsertSerializer(serializers.ModelSerializer):
+    tickdata = TickDataSerializer(many=True, required=False)
+    # the reference data of the label can be sent with the daily fields,
+    # it is written to the Security of the label
+    description = serializers.CharField(max_length=255, required=False)
+    industry = serializers.CharField(max_length=255, required=False)
+    country = serializers.CharField(max_length=50, required=False)
+    currency = serializers.CharField(max_length=5, required=False)
+    market = serializers.CharField(max_length=50, required=False)
+    exchange = serializers.CharField(max_length=20, required=False)
+    class Meta:
+        model = Equity
+        exclude = ('id',)
+        extra_kwargs = {'md_date': {'required': True}}
+        validators = []
+
+class TickAppendSerializer(serializers.Serializer):
+    label = serializers.CharField(max_length=20)
+    md_date = serializers.DateField()
+    tickdata = TickDataSerializer(many=True, allow_empty=False)
+    # the daily prices of the snapshot can be updated together with the ticks
+    p_high = serializers.DecimalField(max_digits=16, decimal_places=6, required=False)
+    p_close = serializers.DecimalField(max_digits=16, decimal_places=6, required=False)
+    p_low = serializers.DecimalField(max_digits=16, decimal_places=6, required=False)
+    p_open = serializers.DecimalField(max_digits=16, decimal_places=6, required=False)
+    market_cap = serializers.DecimalField(max_digits=22, decimal_places=6, required=False)
+
+# daily prices of TickAppendSerializer
+SNAPSHOT_FIELDS = ('p_high', 'p_close', 'p_low', 'p_open', 'market_cap')
+
+class TickRangeSerializer(serializers.Serializer):
+    label = serializers.CharField(max_length=20)
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+
+class OHLCRangeSerializer(serializers.Serializer):
+    label = serializers.CharField(max_length=20)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+# ?labels=MSFT,AAPL, all the labels when missing
+class EquitySummarySerializer(serializers.Serializer):
+    labels = serializers.CharField(required=False)
+
+    def validate_labels(self, value):
+        return [label.strip() for label in value.split(',') if label.strip() != '']
+
+# filters of the equities list on the native read path
+class EquityFilterSerializer(serializers.Serializer):
+    label = serializers.CharField(required=False)
+    md_date = serializers.DateField(required=False)
+    search = serializers.CharField(required=False, allow_blank=True)
+
+# a date (YYYY-MM-DD) or a timestamp, the dates are kept as dates so that
+# an end date includes the whole day with the bars and with the ticks
+class DateOrDateTimeField(serializers.DateTimeField):
+    def to_internal_value(self, value):
+        try:
+            day = parse_date(value) if isinstance(value, str) else None
+        except ValueError:
+            day = None
+        if day is not None:
+            return day
+        return super().to_internal_value(value)
+
+class ResampleSerializer(serializers.Serializer):
+    label = serializers.CharField(max_length=20)
+    interval = serializers.CharField(max_length=10)
+    # dates or timestamps, the bars only use the date
+    start = DateOrDateTimeField(required=False)
+    end = DateOrDateTimeField(required=False)
+    source = serializers.ChoiceField(choices=['bars', 'ticks'], required=False)
+
+def parse_fields(model, fields):
+    # ?fields=label,md_date,p_close, None if all the fields are returned
+    if fields is None:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip() != '']
+    # the stored fields only, not the reverse relations
+    unknown = set(fields) - set(field.name for field in model._meta.concrete_fields)
+    if len(unknown) != 0:
+        raise ValidationError({'fields': 'Unknown fields: {0}'.format(', '.join(sorted(unknown)))})
+    return fields
+
+def build_equities_query(filters):
+    # MongoDB query of the validated EquityFilterSerializer filters
+    query = {}
+    if 'label' in filters:
+        query['label'] = filters['label']
+    if 'md_date' in filters:
+        query['md_date'] = to_mongo_date(filters['md_date'])
+    if filters.get('search'):
+        # md_date is stored as a date, the terms are only matched on the label
+        query.update(search_query(filters['search'], ['label']))
+    return query
+
+def write_equity_ticks(entries):
+    # the tickdata of the payloads goes to the tick buckets of the label
+    ticks = []
+    for entry in entries:
+        for tick in entry.pop('tickdata', None) or []:
+            ticks.append((entry['label'], tick['timestamp'], tick['p_mkt']))
+    return write_ticks(TickBucket, ticks)
+
+def write_equity_securities(entries):
+    # the reference data of the payloads goes to the Security of the label
+    securities = {}
+    for entry in entries:
+        security = {field: entry.pop(field) for field in SECURITY_FIELDS if field in entry}
+        if len(security) != 0:
+            securities.setdefault(entry['label'], {'label': entry['label']}).update(security)
+    return upsert_securities(list(securities.values()))
+
 # Create your views here.
-class EquitiesViewSet(viewsets.ModelViewSet):
+class EquitiesViewSet(CachedReadMixin, viewsets.ModelViewSet):
     serializer_class = EquitySerializer
     queryset = Equity.objects.all()
 
+    # the lists are paginated with ?page_size or ?cursor only, the pages
+    # are ordered by md_date (or -md_date) by the keyset pagination
     filter_backends = (filters.DjangoFilterBackend, SearchFilter, OrderingFilter)
     filterset_fields = ('label','md_date')
     search_fields = ('label','md_date')
     ordering = ('md_date')
+    pagination_class = KeysetPagination
+
+    # ?fields=label,md_date,p_close returns only these fields
+    # and only these are read from MongoDB (projection)
+    def get_projection(self):
+        if self.action not in ('list', 'retrieve'):
+            return None
+        return parse_fields(Equity, self.request.query_params.get('fields'))
+
+    # override method of GenericAPIView
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_projection()
+        if fields is not None:
+            # md_date (and the primary key) are needed by the keyset pagination
+            queryset = queryset.only(*(set(fields) | {'md_date'}))
+        return queryset
+
+    # override method of GenericAPIView
+    # a list of equities in the POST request body is created in bulk
+    def get_serializer(self, *args, **kwargs):
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        fields = self.get_projection()
+        if fields is not None:
+            kwargs['fields'] = fields
+        if self.get_embed_security() and len(args) != 0:
+            equities = args[0] if kwargs.get('many') else [args[0]]
+            labels = set(equity.label for equity in equities)
+            kwargs['embed_security'] = True
+            kwargs['context'] = self.get_serializer_context()
+            kwargs['context']['securities'] = Security.objects.in_bulk(labels, field_name='label')
+        return super().get_serializer(*args, **kwargs)
 
-class EquityDividendsViewSet(viewsets.ModelViewSet):
+    # ?embed=security adds the reference data of the label to each equity
+    def get_embed_security(self):
+        if self.action not in ('list', 'retrieve'):
+            return False
+        return 'security' in self.request.query_params.get('embed', '').split(',')
+
+    # override methods of ModelViewSet, with the native read path the
+    # documents are read with pymongo (see native.py)
+    def list(self, request, *args, **kwargs):
+        if not use_native_reads(request):
+            return super().list(request, *args, **kwargs)
+        serializer = EquityFilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = build_equities_query(serializer.validated_data)
+
+        fields = self.get_projection()
+        paginator = self.paginator
+        if not paginator.is_requested(request):
+            documents = get_collection(Equity).find(query, get_projection(Equity, fields)).sort(
+                get_sort(Equity, request.query_params.get('ordering'), self.ordering)
+            )
+            return Response(self.represent_equities(list(documents), fields))
+        documents = paginator.paginate_collection(
+            get_collection(Equity), query, get_projection(Equity, fields), request, Equity
+        )
+        return paginator.get_paginated_response(self.represent_equities(documents, fields))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not use_native_reads(request):
+            return super().retrieve(request, *args, **kwargs)
+        document = find_one(Equity, kwargs['pk'])
+        return Response(self.represent_equities([document], self.get_projection())[0])
+
+    def represent_equities(self, documents, fields):
+        with phase('serialize'):
+            data = [to_representation(Equity, document, fields) for document in documents]
+            if self.get_embed_security():
+                securities = find_by_labels(Security, set(document['label'] for document in documents))
+                for equity, document in zip(data, documents):
+                    security = securities.get(document['label'])
+                    equity['security'] = to_representation(Security, security) if security is not None else None
+        return data
+
+    # the GET requests filtered by label and the ones of a document
+    # (/equities/:id/, /equities/:id/ticks/) are cached in the namespace of
+    # the label, the other ones in equities:all
+    def get_cache_namespaces(self, request, kwargs):
+        label = request.GET.get('label')
+        if label is None and 'pk' in kwargs:
+            label = get_label(Equity, kwargs['pk'])
+        if label is not None:
+            return [equity_namespace(label)]
+        return [EQUITIES_ALL]
+
+    # override methods of ModelViewSet, the writes invalidate the cache
+    def perform_create(self, serializer):
+        serializer.save()
+        data = serializer.validated_data
+        invalidate_equities([equity['label'] for equity in data] if isinstance(data, list) else [data['label']])
+
+    def perform_update(self, serializer):
+        label = serializer.instance.label
+        serializer.save()
+        if serializer.instance.label != label:
+            forget_label(Equity, serializer.instance.pk)
+        invalidate_equities([label, serializer.instance.label])
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        invalidate_equities([instance.label])
+
+    # POST /equities/bulk/ with a list of equities
+    # one unordered bulk write matched on label/md_date (insert or update)
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_upsert(self, request):
+        serializer = EquityUpsertSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        equities = serializer.validated_data
+        try:
+            ticks = write_equity_ticks(equities)
+            securities = write_equity_securities(equities)
+            result = bulk_upsert_equities(Equity, equities)
+        except BulkWriteError as err:
+            return Response(
+                {'errors': [e['errmsg'] for e in err.details['writeErrors']]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        finally:
+            # unordered: the other documents are written even if some fail
+            invalidate_equities([equity['label'] for equity in equities])
+        result['ticks'] = ticks['ticks']
+        result['securities'] = securities['matched'] + securities['upserted']
+        return Response(result, status=status.HTTP_200_OK)
+
+    # GET /equities/range/?label=&start=&end= daily OHLC as parallel arrays
+    # read with pymongo and encoded without the serializers (see timeseries.py)
+    @action(detail=False, methods=['get'], url_path='range')
+    def ohlc_range(self, request):
+        serializer = OHLCRangeSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return encode_response(request, read_ohlc(Equity, **serializer.validated_data))
+
+    # GET /equities/summary/?labels= first/last md_date and count of each
+    # label, used by the feeder to send only the missing trading dates
+    @action(detail=False, methods=['get'], url_path='summary')
+    def summary(self, request):
+        serializer = EquitySummarySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(read_summary(Equity, serializer.validated_data.get('labels')))
+
+    # GET /equities/export/?labels=&start=&end=&encoding=csv|parquet|arrow
+    # daily bars streamed from a MongoDB cursor (see export.py)
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        serializer = ExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return export_response('equities', serializer.validated_data)
+
+    # GET /equities/resample/?label=&interval=1w&start=&end=&source=
+    # OHLC bars of the interval computed by a MongoDB aggregation pipeline
+    @action(detail=False, methods=['get'], url_path='resample')
+    def resample_bars(self, request):
+        serializer = ResampleSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        try:
+            data = resample(Equity, TickBucket, **serializer.validated_data)
+        except IntervalError as err:
+            raise ValidationError({'interval': str(err)})
+        return encode_response(request, data)
+
+    # GET /equities/ticks/?label=&start=&end= ticks as parallel arrays
+    # POST /equities/ticks/ with a list of {label, md_date, tickdata, ...}
+    # the ticks are appended to the tick buckets and the optional daily prices
+    # are set on the existing label/md_date documents
+    @action(detail=False, methods=['get', 'post'], url_path='ticks')
+    def ticks(self, request):
+        if request.method == 'GET':
+            serializer = TickRangeSerializer(data=request.query_params)
+            serializer.is_valid(raise_exception=True)
+            return Response(read_ticks(TickBucket, **serializer.validated_data))
+
+        serializer = TickAppendSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        entries = serializer.validated_data
+        result = write_equity_ticks(entries)
+        result['missing'] = update_snapshots(Equity, entries)
+        invalidate_equities(
+            [entry['label'] for entry in entries],
+            ticks_only=not any(field in entry for entry in entries for field in SNAPSHOT_FIELDS)
+        )
+        return Response(result, status=status.HTTP_200_OK)
+
+    # GET /equities/:id/ticks/ ticks of the md_date of the equity
+    # POST /equities/:id/ticks/ with a list of {timestamp, p_mkt}
+    @action(detail=True, methods=['get', 'post'], url_path='ticks')
+    def equity_ticks(self, request, pk=None):
+        equity = self.get_object()
+        if request.method == 'GET':
+            start = datetime.combine(equity.md_date, time())
+            return Response(read_ticks(TickBucket, equity.label, start, start + timedelta(days=1)))
+
+        serializer = TickDataSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        result = write_equity_ticks([{
+            'label': equity.label,
+            'tickdata': serializer.validated_data
+        }])
+        invalidate_equities([equity.label], ticks_only=True)
+        return Response(result, status=status.HTTP_200_OK)
+
+class EquityDividendsViewSet(CachedReadMixin, DividendWritesMixin, viewsets.ModelViewSet):
     serializer_class = DividendSerializer
     queryset = Dividend.objects.all()
 
+    # the dividends of the label of the equity
+    def get_cache_namespaces(self, request, kwargs):
+        label = get_label(Equity, kwargs['equity_pk'])
+        if label is not None:
+            return [dividend_namespace(label)]
+        return [DIVIDENDS_ALL]
+
     # override method of ModelViewSet
+    # the dividends of the label of the equity (one document per label)
     def list(self, request, equity_pk):
-        dividends = Dividend.objects.filter(equity = equity_pk)
+        if use_native_reads(request):
+            equity = find_one(Equity, equity_pk)
+            documents = get_collection(Dividend).find({'label': equity['label']}, get_projection(Dividend))
+            with phase('serialize'):
+                return Response([to_representation(Dividend, document) for document in documents])
+        equity = get_object_or_404(Equity, pk=equity_pk)
+        dividends = Dividend.objects.filter(label = equity.label)
         serializer = self.get_serializer(dividends, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+    # override method of ModelViewSet
+    # a dividend of the label of the equity
+    def create(self, request, equity_pk):
+        equity = get_object_or_404(Equity, pk=equity_pk)
+        serializer = self.get_serializer(data=with_equity_label(request.data, equity.label))
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not use_native_reads(request):
+            return super().retrieve(request, *args, **kwargs)
+        return Response(to_representation(Dividend, find_one(Dividend, kwargs['pk'])))
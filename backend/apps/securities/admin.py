@@ -0,0 +1,5 @@
+from django.contrib import admin
+from .models import Security
+
+# Register your models here.
+admin.site.register(Security)
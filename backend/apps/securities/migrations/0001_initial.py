@@ -0,0 +1,29 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Security',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=20, unique=True)),
+                ('date_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('description', models.CharField(max_length=255)),
+                ('industry', models.CharField(max_length=255)),
+                ('country', models.CharField(max_length=50)),
+                ('currency', models.CharField(max_length=5)),
+                ('market', models.CharField(max_length=50)),
+                ('exchange', models.CharField(max_length=20)),
+            ],
+        ),
+    ]
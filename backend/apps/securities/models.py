@@ -0,0 +1,18 @@
+from django.db import models
+from django.utils import timezone
+
+# Create your models here.
+# reference data of a security which does not change from one trading date
+# to the next one, the daily Equity documents reference it by label
+class Security(models.Model):
+    label = models.CharField(max_length=20, unique=True)
+    date_time = models.DateTimeField(default=timezone.now)
+    description = models.CharField(max_length=255)
+    industry = models.CharField(max_length=255)
+    country = models.CharField(max_length=50)
+    currency = models.CharField(max_length=5)
+    market = models.CharField(max_length=50)
+    exchange = models.CharField(max_length=20)
+
+    def __str__(self):
+        return self.label
@@ -0,0 +1,6 @@
+from rest_framework import routers
+from .views import SecuritiesViewSet
+
+router = routers.SimpleRouter()
+router.register('', SecuritiesViewSet)
+urlpatterns = router.urls
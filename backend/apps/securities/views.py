@@ -0,0 +1,74 @@
+from django.shortcuts import render
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from pymongo.errors import BulkWriteError
+from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter, OrderingFilter
+from apps.equities.mongo import bulk_upsert
+from apps.equities.cache import invalidate_equities
+from apps.equities.metrics import TimedSerializerMixin
+from .models import Security
+
+SECURITY_FIELDS = ('description', 'industry', 'country', 'currency', 'market', 'exchange')
+
+class SecuritySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Security
+        fields = '__all__'
+
+# used only to validate the payloads of the bulk upsert
+class SecurityUpsertSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Security
+        exclude = ('id',)
+        extra_kwargs = {'label': {'validators': []}}
+
+def upsert_securities(securities):
+    # one document for each label, matched on the unique label
+    # the cached equities embedding these securities are invalidated
+    result = bulk_upsert(Security, securities, ('label',))
+    invalidate_equities([security['label'] for security in securities])
+    return result
+
+# Create your views here.
+class SecuritiesViewSet(viewsets.ModelViewSet):
+    serializer_class = SecuritySerializer
+    queryset = Security.objects.all()
+    # /securities/:label/ (labels can contain dots, e.g. BRK.B)
+    lookup_field = 'label'
+    lookup_value_regex = '[^/]+'
+
+    filter_backends = (filters.DjangoFilterBackend, SearchFilter, OrderingFilter)
+    filterset_fields = ('country', 'currency', 'market', 'exchange', 'industry')
+    search_fields = ('label', 'description')
+    ordering = ('label')
+
+    # the writes invalidate the cached equities of the label (?embed=security)
+    def perform_create(self, serializer):
+        serializer.save()
+        invalidate_equities([serializer.instance.label])
+
+    def perform_update(self, serializer):
+        label = serializer.instance.label
+        serializer.save()
+        invalidate_equities([label, serializer.instance.label])
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        invalidate_equities([instance.label])
+
+    # POST /securities/bulk/ with a list of securities (insert or update by label)
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_upsert(self, request):
+        serializer = SecurityUpsertSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            result = upsert_securities(serializer.validated_data)
+        except BulkWriteError as err:
+            return Response(
+                {'errors': [e['errmsg'] for e in err.details['writeErrors']]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(result, status=status.HTTP_200_OK)
@@ -9,8 +9,29 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# the async API (Motor) serves the equities and dividends CRUD endpoints in
+# the event loop, the other requests go to the Django application
+# uvicorn config.asgi:application --workers 1
+if getattr(settings, 'ASYNC_API_ENABLED', True):
+    from apps.equities.async_http import AsyncRouter
+    from apps.equities.async_views import ROUTES as EQUITIES_ROUTES
+    from apps.dividends.async_views import ROUTES as DIVIDENDS_ROUTES
+    from apps.equities.streaming import stream_ticks
+    from apps.equities.export import stream_export
+
+    application = AsyncRouter(
+        EQUITIES_ROUTES + DIVIDENDS_ROUTES, django_application,
+        asgi_routes=[
+            (r'^/equities/stream/$', stream_ticks),
+            (r'^/(equities|dividends)/export/$', stream_export)
+        ]
+    )
+else:
+    application = django_application
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
     # own apps
     'apps.equities',
     'apps.dividends',
+    'apps.securities',
 
     # third party packages
     'rest_framework',
@@ -55,6 +57,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, to time the whole request (apps/equities/metrics.py)
+    'apps.equities.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,16 +92,110 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# MongoDB client options of djongo (pymongo MongoClient), including the
+# connection pool of each process
+MONGO_CLIENT = {
+    'host': 'mongodb://127.0.0.1:27017',
+    'maxPoolSize': 100,
+    'minPoolSize': 0,
+    'maxIdleTimeMS': 60000,
+    # waiting time for a free connection of the pool before failing
+    'waitQueueTimeoutMS': 10000,
+    'serverSelectionTimeoutMS': 5000
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
         'NAME': 'mddb',
-        #'CLIENT': {
-        #    'host': 'mongodb://127.0.0.1:27017'
-        #}
+        'CLIENT': MONGO_CLIENT
+    }
+}
+
+# async API served over ASGI (config/asgi.py) with the Motor client below:
+# one event loop holds thousands of concurrent requests sharing this pool,
+# the requests waiting for a connection are queued up to waitQueueTimeoutMS
+ASYNC_API_ENABLED = True
+ASYNC_MONGO_CLIENT = dict(MONGO_CLIENT, maxPoolSize=500, minPoolSize=10)
+
+# live ticks streaming of the async API (apps/equities/streaming.py)
+# 'poll' reads the tick buckets every TICK_STREAM_POLL_INTERVAL seconds,
+# 'changestream' watches them (MongoDB replica set only)
+# a slow client keeps at most TICK_STREAM_MAX_PENDING ticks per label
+TICK_STREAM_SOURCE = 'poll'
+TICK_STREAM_POLL_INTERVAL = 1
+TICK_STREAM_MAX_PENDING = 100
+TICK_STREAM_HEARTBEAT = 15
+# the late ticks are published up to TICK_STREAM_LATE_WINDOW seconds after the
+# end of their bucket
+TICK_STREAM_LATE_WINDOW = 3600
+
+# intraday ticks store (apps/equities/tickstore.py)
+# fixed interval of each bucket document and maximum number of ticks per bucket
+TICK_BUCKET_SECONDS = 3600
+TICK_BUCKET_SIZE = 1000
+
+# keyset pagination of the equities list endpoint (apps/equities/pagination.py)
+# default page size and maximum page_size accepted from the clients
+EQUITY_PAGE_SIZE = 100
+EQUITY_MAX_PAGE_SIZE = 1000
+
+# documents read and encoded at a time by the streaming exports
+# (/equities/export/, /dividends/export/, apps/equities/export.py)
+EXPORT_BATCH_SIZE = 10000
+
+# read path of the equities and dividends read endpoints (apps/equities/native.py)
+# 'native' reads the documents with pymongo, 'orm' with the djongo ORM and the
+# serializers, ?read_path= overrides it for a request
+API_READ_PATH = 'native'
+
+# timings of the requests, the ORM queries and the MongoDB commands exposed
+# in the Prometheus format on /metrics/ to METRICS_ALLOWED_IPS only
+# (apps/equities/metrics.py). METRICS_PROFILE_RATE (0 to 1) of the requests
+# run under cProfile, the profiles of the ones slower than
+# METRICS_PROFILE_MIN_DURATION seconds are written to METRICS_PROFILE_DIR
+METRICS_ENABLED = True
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+METRICS_PROFILE_RATE = 0
+METRICS_PROFILE_MIN_DURATION = 0.5
+METRICS_PROFILE_DIR = str(BASE_DIR / 'profiles')
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# 'api' holds the cached GET responses of the API (apps/equities/cache.py).
+# The invalidations must be seen by every process serving the API (and by
+# the management commands writing to MongoDB): API_CACHE_LOCATION (env,
+# host:port of a memcached server, pip install python-memcached) shares the
+# cache between them. Without it the cache is a LocMemCache per process,
+# which apps/equities/cache.py disables when WEB_CONCURRENCY (env, number of
+# gunicorn/uvicorn workers) is above 1. Redis can be used instead with:
+#    'api': {
+#        'BACKEND': 'django_redis.cache.RedisCache',
+#        'LOCATION': 'redis://127.0.0.1:6379/1',
+#    }
+API_CACHE_LOCATION = os.environ.get('API_CACHE_LOCATION')
+API_CACHE_WORKERS = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': API_CACHE_LOCATION,
+    } if API_CACHE_LOCATION else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000
+        }
     }
 }
 
+API_CACHE_ENABLED = True
+API_CACHE_ALIAS = 'api'
+# seconds a cached response is kept (the invalidation does not depend on it)
+API_CACHE_TIMEOUT = 3600
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -15,9 +15,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from apps.equities.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('equities/', include('apps.equities.urls')),
-    path('dividends/', include('apps.dividends.urls'))
+    path('dividends/', include('apps.dividends.urls')),
+    path('securities/', include('apps.securities.urls')),
+    path('metrics/', metrics_view)
 ]
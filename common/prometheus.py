@@ -0,0 +1,94 @@
+import threading
+
+# counters and histograms in the Prometheus text format, shared by the
+# backend (backend/apps/equities/metrics.py) and the feeders
+# (datafeeders/metrics.py), which run without prometheus_client. Each
+# program keeps its metrics in its own registry (a list) and renders it
+#
+#   REGISTRY = []
+#   REQUESTS = Counter('requests_total', 'Requests by status', ('status',), registry=REGISTRY)
+#   REQUESTS.inc(('200',))
+#   render_metrics(REGISTRY)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(label_names, labels, extra=''):
+    values = ['{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+              for name, value in zip(label_names, labels)]
+    if extra != '':
+        values.append(extra)
+    return '{' + ','.join(values) + '}' if len(values) != 0 else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.append(self)
+
+    def inc(self, labels=(), value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation), '# TYPE {0} counter'.format(self.name)]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append('{0}{1} {2}'.format(self.name, format_labels(self.label_names, labels), value))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels: [count of each bucket (not cumulative), sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.append(self)
+
+    def observe(self, labels, value):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def totals(self):
+        # {labels: (sum, count)}
+        with self.lock:
+            return {labels: (total, count) for labels, (counts, total, count) in self.values.items()}
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation), '# TYPE {0} histogram'.format(self.name)]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = 'le="{0}"'.format(bound)
+                    lines.append('{0}_bucket{1} {2}'.format(self.name, format_labels(self.label_names, labels, le), cumulative))
+                lines.append('{0}_bucket{1} {2}'.format(self.name, format_labels(self.label_names, labels, 'le="+Inf"'), count))
+                lines.append('{0}_sum{1} {2}'.format(self.name, format_labels(self.label_names, labels), total))
+                lines.append('{0}_count{1} {2}'.format(self.name, format_labels(self.label_names, labels), count))
+        return lines
+
+
+def render_metrics(registry):
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
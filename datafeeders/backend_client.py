@@ -0,0 +1,265 @@
+import asyncio
+import random
+import aiohttp
+from urllib.parse import urlparse, parse_qs
+
+# asyncio client for the Django backend REST API
+# one client (one aiohttp session) is meant to be shared by all the tasks of
+# an event loop: the connections are pooled and kept alive, and at most
+# max_concurrency requests are in flight at the same time
+#
+#   async with BackendClient() as client:
+#       equities = await asyncio.gather(*[
+#           client.list_equities(label=symbol) for symbol in symbols
+#       ])
+#
+# aiohttp does not pipeline HTTP/1.1 requests on a single connection, the
+# requests are multiplexed over the keep-alive connections of the pool instead
+
+DJANGO_BACKEND_URL = 'http://localhost:8000'
+
+
+class BackendError(Exception):
+    pass
+
+
+class BackendConnectionError(BackendError):
+    pass
+
+
+class BackendTimeoutError(BackendError):
+    pass
+
+
+class BackendHTTPError(BackendError):
+    def __init__(self, method, url, status, body):
+        super().__init__("HTTP {0} {1} ended with {2} status code: {3}".format(method, url, status, body))
+        self.method = method
+        self.url = url
+        self.status = status
+        self.body = body
+
+
+class BackendNotFoundError(BackendHTTPError):
+    pass
+
+
+class BackendResponseError(BackendError):
+    # successful response whose body is not JSON (e.g. the page of a proxy)
+    pass
+
+
+def is_retryable(e):
+    if isinstance(e, (BackendConnectionError, BackendTimeoutError)):
+        return True
+    if isinstance(e, BackendHTTPError):
+        return e.status >= 500 or e.status == 429
+    return False
+
+
+class BackendClient:
+    def __init__(self, base_url=DJANGO_BACKEND_URL, max_concurrency=100, timeout=30,
+                 retries=3, backoff_base=0.5, backoff_max=30, keepalive_timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.semaphore = None
+
+    async def open(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    #=================================================================================
+    # Requests
+    #=================================================================================
+    async def send(self, method, path, payload=None, params=None, timeout=None):
+        # timeout (seconds) overrides the default one of the client for this call
+        # connection errors, timeouts and 5xx/429 responses are retried
+        # with exponential backoff and full jitter. All the failures are
+        # raised as BackendError, never as aiohttp errors
+        if self.session is None:
+            await self.open()
+        url = self.base_url + path
+        if params is not None:
+            params = {k: str(v) for k,v in params.items() if v is not None}
+
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.send_once(method, url, payload, params, timeout)
+            except BackendError as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                await asyncio.sleep(delay)
+
+    async def send_once(self, method, url, payload, params, timeout):
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout is not None else None
+        async with self.semaphore:
+            try:
+                async with self.session.request(method, url, json=payload, params=params, timeout=request_timeout) as r:
+                    if r.status == 404:
+                        raise BackendNotFoundError(method, url, r.status, await r.text())
+                    if r.status >= 400:
+                        raise BackendHTTPError(method, url, r.status, await r.text())
+                    if r.status == 204:
+                        return None
+                    try:
+                        return await r.json()
+                    except (aiohttp.ContentTypeError, ValueError) as e:
+                        raise BackendResponseError("HTTP {0} {1} returned an invalid JSON response: {2}".format(method, url, e)) from e
+            except asyncio.TimeoutError as e:
+                raise BackendTimeoutError("HTTP {0} {1} timed out".format(method, url)) from e
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as e:
+                # also the connections closed by the server and the truncated bodies
+                raise BackendConnectionError("HTTP {0} {1} failed with {2}".format(method, url, e)) from e
+            except aiohttp.ClientError as e:
+                raise BackendError("HTTP {0} {1} failed with {2}".format(method, url, e)) from e
+
+    #=================================================================================
+    # Equities
+    #=================================================================================
+    async def list_equities(self, label=None, md_date=None, search=None, ordering=None,
+                            page_size=None, cursor=None, fields=None, embed=None, timeout=None):
+        # the list of all the equities of the filters, or one page
+        # {"next": url or None, "results": [...]} with page_size or cursor
+        # fields is a list of field names returned (and read from MongoDB)
+        # embed=['security'] adds the reference data of the label
+        params = {
+            'label': label, 'md_date': md_date, 'search': search, 'ordering': ordering,
+            'page_size': page_size, 'cursor': cursor,
+            'fields': ','.join(fields) if fields is not None else None,
+            'embed': ','.join(embed) if embed is not None else None
+        }
+        return await self.send('GET', '/equities/', params=params, timeout=timeout)
+
+    async def iter_equities(self, label=None, md_date=None, search=None, ordering=None,
+                            page_size=1000, fields=None, embed=None, timeout=None):
+        # async generator over the documents of all the pages
+        cursor = None
+        while True:
+            page = await self.list_equities(label, md_date, search, ordering, page_size, cursor, fields, embed, timeout)
+            for equity in page['results']:
+                yield equity
+            if page['next'] is None:
+                break
+            cursor = parse_qs(urlparse(page['next']).query)['cursor'][0]
+
+    async def get_equity(self, equity_id, timeout=None):
+        return await self.send('GET', '/equities/{0}/'.format(equity_id), timeout=timeout)
+
+    async def create_equity(self, payload, timeout=None):
+        return await self.send('POST', '/equities/', payload, timeout=timeout)
+
+    async def update_equity(self, equity_id, payload, timeout=None):
+        return await self.send('PUT', '/equities/{0}/'.format(equity_id), payload, timeout=timeout)
+
+    async def partial_update_equity(self, equity_id, payload, timeout=None):
+        return await self.send('PATCH', '/equities/{0}/'.format(equity_id), payload, timeout=timeout)
+
+    async def delete_equity(self, equity_id, timeout=None):
+        return await self.send('DELETE', '/equities/{0}/'.format(equity_id), timeout=timeout)
+
+    async def bulk_upsert_equities(self, payloads, timeout=None):
+        return await self.send('POST', '/equities/bulk/', payloads, timeout=timeout)
+
+    async def get_range(self, label, start=None, end=None, timeout=None):
+        # daily OHLC of the label as parallel arrays
+        params = {'label': label, 'start': start, 'end': end}
+        return await self.send('GET', '/equities/range/', params=params, timeout=timeout)
+
+    async def resample(self, label, interval, start=None, end=None, source=None, timeout=None):
+        # OHLC bars of the interval (e.g. 15m, 1h, 1w, 1mo), from the daily bars or
+        # the ticks (source='bars' or 'ticks')
+        params = {'label': label, 'interval': interval, 'start': start, 'end': end, 'source': source}
+        return await self.send('GET', '/equities/resample/', params=params, timeout=timeout)
+
+    async def get_equities_summary(self, labels=None, timeout=None):
+        params = {'labels': ','.join(labels) if labels is not None else None}
+        return await self.send('GET', '/equities/summary/', params=params, timeout=timeout)
+
+    async def append_ticks(self, entries, timeout=None):
+        return await self.send('POST', '/equities/ticks/', entries, timeout=timeout)
+
+    async def get_ticks(self, label, start, end, timeout=None):
+        params = {'label': label, 'start': start, 'end': end}
+        return await self.send('GET', '/equities/ticks/', params=params, timeout=timeout)
+
+    async def append_equity_ticks(self, equity_id, ticks, timeout=None):
+        return await self.send('POST', '/equities/{0}/ticks/'.format(equity_id), ticks, timeout=timeout)
+
+    async def get_equity_ticks(self, equity_id, timeout=None):
+        return await self.send('GET', '/equities/{0}/ticks/'.format(equity_id), timeout=timeout)
+
+    async def list_equity_dividends(self, equity_id, timeout=None):
+        return await self.send('GET', '/equities/{0}/dividends/'.format(equity_id), timeout=timeout)
+
+    #=================================================================================
+    # Dividends
+    #=================================================================================
+    async def list_dividends(self, label=None, ex_div_date__gte=None, ex_div_date__lte=None, ordering=None, timeout=None):
+        params = {'label': label, 'ex_div_date__gte': ex_div_date__gte, 'ex_div_date__lte': ex_div_date__lte, 'ordering': ordering}
+        return await self.send('GET', '/dividends/', params=params, timeout=timeout)
+
+    async def dividend_calendar(self, start=None, end=None, labels=None, timeout=None):
+        params = {'start': start, 'end': end, 'labels': ','.join(labels) if labels is not None else None}
+        return await self.send('GET', '/dividends/calendar/', params=params, timeout=timeout)
+
+    async def bulk_upsert_dividends(self, payloads, timeout=None):
+        return await self.send('POST', '/dividends/bulk/', payloads, timeout=timeout)
+
+    async def get_dividend(self, dividend_id, timeout=None):
+        return await self.send('GET', '/dividends/{0}/'.format(dividend_id), timeout=timeout)
+
+    async def create_dividend(self, payload, timeout=None):
+        return await self.send('POST', '/dividends/', payload, timeout=timeout)
+
+    async def update_dividend(self, dividend_id, payload, timeout=None):
+        return await self.send('PUT', '/dividends/{0}/'.format(dividend_id), payload, timeout=timeout)
+
+    async def partial_update_dividend(self, dividend_id, payload, timeout=None):
+        return await self.send('PATCH', '/dividends/{0}/'.format(dividend_id), payload, timeout=timeout)
+
+    async def delete_dividend(self, dividend_id, timeout=None):
+        return await self.send('DELETE', '/dividends/{0}/'.format(dividend_id), timeout=timeout)
+
+    #=================================================================================
+    # Securities
+    #=================================================================================
+    async def list_securities(self, country=None, currency=None, market=None, exchange=None,
+                              industry=None, search=None, ordering=None, timeout=None):
+        params = {
+            'country': country, 'currency': currency, 'market': market, 'exchange': exchange,
+            'industry': industry, 'search': search, 'ordering': ordering
+        }
+        return await self.send('GET', '/securities/', params=params, timeout=timeout)
+
+    async def get_security(self, label, timeout=None):
+        return await self.send('GET', '/securities/{0}/'.format(label), timeout=timeout)
+
+    async def bulk_upsert_securities(self, payloads, timeout=None):
+        return await self.send('POST', '/securities/bulk/', payloads, timeout=timeout)
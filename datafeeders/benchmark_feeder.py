@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import equity_feeder
+import upstream_cache
+from exchange_calendar import previous_trading_day, get_trading_days
+
+# benchmarks of the feeder modes against the fake provider (fake_provider.py)
+# and a local backend, so the numbers only depend on the feeder and the
+# backend and not on Yahoo! Finance. Every mode runs equity_feeder.main
+# in-process with --provider fake, the output of the feeder is hidden
+# unless --verbose is given. Use a dedicated backend database: the symbols
+# of the benchmark start with SYMBOL_PREFIX
+#
+#   python benchmark_feeder.py --url http://localhost:8000 --output feeder.json
+#   python benchmark_feeder.py --compare feeder.json --threshold 0.2
+#
+# the report has the format of the API benchmarks (see
+# backend/apps/equities/benchmark.py) with documents_per_s for the bulk modes
+
+SYMBOL_PREFIX = 'SYNF'
+MODES = [
+    'eqhist_single', 'eqmkt_single', 'eqdvd_single', 'eqhist_backfill', 'eqhist_sync',
+    'eqdvd_backfill', 'eqhist_spool', 'eqhist_cache_cold', 'eqhist_cache_warm', 'tick_collector'
+]
+
+
+def get_symbols(count):
+    return ['{0}{1:04d}'.format(SYMBOL_PREFIX, i) for i in range(count)]
+
+
+# percentile, summarize and compare are a copy of percentile, summarize and
+# compare_reports of backend/apps/equities/benchmark.py (which needs
+# Django), the reports of both must keep the same format
+def percentile(values, q):
+    # nearest rank percentile of the sorted values
+    if len(values) == 0:
+        return None
+    return values[max(0, int(math.ceil(q / 100 * len(values))) - 1)]
+
+
+def summarize(name, latencies, errors, elapsed, documents=None):
+    latencies = sorted(latency * 1000 for latency in latencies)
+    result = {
+        'name': name,
+        'method': 'FEED',
+        'path': name,
+        'iterations': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'p90_ms': round(percentile(latencies, 90), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'max_ms': round(latencies[-1], 3) if latencies else None,
+        'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed > 0 else None
+    }
+    if documents is not None:
+        result['documents'] = documents
+        result['documents_per_s'] = round(documents / elapsed, 3) if elapsed > 0 else None
+    return result
+
+
+def compare(baseline, report, threshold):
+    # prints the p50 of both reports, returns the names of the regressions:
+    # p50 slower or throughput lower by more than threshold (0.2 = 20%)
+    baseline_results = {result['name']: result for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        before = baseline_results.get(result['name'])
+        if before is None or not before['p50_ms'] or not result['p50_ms']:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1
+        print("{0:<24} {1:>10.1f}ms {2:>10.1f}ms {3:>+8.1%}".format(result['name'], before['p50_ms'], result['p50_ms'], change))
+        lower = before['throughput_rps'] and result['throughput_rps'] < before['throughput_rps'] * (1 - threshold)
+        if change > threshold or lower:
+            regressions.append(result['name'])
+    return regressions
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class FeederBenchmark:
+    def __init__(self, url, latency, tickers, days, end_date, verbose=False):
+        self.url = url
+        self.latency = latency
+        self.symbols = get_symbols(tickers)
+        self.end_date = end_date
+        trading_days = get_trading_days(end_date - datetime.timedelta(days=days * 2 + 14), end_date)
+        self.start_date = trading_days[-days]
+        self.verbose = verbose
+        self.tmp_dir = tempfile.mkdtemp(prefix='benchmark_feeder_')
+
+    def close(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def feed(self, *args):
+        # (stats of the run or None, True if it failed)
+        argv = ['--provider', 'fake', '--fakelatency', str(self.latency), '--url', self.url] + list(args)
+        output = None if self.verbose else io.StringIO()
+        with contextlib.redirect_stdout(output) if output is not None else contextlib.suppress():
+            try:
+                return equity_feeder.main(argv), False
+            except SystemExit as e:
+                return None, e.code not in (None, 0)
+
+    def run_single(self, name, iterations, build_argv):
+        latencies, errors = [], 0
+        started = time.time()
+        for i in range(iterations):
+            before = time.perf_counter()
+            stats, failed = self.feed(*build_argv(self.symbols[i % len(self.symbols)]))
+            latencies.append(time.perf_counter() - before)
+            errors += failed
+        return summarize(name, latencies, errors, time.time() - started)
+
+    def run_bulk(self, name, runs, build_argv, count, before_run=None):
+        latencies, errors, documents = [], 0, 0
+        elapsed = 0
+        for i in range(runs):
+            if before_run is not None:
+                before_run()
+            before = time.perf_counter()
+            stats, failed = self.feed(*build_argv())
+            latency = time.perf_counter() - before
+            latencies.append(latency)
+            elapsed += latency
+            errors += failed
+            if stats is not None:
+                documents += stats[count]
+        return summarize(name, latencies, errors, elapsed, documents)
+
+    def get_range_argv(self, *args):
+        return [
+            '--type', 'EQHIST', '--tickers', ','.join(self.symbols),
+            '--sdate', self.start_date.isoformat(), '--edate', self.end_date.isoformat()
+        ] + list(args)
+
+    def run_tick_collector(self, rounds):
+        # polls of every symbol flushed in one append ticks request, as a
+        # collector round (imported here, aiohttp is only needed by this mode)
+        from backend_client import BackendClient
+        from tick_collector import TickCollector
+
+        async def collect():
+            latencies, errors = [], 0
+            async with BackendClient(self.url) as client:
+                collector = TickCollector(client, self.symbols, batch_size=len(self.symbols))
+                for i in range(rounds):
+                    before = time.perf_counter()
+                    await asyncio.gather(*[collector.poll_symbol(symbol) for symbol in self.symbols])
+                    await collector.flush()
+                    latencies.append(time.perf_counter() - before)
+                    errors += len(collector.pending) != 0 or len(collector.missing) != 0
+                collector.executor.shutdown(wait=True)
+            return latencies, errors
+
+        output = None if self.verbose else io.StringIO()
+        with contextlib.redirect_stdout(output) if output is not None else contextlib.suppress():
+            latencies, errors = asyncio.run(collect())
+        return summarize('tick_collector', latencies, errors, sum(latencies), len(self.symbols) * rounds)
+
+    def run(self, mode, iterations, runs):
+        day = self.end_date.isoformat()
+        if mode == 'eqhist_single':
+            return self.run_single(mode, iterations, lambda symbol: ['--type', 'EQHIST', '--ticker', symbol, '--sdate', day, '--edate', day])
+        if mode == 'eqmkt_single':
+            return self.run_single(mode, iterations, lambda symbol: ['--type', 'EQMKT', '--ticker', symbol])
+        if mode == 'eqdvd_single':
+            return self.run_single(mode, iterations, lambda symbol: ['--type', 'EQDVD', '--ticker', symbol])
+        if mode == 'eqhist_backfill':
+            return self.run_bulk(mode, runs, lambda: self.get_range_argv(), 'documents')
+        if mode == 'eqhist_sync':
+            # the last trading day is removed from the backend by backfilling
+            # up to the day before, so each sync only catches up one day
+            previous_day = previous_trading_day(self.end_date).isoformat()
+            return self.run_bulk(
+                mode, runs, lambda: self.get_range_argv('--sync'), 'documents',
+                lambda: self.feed(*self.get_range_argv('--edate', previous_day))
+            )
+        if mode == 'eqdvd_backfill':
+            return self.run_bulk(mode, runs, lambda: ['--type', 'EQDVD', '--tickers', ','.join(self.symbols)], 'dividends')
+        if mode == 'eqhist_spool':
+            spool_dir = os.path.join(self.tmp_dir, 'spool')
+            return self.run_bulk(
+                mode, runs, lambda: self.get_range_argv('--spool', spool_dir), 'documents',
+                lambda: shutil.rmtree(spool_dir, ignore_errors=True)
+            )
+        if mode in ('eqhist_cache_cold', 'eqhist_cache_warm'):
+            cache_dir = os.path.join(self.tmp_dir, 'cache')
+            if mode == 'eqhist_cache_cold':
+                before_run = lambda: shutil.rmtree(cache_dir, ignore_errors=True)
+            else:
+                before_run = lambda: self.feed(*self.get_range_argv('--cachedir', cache_dir))
+            return self.run_bulk(mode, runs, lambda: self.get_range_argv('--cachedir', cache_dir), 'documents', before_run)
+        if mode == 'tick_collector':
+            return self.run_tick_collector(runs)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks of the equity feeder with the fake provider.')
+    parser.add_argument('--url',        type=str, default=equity_feeder.DJANGO_BACKEND_URL)
+    parser.add_argument('--modes',      type=str, default=','.join(MODES))
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--runs',       type=int, default=3)
+    parser.add_argument('--tickers',    type=int, default=100)
+    parser.add_argument('--days',       type=int, default=250)
+    parser.add_argument('--edate',      type=str, default='2021-08-24')
+    parser.add_argument('--latency',    type=float, default=0)
+    parser.add_argument('--output',     type=str)
+    parser.add_argument('--compare',    type=str)
+    parser.add_argument('--threshold',  type=float, default=0.2)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--verbose',    action='store_true')
+    args = parser.parse_args(argv)
+
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parser.error("unknown mode {0}, should be one of {1}".format(mode, ','.join(MODES)))
+
+    end_date = datetime.datetime.strptime(args.edate, "%Y-%m-%d").date()
+    benchmark = FeederBenchmark(args.url, args.latency, args.tickers, args.days, end_date, args.verbose)
+    results = []
+    try:
+        for mode in modes:
+            if mode.startswith('eqhist_cache') and upstream_cache.pyarrow is None:
+                print("{0} skipped, pyarrow is not installed".format(mode))
+                continue
+            result = benchmark.run(mode, args.iterations, args.runs)
+            results.append(result)
+            print("{0:<24} p50 {1}ms p99 {2}ms {3} errors{4}".format(
+                mode, result['p50_ms'], result['p99_ms'], result['errors'],
+                " {0} documents/s".format(result['documents_per_s']) if 'documents_per_s' in result else ""
+            ))
+    finally:
+        benchmark.close()
+
+    report = {
+        'kind': 'feeder',
+        'commit': get_commit(),
+        'created': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dataset': {'tickers': args.tickers, 'days': args.days, 'edate': args.edate},
+        'options': {'iterations': args.iterations, 'runs': args.runs, 'latency': args.latency},
+        'results': results
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+        print("Report written to {0}".format(args.output))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if len(regressions) != 0:
+            print("Regressions: {0}".format(','.join(regressions)))
+            if args.fail_on_regression:
+                sys.exit(1)
+
+#=================================================================================
+#=================================================================================
+if __name__ == "__main__":
+    main(sys.argv[1:])
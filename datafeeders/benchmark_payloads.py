@@ -0,0 +1,148 @@
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+import pandas as pd
+from equity_feeder import build_payloads_eqhist, build_payload_eqdvd, build_payload_eqmkt, get_ticker_info
+from fake_provider import FakeTicker
+from benchmark_feeder import summarize, compare, get_commit
+
+# micro-benchmark of the payload builders: a --rows rows history (and
+# dividend series) of the fake provider is converted --iterations times by
+# the column-wise builders of equity_feeder.py and by the row by row
+# builders they replaced (kept below as the reference), the records of
+# both must be the same. No backend and no network are needed
+#
+#   python benchmark_payloads.py --rows 10000 --iterations 20
+#   python benchmark_payloads.py --output payloads.json --compare baseline.json
+
+
+def build_payloads_eqhist_rows(ticker_dataframe, ticker_info_dict):
+    # reference: one iterrows() and one string formatting per price
+    key_conversion_map = {
+        "Open" : "p_open",
+        "High" : "p_high",
+        "Low"  : "p_low",
+        "Close": "p_close"
+    }
+    date_time = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    common_fields = {
+        "label": ticker_info_dict['symbol'],
+        "date_time": date_time,
+        "market_cap": ticker_info_dict['market_cap']
+    }
+    payloads = []
+    for md_date, row in ticker_dataframe.iterrows():
+        payload = dict(common_fields)
+        payload['md_date'] = str(md_date)[:10]
+        for k,v in key_conversion_map.items():
+            payload[v] = float("{:.6f}".format(row[k]))
+        payloads.append(payload)
+    return payloads
+
+
+def build_payload_eqdvd_rows(ticker_dividends, label, ex_div_year=None):
+    # reference: to_dict() and one str() per ex-dividend date
+    dividends_list = []
+    for k,v in ticker_dividends.to_dict().items():
+        ex_div_date = str(k)[:10]
+        if(ex_div_year is None or ex_div_date[:4] == ex_div_year):
+            dividends_list.append({"ex_div_date": ex_div_date, "dividend": float("{:.6f}".format(v))})
+    return {
+        "label": label,
+        "dividends": dividends_list,
+        "date_time": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    }
+
+
+def get_history(ticker, rows):
+    # the last rows weekdays before today
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=rows * 7 // 5 + 7)
+    return ticker.history(start=start.isoformat(), end=end.isoformat()).tail(rows)
+
+
+def without_date_time(records):
+    return [{k: v for k, v in record.items() if k != 'date_time'} for record in records]
+
+
+def measure(name, iterations, build):
+    latencies = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        build()
+        latencies.append(time.perf_counter() - started)
+    return summarize(name, latencies, 0, sum(latencies))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the payload builders of the equity feeder.')
+    parser.add_argument('--rows',       type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--symbol',     type=str, default='SYNF0000')
+    parser.add_argument('--output',     type=str)
+    parser.add_argument('--compare',    type=str)
+    parser.add_argument('--threshold',  type=float, default=0.2)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    ticker = FakeTicker(args.symbol)
+    ticker_info_dict = get_ticker_info(ticker)
+    ticker_dataframe = get_history(ticker, args.rows)
+    ticker_dividends = pd.Series(ticker_dataframe['Close'].to_numpy() / 100, index=ticker_dataframe.index, name='Dividends')
+
+    # same records as the reference builders
+    if without_date_time(build_payloads_eqhist(ticker_dataframe, ticker_info_dict)) != \
+            without_date_time(build_payloads_eqhist_rows(ticker_dataframe, ticker_info_dict)):
+        print("build_payloads_eqhist differs from the row by row builder")
+        sys.exit(1)
+    if build_payload_eqdvd(ticker_dividends, args.symbol)['dividends'] != \
+            build_payload_eqdvd_rows(ticker_dividends, args.symbol)['dividends']:
+        print("build_payload_eqdvd differs from the row by row builder")
+        sys.exit(1)
+
+    rows = len(ticker_dataframe)
+    results = [
+        measure('eqhist_columns', args.iterations, lambda: build_payloads_eqhist(ticker_dataframe, ticker_info_dict)),
+        measure('eqhist_rows', args.iterations, lambda: build_payloads_eqhist_rows(ticker_dataframe, ticker_info_dict)),
+        measure('eqdvd_columns', args.iterations, lambda: build_payload_eqdvd(ticker_dividends, args.symbol)),
+        measure('eqdvd_rows', args.iterations, lambda: build_payload_eqdvd_rows(ticker_dividends, args.symbol)),
+        measure('eqmkt', args.iterations * 100, lambda: build_payload_eqmkt(ticker_info_dict))
+    ]
+    for result in results:
+        count = 1 if result['name'] == 'eqmkt' else rows
+        result['documents_per_s'] = round(count / (result['mean_ms'] / 1000), 3) if result['mean_ms'] else None
+        print("{0:<16} p50 {1:>9.3f}ms  p99 {2:>9.3f}ms  {3:>12.0f} records/s".format(
+            result['name'], result['p50_ms'], result['p99_ms'], result['documents_per_s']
+        ))
+
+    report = {
+        'kind': 'payloads',
+        'commit': get_commit(),
+        'created': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dataset': {'rows': rows, 'symbol': args.symbol, 'pandas': pd.__version__},
+        'options': {'iterations': args.iterations},
+        'results': results
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+        print("Report written to {0}".format(args.output))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if len(regressions) != 0:
+            print("Regressions: {0}".format(','.join(regressions)))
+            if args.fail_on_regression:
+                sys.exit(1)
+
+#=================================================================================
+#=================================================================================
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,9 +1,22 @@
 import yfinance as yf
+import numpy as np
 import datetime
 import json
 import requests
 import argparse
 import sys
+import threading
+import queue
+import random
+import time
+import urllib.parse
+from spool import Spool
+from metrics import (
+    stage, STAGE_WAIT_SECONDS, STAGE_ERRORS, BACKEND_REQUEST_SECONDS, print_stage_stats, start_server, write_textfile
+)
+from fake_provider import FakeTicker
+from upstream_cache import UpstreamCache, CachedTicker, CacheMissError
+from exchange_calendar import previous_trading_day, next_trading_day, get_trading_days, get_missing_ranges
 
 # trailing slash needed with APPEND_SLASH set to True
 # since our backend is in Django
@@ -14,16 +27,80 @@ import sys
 ## or set APPEND_SLASH=False in your Django settings.
 DJANGO_BACKEND_URL = 'http://localhost:8000'
 DJANGO_BACKEND_EQUITY_ENDPOINT = DJANGO_BACKEND_URL + '/equities/'
+DJANGO_BACKEND_EQUITY_BULK_ENDPOINT = DJANGO_BACKEND_EQUITY_ENDPOINT + 'bulk/'
+DJANGO_BACKEND_EQUITY_TICKS_ENDPOINT = DJANGO_BACKEND_EQUITY_ENDPOINT + 'ticks/'
+DJANGO_BACKEND_EQUITY_SUMMARY_ENDPOINT = DJANGO_BACKEND_EQUITY_ENDPOINT + 'summary/'
+DJANGO_BACKEND_EQUITY_RANGE_ENDPOINT = DJANGO_BACKEND_EQUITY_ENDPOINT + 'range/'
 DJANGO_BACKEND_DIVIDEND_ENDPOINT = DJANGO_BACKEND_URL + '/dividends/'
+DJANGO_BACKEND_DIVIDEND_BULK_ENDPOINT = DJANGO_BACKEND_DIVIDEND_ENDPOINT + 'bulk/'
+DJANGO_BACKEND_SECURITY_ENDPOINT = DJANGO_BACKEND_URL + '/securities/'
+DJANGO_BACKEND_SECURITY_BULK_ENDPOINT = DJANGO_BACKEND_SECURITY_ENDPOINT + 'bulk/'
+
+# backend and upstream requests are retried with exponential backoff and
+# full jitter on connection errors, timeouts and 5xx/429 responses
+REQUEST_TIMEOUT = 30
+REQUEST_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# one keep-alive session with a connection pool shared by all the requests
+# of the process (and by the threads of the backfill pipeline)
+session = None
+session_lock = threading.Lock()
+
+# on-disk cache of the yfinance responses (see upstream_cache.py), enabled
+# with --cachedir, None when every call goes to Yahoo! Finance
+upstream_cache = None
+
+# 'yahoo' or 'fake' (deterministic data of fake_provider.py, no network)
+# with fake_latency seconds slept on each upstream call
+provider = 'yahoo'
+fake_latency = 0
+
+# Prometheus textfile written at the end of the run (--metricsfile)
+metrics_file = None
+
+
+def set_backend_url(url):
+    global DJANGO_BACKEND_URL, DJANGO_BACKEND_EQUITY_ENDPOINT, DJANGO_BACKEND_EQUITY_BULK_ENDPOINT
+    global DJANGO_BACKEND_EQUITY_TICKS_ENDPOINT, DJANGO_BACKEND_EQUITY_SUMMARY_ENDPOINT, DJANGO_BACKEND_EQUITY_RANGE_ENDPOINT
+    global DJANGO_BACKEND_DIVIDEND_ENDPOINT, DJANGO_BACKEND_DIVIDEND_BULK_ENDPOINT
+    global DJANGO_BACKEND_SECURITY_ENDPOINT, DJANGO_BACKEND_SECURITY_BULK_ENDPOINT
+    DJANGO_BACKEND_URL = url.rstrip('/')
+    DJANGO_BACKEND_EQUITY_ENDPOINT = DJANGO_BACKEND_URL + '/equities/'
+    DJANGO_BACKEND_EQUITY_BULK_ENDPOINT = DJANGO_BACKEND_EQUITY_ENDPOINT + 'bulk/'
+    DJANGO_BACKEND_EQUITY_TICKS_ENDPOINT = DJANGO_BACKEND_EQUITY_ENDPOINT + 'ticks/'
+    DJANGO_BACKEND_EQUITY_SUMMARY_ENDPOINT = DJANGO_BACKEND_EQUITY_ENDPOINT + 'summary/'
+    DJANGO_BACKEND_EQUITY_RANGE_ENDPOINT = DJANGO_BACKEND_EQUITY_ENDPOINT + 'range/'
+    DJANGO_BACKEND_DIVIDEND_ENDPOINT = DJANGO_BACKEND_URL + '/dividends/'
+    DJANGO_BACKEND_DIVIDEND_BULK_ENDPOINT = DJANGO_BACKEND_DIVIDEND_ENDPOINT + 'bulk/'
+    DJANGO_BACKEND_SECURITY_ENDPOINT = DJANGO_BACKEND_URL + '/securities/'
+    DJANGO_BACKEND_SECURITY_BULK_ENDPOINT = DJANGO_BACKEND_SECURITY_ENDPOINT + 'bulk/'
 
 def print_separator():
     print('='*50)
 
 
-def get_ticker_data(ticker):
+def get_upstream_ticker(ticker):
+    if provider == 'fake':
+        return FakeTicker(ticker, fake_latency)
     return yf.Ticker(ticker)
 
 
+def get_ticker_data(ticker):
+    if upstream_cache is not None:
+        return CachedTicker(ticker, upstream_cache, None if upstream_cache.offline else get_upstream_ticker(ticker))
+    return get_upstream_ticker(ticker)
+
+
+def print_cache_stats():
+    if upstream_cache is not None:
+        stats = upstream_cache.stats
+        print("Upstream cache: {0} hits, {1} misses, {2} ranges fetched".format(
+            stats['hits'], stats['misses'], stats['fetched_ranges']
+        ))
+
+
 def get_ticker_hist_data(ticker_data, start_date, end_date, period):
     print_separator()
     print("period: {0}".format(period))
@@ -80,6 +157,58 @@ def get_ticker_dividends(ticker_data):
     return ticker_data.dividends
 
 
+def get_session(pool_size=10):
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+    return session
+
+
+def is_retryable(e):
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return False
+
+
+def is_upstream_retryable(e):
+    # any upstream error except a miss of the offline cache
+    return not isinstance(e, CacheMissError)
+
+
+def retry(func, retryable=lambda e: True, retries=REQUEST_RETRIES):
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == retries or not retryable(e):
+                raise
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            print("Attempt {0} failed with {1}, retrying in {2:.2f}s".format(attempt + 1, e, delay))
+            time.sleep(delay)
+
+
+def send_request(method, url, payload=None):
+    endpoint = urllib.parse.urlsplit(url).path
+
+    def attempt():
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            r = get_session().request(method, url, json=payload, timeout=REQUEST_TIMEOUT)
+            status = str(r.status_code)
+            r.raise_for_status()
+            return r
+        finally:
+            BACKEND_REQUEST_SECONDS.observe((method, endpoint, status), time.perf_counter() - started)
+    return retry(attempt, is_retryable)
+
+
 def post_request(url, payload_as_dict):
     print_separator()
     print("URL: {0}".format(url))
@@ -88,9 +217,8 @@ def post_request(url, payload_as_dict):
 
     # make the post request
     try:
-        r = requests.post(url, json=payload_as_dict)
+        r = send_request('POST', url, payload_as_dict)
         http_status = r.status_code
-        r.raise_for_status()
     except requests.exceptions.HTTPError as err:
         raise SystemExit(err)
     except Exception as e:
@@ -106,9 +234,8 @@ def put_request(url, payload_as_dict):
 
     # make the post request
     try:
-        r = requests.put(url, json=payload_as_dict)
+        r = send_request('PUT', url, payload_as_dict)
         http_status = r.status_code
-        r.raise_for_status()
     except requests.exceptions.HTTPError as err:
         raise SystemExit(err)
     except Exception as e:
@@ -117,178 +244,675 @@ def put_request(url, payload_as_dict):
     return http_status
 
 
-def get_yesterday_iso_date():
-    today = datetime.date.today()
-    
-    if(today.weekday() == 0): # monday
-        yesterday = today - datetime.timedelta(days=3)
-    elif(today.weekday() == 6): # sunday
-        yesterday = today - datetime.timedelta(days=2)
-    else:
-        yesterday = today - datetime.timedelta(days=1)
+def post_bulk_request(url, payload_list):
+    # same as post_request but only a summary of the payload is printed
+    # since a bulk payload can contain thousands of documents
+    print("URL: {0}".format(url))
+    print("payload: {0} documents".format(len(payload_list)))
+
+    try:
+        r = send_request('POST', url, payload_list)
+        http_status = r.status_code
+    except requests.exceptions.HTTPError as err:
+        raise SystemExit(err)
+    except Exception as e:
+        raise SystemExit(e)
+    print("HTTP POST ended with {0} status code".format(http_status))
+    return http_status
 
-    return yesterday.isoformat()
+
+def post_ticks_request(url, ticks_list):
+    print("URL: {0}".format(url))
+    print("ticks:\n{0}".format(json.dumps(ticks_list, indent=4, sort_keys=True)))
+
+    try:
+        r = send_request('POST', url, ticks_list)
+        http_status = r.status_code
+    except requests.exceptions.HTTPError as err:
+        raise SystemExit(err)
+    except Exception as e:
+        raise SystemExit(e)
+    print("HTTP POST ended with {0} status code".format(http_status))
+    return r.json()
+
+
+def get_yesterday_iso_date():
+    # last trading day before today, skipping the weekends and the exchange holidays
+    return previous_trading_day(datetime.date.today()).isoformat()
 
 
 def get_today_iso_date():
     return datetime.date.today().isoformat()
 
 
-def build_payload_eqhist(ticker_dataframe, ticker_info_dict):
-    key_conversion_map = {
-        "Open" : "p_open",
-        "High" : "p_high",
-        "Low"  : "p_low",
-        "Close": "p_close",
-        "Date": "md_date"
-    }
+# columns of the yfinance daily bars and fields of the Equity payloads
+PRICE_COLUMNS = (
+    ("Open", "p_open"),
+    ("High", "p_high"),
+    ("Low", "p_low"),
+    ("Close", "p_close")
+)
 
-    # for md_date get the first 10 characters (yyyy-mm-dd)
-    # from the timestamp of any of the fields
-    payload = {
+
+def get_utc_timestamp():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def format_dates(index):
+    # yyyy-mm-dd of every timestamp of a DatetimeIndex, in the timezone of the
+    # index (the exchange date of the yfinance bars), formatted by numpy at once
+    if len(index) == 0:
+        return []
+    if getattr(index, 'tz', None) is not None:
+        index = index.tz_localize(None)
+    return index.values.astype('datetime64[D]').astype(str).tolist()
+
+
+def round_prices(column):
+    # limit to 6 decimal places as our Django model has 6 decimal places,
+    # for the whole column at once (Python floats for the JSON encoder)
+    return np.round(column.to_numpy(dtype='float64'), 6).tolist()
+
+
+def round_price(value):
+    return round(value, 6) if value is not None else None
+
+
+def build_payload_security(ticker_info_dict):
+    # reference data of the label, stored once instead of in every Equity
+    return {
         "label": ticker_info_dict['symbol'],
         "description": ticker_info_dict['long_name'],
-        "date_time": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-        "md_date": str(list(ticker_dataframe.to_dict()['Open'])[0])[:10],
+        "date_time": get_utc_timestamp(),
         "industry": ticker_info_dict['industry'],
         "country": ticker_info_dict['country'],
         "currency": ticker_info_dict['currency'],
         "market": ticker_info_dict['market'],
-        "exchange": ticker_info_dict['exchange'],
-        "market_cap": ticker_info_dict['market_cap'],
-        "tickdata": [] # cannot have tickdata for past prices
+        "exchange": ticker_info_dict['exchange']
     }
 
-    for k,v in ticker_dataframe.to_dict().items():
-        if k in key_conversion_map.keys():
-            # limit to 6 decimal places as our Django model has 6 decimal places
-            payload[key_conversion_map[k]] = float("{:.6f}".format(list(v.values())[0]))
-    return payload
 
+def build_payload_eqhist(ticker_dataframe, ticker_info_dict):
+    # the first row of the dataframe, None if it has no prices
+    payloads = build_payloads_eqhist(ticker_dataframe.iloc[:1], ticker_info_dict)
+    return payloads[0] if len(payloads) != 0 else None
+
+
+def build_payloads_eqhist(ticker_dataframe, ticker_info_dict):
+    # one Equity document for each row (trading date) of the dataframe, built
+    # column by column: the dates are formatted and the prices rounded for
+    # the whole columns, then the records are emitted in a single pass.
+    # The rows without prices (days without trades) are skipped, NaN is not
+    # valid JSON for the backend
+    ticker_dataframe = ticker_dataframe.dropna(subset=[column for column, field in PRICE_COLUMNS])
+    label = ticker_info_dict['symbol']
+    date_time = get_utc_timestamp()
+    market_cap = ticker_info_dict['market_cap']
+    md_dates = format_dates(ticker_dataframe.index)
+    p_open, p_high, p_low, p_close = [round_prices(ticker_dataframe[column]) for column, field in PRICE_COLUMNS]
+    return [
+        {
+            "label": label,
+            "date_time": date_time,
+            "market_cap": market_cap,
+            "md_date": md_date,
+            "p_open": p_open_value,
+            "p_high": p_high_value,
+            "p_low": p_low_value,
+            "p_close": p_close_value
+        }
+        for md_date, p_open_value, p_high_value, p_low_value, p_close_value
+        in zip(md_dates, p_open, p_high, p_low, p_close)
+    ]
 
-def build_payload_eqmkt(ticker_info_dict):
-    key_conversion_map = {
-        "p_open" : "p_open",
-        "p_high" : "p_high",
-        "p_low"  : "p_low",
-        "p_close": "p_close",
-        "p_mkt"  : "p_mkt"
-    }
 
-    payload = {
+def build_payload_eqmkt(ticker_info_dict):
+    # the snapshot and its tick share the same timestamp
+    timestamp = get_utc_timestamp()
+    return {
         "label": ticker_info_dict['symbol'],
-        "description": ticker_info_dict['long_name'],
-        "date_time": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "date_time": timestamp,
         "md_date": get_today_iso_date(),
-        "p_low": ticker_info_dict[key_conversion_map['p_low']],
-        "p_high": ticker_info_dict[key_conversion_map['p_high']],
-        "p_open": ticker_info_dict[key_conversion_map['p_open']],
-        "p_close": ticker_info_dict[key_conversion_map['p_close']],
-        "industry": ticker_info_dict['industry'],
-        "country": ticker_info_dict['country'],
-        "currency": ticker_info_dict['currency'],
-        "market": ticker_info_dict['market'],
-        "exchange": ticker_info_dict['exchange'],
+        "p_low": round_price(ticker_info_dict['p_low']),
+        "p_high": round_price(ticker_info_dict['p_high']),
+        "p_open": round_price(ticker_info_dict['p_open']),
+        "p_close": round_price(ticker_info_dict['p_close']),
         "market_cap": ticker_info_dict['market_cap'],
         "tickdata": [
             {
-                "p_mkt": ticker_info_dict[key_conversion_map['p_mkt']],
-                "timestamp": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+                "p_mkt": round_price(ticker_info_dict['p_mkt']),
+                "timestamp": timestamp
             }
         ]
     }
-    return payload
 
 
+def build_ticks_eqmkt(payload_eqmkt):
+    # only the new ticks and the daily prices of the snapshot,
+    # the security info is already in the document of the day
+    return {
+        "label": payload_eqmkt['label'],
+        "md_date": payload_eqmkt['md_date'],
+        "p_low": payload_eqmkt['p_low'],
+        "p_high": payload_eqmkt['p_high'],
+        "p_open": payload_eqmkt['p_open'],
+        "p_close": payload_eqmkt['p_close'],
+        "market_cap": payload_eqmkt['market_cap'],
+        "tickdata": payload_eqmkt['tickdata']
+    }
+
+
+# the GET helpers below raise the requests.RequestException of send_request
+# (after its retries), the __main__ block exits with an error message
+
 def get_equity_by_label(symbol):
-    url = DJANGO_BACKEND_EQUITY_ENDPOINT + "?label={0}".format(symbol)
-    try:
-        r = requests.get(url)
+    # the equities endpoint is paginated: the next pages are followed
+    # until all the documents of the label have been read
+    url = DJANGO_BACKEND_EQUITY_ENDPOINT + "?label={0}&page_size=1000".format(symbol)
+    equities = []
+    while url is not None:
+        r = send_request('GET', url)
         http_status = r.status_code
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        raise SystemExit(err)
-    except Exception as e:
-        raise SystemExit(e)
-    
+        page = r.json()
+        equities.extend(page['results'])
+        url = page['next']
+
     print("HTTP GET for equity label {0} ended with {1} status code".format(symbol, http_status))
-    return r.json()
+    return equities
+
+
+def get_last_equity_by_label(symbol, fields='id,label,md_date'):
+    # only the document with the most recent md_date for the label
+    url = DJANGO_BACKEND_EQUITY_ENDPOINT + "?label={0}&ordering=-md_date&page_size=1&fields={1}".format(symbol, fields)
+    r = send_request('GET', url)
+    http_status = r.status_code
+
+    print("HTTP GET for last equity label {0} ended with {1} status code".format(symbol, http_status))
+    results = r.json()['results']
+    return results[0] if len(results) != 0 else None
 
 
 def get_equity_by_label_and_date(symbol, md_date):
     url = DJANGO_BACKEND_EQUITY_ENDPOINT + "?label={0}&md_date={1}".format(symbol, md_date)
-    try:
-        r = requests.get(url)
-        http_status = r.status_code
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        raise SystemExit(err)
-    except Exception as e:
-        raise SystemExit(e)
-    
+    r = send_request('GET', url)
+    http_status = r.status_code
+
     print("HTTP GET for equity label {0} at md_date {1} ended with {2} status code".format(symbol, md_date, http_status))
     return r.json()
 
 
-def get_dividends_by_equity_and_year(equity_id, ex_div_year):
-    url = DJANGO_BACKEND_DIVIDEND_ENDPOINT + "?equity={0}&year={1}".format(equity_id, ex_div_year)
-    try:
-        r = requests.get(url)
-        http_status = r.status_code
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        raise SystemExit(err)
-    except Exception as e:
-        raise SystemExit(e)
-    
-    print("HTTP GET for dividends for equity id {0} and exdivyear {1} ended with {2} status code".format(equity_id, ex_div_year, http_status))
+def get_equities_summary(symbols, labels_per_request=200):
+    # first/last md_date and count of the labels stored by the backend,
+    # the labels without any document are not returned
+    summary = {}
+    for labels in chunks(symbols, labels_per_request):
+        url = DJANGO_BACKEND_EQUITY_SUMMARY_ENDPOINT + "?labels={0}".format(','.join(labels))
+        r = send_request('GET', url)
+        for entry in r.json():
+            summary[entry['label']] = entry
+    print("HTTP GET of the summary of {0} labels ended with {1} labels found".format(len(symbols), len(summary)))
+    return summary
+
+
+def get_md_dates(symbol, start_date, end_date):
+    url = DJANGO_BACKEND_EQUITY_RANGE_ENDPOINT + "?label={0}&start={1}&end={2}".format(symbol, start_date, end_date)
+    r = send_request('GET', url)
+    return [datetime.datetime.strptime(md_date, "%Y-%m-%d").date() for md_date in r.json()['dates']]
+
+
+def plan_sync(ticker_symbols, start_date, end_date, fill_gaps=False):
+    # (symbol, start_date, end_date, stored md_dates to skip) of the tickers
+    # with missing trading days: the days after the last md_date stored
+    # (from start_date for the new labels) and, with fill_gaps, the trading
+    # days missing between the first and the last md_date. The gaps are only
+    # looked up when the count of the label is lower than the number of
+    # trading days, and a single upstream range covers all the missing days.
+    # As --sdate, start_date is excluded by get_ticker_hist_data, so the range
+    # starts on the trading day before the first missing one
+    summary = get_equities_summary(ticker_symbols)
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+    ranges = []
+    for symbol in ticker_symbols:
+        entry = summary.get(symbol)
+        if entry is None:
+            ranges.append((symbol, start_date, end_date, None))
+            continue
+        first = datetime.datetime.strptime(entry['first_md_date'], "%Y-%m-%d").date()
+        last = datetime.datetime.strptime(entry['last_md_date'], "%Y-%m-%d").date()
+        missing = []
+        skip_dates = None
+        if fill_gaps and entry['count'] < len(get_trading_days(first, last)):
+            stored = get_md_dates(symbol, first.isoformat(), last.isoformat())
+            missing.extend(get_missing_ranges(first, last, stored))
+            skip_dates = set(md_date.isoformat() for md_date in stored)
+        if next_trading_day(last) <= end:
+            missing.append((next_trading_day(last), end))
+        if len(missing) == 0:
+            continue
+        print("{0} missing trading days: {1}".format(symbol, ', '.join(
+            first_day.isoformat() if first_day == last_day else '{0}..{1}'.format(first_day, last_day)
+            for first_day, last_day in missing
+        )))
+        ranges.append((symbol, previous_trading_day(missing[0][0]).isoformat(), missing[-1][1].isoformat(), skip_dates))
+    print("{0} of {1} tickers to sync".format(len(ranges), len(ticker_symbols)))
+    return ranges
+
+
+def get_dividends_by_label(symbol):
+    url = DJANGO_BACKEND_DIVIDEND_ENDPOINT + "?label={0}".format(symbol)
+    r = send_request('GET', url)
+    http_status = r.status_code
+
+    print("HTTP GET for dividends for label {0} ended with {1} status code".format(symbol, http_status))
     return r.json()
 
 
-def get_dividends_by_equity(equity_id):
-    url = DJANGO_BACKEND_DIVIDEND_ENDPOINT + "?equity={0}".format(equity_id)
+def build_payload_eqdvd(ticker_dividends, label, ex_div_year=None):
+    # the whole history of the label in one payload, or only the dividends
+    # of ex_div_year when given. The backend merges the entries by
+    # ex_div_date into the document of the label. ticker_dividends is the
+    # Series of Ticker.dividends (indexed by ex-dividend date)
+    ex_div_dates = format_dates(ticker_dividends.index)
+    dividends = round_prices(ticker_dividends)
+    return {
+        "label": label,
+        "dividends": [
+            {"ex_div_date": ex_div_date, "dividend": dividend}
+            for ex_div_date, dividend in zip(ex_div_dates, dividends)
+            if ex_div_year is None or ex_div_date[:4] == ex_div_year
+        ],
+        "date_time": get_utc_timestamp()
+    }
+
+def read_tickers(tickers, tickers_file):
+    # --tickers is a comma separated list, --tickers-file has one symbol per line
+    # lines starting with # are ignored, duplicates are removed keeping the order
+    symbols = []
+    if tickers is not None:
+        symbols.extend(tickers.split(','))
+    if tickers_file is not None:
+        with open(tickers_file) as f:
+            for line in f:
+                if not line.strip().startswith('#'):
+                    symbols.append(line)
+    symbols = [symbol.strip().upper() for symbol in symbols if symbol.strip() != '']
+    return list(dict.fromkeys(symbols))
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def fetch_ticker_hist(ticker_symbol, start_date, end_date, period):
+    # upstream calls of the backfill for a ticker, retried on any error
+    ticker_data = get_ticker_data(ticker_symbol)
+    ticker_info_dict = retry(lambda: get_ticker_info(ticker_data), is_upstream_retryable)
+    if ticker_info_dict == None:
+        print("No data found for the provided symbol {0}".format(ticker_symbol))
+        return None, None
+
+    ticker_dataframe = retry(lambda: get_ticker_hist_data(ticker_data, start_date, end_date, period), is_upstream_retryable)
+    if ticker_dataframe.empty:
+        print("No historical data found for {0} between {1} and {2}".format(ticker_symbol, start_date, end_date))
+        return None, None
+    return ticker_info_dict, ticker_dataframe
+
+
+def start_stage(worker, workers, in_queue, out_queue, name, on_error=None):
+    # starts the threads of a pipeline stage: each one takes items from in_queue
+    # until it gets None and puts the items returned by worker in out_queue.
+    # out_queue is bounded, so a stage blocks when the next one is behind.
+    # An error of worker only fails its item (reported to on_error(item, e)),
+    # a dead thread would block the previous stage on the full queue.
+    # The time waiting for in_queue (previous stage behind) and for out_queue
+    # (next stage behind) is measured apart from the work on the items
+    def run():
+        while True:
+            started = time.perf_counter()
+            item = in_queue.get()
+            STAGE_WAIT_SECONDS.observe((name, 'input'), time.perf_counter() - started)
+            if item is None:
+                break
+            try:
+                with stage(name):
+                    results = worker(item)
+            except Exception as e:
+                print("Stage {0} failed with {1}".format(name, e))
+                if on_error is not None:
+                    on_error(item, e)
+                continue
+            started = time.perf_counter()
+            for result in results:
+                out_queue.put(result)
+            if len(results) != 0:
+                STAGE_WAIT_SECONDS.observe((name, 'output'), time.perf_counter() - started)
+
+    threads = [threading.Thread(target=run, daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def stop_stage(threads, in_queue):
+    # called once the previous stage is done, one None for each thread
+    for thread in threads:
+        in_queue.put(None)
+    for thread in threads:
+        thread.join()
+
+
+def get_spool_key(*fields):
+    return ' '.join(str(field) for field in fields)
+
+
+def send_drained(url, payloads):
+    with stage('drain'):
+        send_request('POST', url, payloads)
+
+
+def drain_spool(spool, batch_size):
+    # one pass over the spooled records, False if the backend failed
     try:
-        r = requests.get(url)
-        http_status = r.status_code
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        raise SystemExit(err)
+        sent = spool.drain(send_drained, batch_size, is_retryable)
     except Exception as e:
-        raise SystemExit(e)
-    
-    print("HTTP GET for dividends for equity id {0} ended with {1} status code".format(equity_id, http_status))
-    return r.json()
+        print("Draining the spool failed with {0}, the records are kept".format(e))
+        return False
+    if sent != 0:
+        print("{0} spooled documents written".format(sent))
+    return True
 
 
-def build_payload_eqdvd(dividends_dict, equity_id, ex_div_year):
-    dividends_list = []
+def start_drainer(spool, batch_size, interval=1):
+    # drain stage of the spool, running while the payloads are appended.
+    # The passes are spaced out with exponential backoff while the backend fails
+    stop = threading.Event()
 
-    for k,v in dividends_dict.items():
-        ex_div_date = str(k)[:10]
-        dividend = v
-        # only dividends for the input year will be added to the payload
-        if(ex_div_date[:4] == ex_div_year): 
-            dividends_list.append(
-                {"ex_div_date": ex_div_date, "dividend": dividend}
-            )
+    def run():
+        delay = interval
+        while not stop.is_set():
+            delay = interval if drain_spool(spool, batch_size) else min(BACKOFF_MAX, delay * 2)
+            stop.wait(delay)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, stop
+
+
+def finish_drain(spool, batch_size, timeout, drainer=None):
+    # stops the drainer and drains the spool until it is empty or for at most
+    # timeout seconds, the records left are sent by the next run or by --drain
+    if drainer is not None:
+        thread, stop = drainer
+        stop.set()
+        thread.join()
+    deadline = time.time() + timeout
+    delay = 1
+    while not (drain_spool(spool, batch_size) and not spool.pending()):
+        if time.time() + delay > deadline:
+            print("The backend is not available, the spooled records will be sent by the next run or with --drain")
+            return False
+        time.sleep(delay)
+        delay = min(BACKOFF_MAX, delay * 2)
+    return True
+
+
+def write_bulk(url, payload_list, spool=None):
+    if spool is not None:
+        spool.append(url, payload_list)
+        print("{0} documents spooled for {1}".format(len(payload_list), url))
+        return
+    post_bulk_request(url, payload_list)
+
+
+def backfill(ticker_ranges, period, batch_size,
+             fetch_workers=4, build_workers=1, write_workers=2, queue_size=16, spool=None):
+    # fetch (yfinance) -> build (payloads in batches) -> write (bulk upsert)
+    # each stage with its own threads, connected by bounded queues
+    # ticker_ranges is a list of (symbol, start_date, end_date, md_dates to
+    # skip or None), the rows of the skipped md_dates are not sent
+    # with a spool the batches are appended to it by the build stage (the
+    # drainer sends them) and the ranges already spooled are not fetched again
+    stats = {'tickers': 0, 'documents': 0, 'failed_tickers': [], 'failed_batches': 0}
+    stats_lock = threading.Lock()
+    get_session(pool_size=write_workers)
+
+    def fetch(ticker_range):
+        ticker_symbol, start_date, end_date, skip_dates = ticker_range
+        if spool is not None and spool.is_done(get_spool_key("EQHIST", ticker_symbol, start_date, end_date)):
+            print("{0} between {1} and {2} already spooled".format(ticker_symbol, start_date, end_date))
+            return []
+        try:
+            ticker_info_dict, ticker_dataframe = fetch_ticker_hist(ticker_symbol, start_date, end_date, period)
+        except Exception as e:
+            print("Fetching {0} failed with {1}".format(ticker_symbol, e))
+            STAGE_ERRORS.inc(('fetch',))
+            with stats_lock:
+                stats['failed_tickers'].append(ticker_symbol)
+            return []
+        if ticker_info_dict is None:
+            return []
+        return [(ticker_info_dict, ticker_dataframe, ticker_range)]
+
+    def build(item):
+        # (endpoint, batch) items: the security of the ticker and its equities
+        ticker_info_dict, ticker_dataframe, ticker_range = item
+        skip_dates = ticker_range[3]
+        payloads = build_payloads_eqhist(ticker_dataframe, ticker_info_dict)
+        if skip_dates is not None:
+            payloads = [payload for payload in payloads if payload['md_date'] not in skip_dates]
+        with stats_lock:
+            stats['tickers'] += 1
+        batches = [(DJANGO_BACKEND_SECURITY_BULK_ENDPOINT, [build_payload_security(ticker_info_dict)])]
+        for batch in chunks(payloads, batch_size):
+            batches.append((DJANGO_BACKEND_EQUITY_BULK_ENDPOINT, batch))
+        if spool is not None:
+            for url, batch in batches:
+                spool.append(url, batch)
+            spool.mark_done(get_spool_key("EQHIST", *ticker_range[:3]))
+            with stats_lock:
+                stats['documents'] += len(payloads)
+            print("{0} documents for {1} spooled".format(len(payloads), ticker_info_dict['symbol']))
+            return []
+        return batches
+
+    def write(item):
+        url, batch = item
+        try:
+            send_request('POST', url, batch)
+        except Exception as e:
+            print("Writing {0} documents for {1} failed with {2}".format(len(batch), batch[0]['label'], e))
+            STAGE_ERRORS.inc(('write',))
+            with stats_lock:
+                stats['failed_batches'] += 1
+                if batch[0]['label'] not in stats['failed_tickers']:
+                    stats['failed_tickers'].append(batch[0]['label'])
+            return []
+        if url == DJANGO_BACKEND_SECURITY_BULK_ENDPOINT:
+            return []
+        with stats_lock:
+            stats['documents'] += len(batch)
+        print("{0} documents for {1} written".format(len(batch), batch[0]['label']))
+        return []
+
+    symbols_queue = queue.Queue()
+    build_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+
+    def fail(ticker_symbol):
+        with stats_lock:
+            if ticker_symbol not in stats['failed_tickers']:
+                stats['failed_tickers'].append(ticker_symbol)
+
+    fetchers = start_stage(fetch, fetch_workers, symbols_queue, build_queue, 'fetch',
+                           lambda ticker_range, e: fail(ticker_range[0]))
+    builders = start_stage(build, build_workers, build_queue, write_queue, 'build',
+                           lambda item, e: fail(item[2][0]))
+    writers = start_stage(write, write_workers, write_queue, None, 'write',
+                          lambda item, e: fail(item[1][0]['label']))
+
+    for ticker_range in ticker_ranges:
+        symbols_queue.put(ticker_range)
+    stop_stage(fetchers, symbols_queue)
+    stop_stage(builders, build_queue)
+    stop_stage(writers, write_queue)
+
+    print_separator()
+    print("Backfill ended with {0} documents for {1} tickers".format(stats['documents'], stats['tickers']))
+    if len(stats['failed_tickers']) != 0:
+        print("Failed tickers ({0} batches): {1}".format(stats['failed_batches'], ','.join(stats['failed_tickers'])))
+    print_separator()
+    return stats
+
+
+def backfill_dividends(ticker_symbols, ex_div_year, batch_size, fetch_workers=4, queue_size=16, spool=None):
+    # fetch (the dividend history of each ticker, once) -> write (bulk upsert
+    # of batch_size labels), the payloads are small so one writer is enough
+    # with a spool the batches are appended to it instead of being sent
+    stats = {'tickers': 0, 'dividends': 0, 'failed_tickers': []}
+    stats_lock = threading.Lock()
+    get_session()
+
+    def fetch(ticker_symbol):
+        if spool is not None and spool.is_done(get_spool_key("EQDVD", ticker_symbol, ex_div_year)):
+            print("Dividends of {0} already spooled".format(ticker_symbol))
+            return []
+        try:
+            ticker_dividends = retry(lambda: get_ticker_dividends(get_ticker_data(ticker_symbol)), is_upstream_retryable)
+        except Exception as e:
+            print("Fetching the dividends of {0} failed with {1}".format(ticker_symbol, e))
+            STAGE_ERRORS.inc(('fetch',))
+            with stats_lock:
+                stats['failed_tickers'].append(ticker_symbol)
+            return []
+        payload = build_payload_eqdvd(ticker_dividends, ticker_symbol, ex_div_year)
+        if len(payload['dividends']) == 0:
+            print("No dividends data found for {0}".format(ticker_symbol))
+            return []
+        return [payload]
+
+    batch = []
+
+    def write(payload):
+        batch.append(payload)
+        if len(batch) >= batch_size:
+            flush()
+        return []
+
+    def flush():
+        if len(batch) == 0:
+            return
+        labels = [payload['label'] for payload in batch]
+        try:
+            if spool is not None:
+                spool.append(DJANGO_BACKEND_DIVIDEND_BULK_ENDPOINT, list(batch))
+                for label in labels:
+                    spool.mark_done(get_spool_key("EQDVD", label, ex_div_year))
+            else:
+                send_request('POST', DJANGO_BACKEND_DIVIDEND_BULK_ENDPOINT, list(batch))
+            with stats_lock:
+                stats['tickers'] += len(batch)
+                stats['dividends'] += sum(len(payload['dividends']) for payload in batch)
+            print("Dividends of {0} written".format(','.join(labels)))
+        except Exception as e:
+            print("Writing the dividends of {0} failed with {1}".format(','.join(labels), e))
+            STAGE_ERRORS.inc(('write',))
+            with stats_lock:
+                stats['failed_tickers'].extend(labels)
+        del batch[:]
+
+    symbols_queue = queue.Queue()
+    write_queue = queue.Queue(maxsize=queue_size)
+
+    def fail(ticker_symbol):
+        with stats_lock:
+            stats['failed_tickers'].append(ticker_symbol)
+
+    fetchers = start_stage(fetch, fetch_workers, symbols_queue, write_queue, 'fetch',
+                           lambda ticker_symbol, e: fail(ticker_symbol))
+    writers = start_stage(write, 1, write_queue, None, 'write',
+                          lambda payload, e: fail(payload['label']))
+
+    for ticker_symbol in ticker_symbols:
+        symbols_queue.put(ticker_symbol)
+    stop_stage(fetchers, symbols_queue)
+    stop_stage(writers, write_queue)
+    flush()
+
+    print_separator()
+    print("Dividend backfill ended with {0} dividends for {1} tickers".format(stats['dividends'], stats['tickers']))
+    if len(stats['failed_tickers']) != 0:
+        print("Failed tickers: {0}".format(','.join(stats['failed_tickers'])))
+    print_separator()
+    return stats
 
-    payload = {
-        "year": ex_div_year,
-        "equity": equity_id,
-        "dividends": dividends_list,
-        "date_time": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-    }
-    return payload
 
 def main(argv):
     parser = argparse.ArgumentParser(description='Equity Feeder for Django MongoDB backend.')
-    parser.add_argument('--type',      type=str, required=True)
-    parser.add_argument('--ticker',    type=str, required=True)
+    parser.add_argument('--type',      type=str)
+    parser.add_argument('--ticker',    type=str)
+    parser.add_argument('--tickers',   type=str)
+    parser.add_argument('--tickers-file', type=str)
     parser.add_argument('--sdate',     type=str)
     parser.add_argument('--edate',     type=str)
     parser.add_argument('--period',    type=str)
     parser.add_argument('--exdivyear', type=str)
-    args = parser.parse_args()
+    parser.add_argument('--batchsize', type=int, default=1000)
+    parser.add_argument('--fetchworkers', type=int, default=4)
+    parser.add_argument('--buildworkers', type=int, default=1)
+    parser.add_argument('--writeworkers', type=int, default=2)
+    parser.add_argument('--queuesize', type=int, default=16)
+    parser.add_argument('--sync', action='store_true')
+    parser.add_argument('--fillgaps', action='store_true')
+    parser.add_argument('--cachedir', type=str)
+    parser.add_argument('--cachettl', type=int, default=86400)
+    parser.add_argument('--offline', action='store_true')
+    parser.add_argument('--spool', type=str)
+    parser.add_argument('--drain', action='store_true')
+    parser.add_argument('--draintimeout', type=int, default=60)
+    parser.add_argument('--provider', type=str, default='yahoo', choices=['yahoo', 'fake'])
+    parser.add_argument('--fakelatency', type=float, default=0)
+    parser.add_argument('--url', type=str)
+    parser.add_argument('--metricsport', type=int)
+    parser.add_argument('--metricsfile', type=str)
+    args = parser.parse_args(argv)
+
+    global provider, fake_latency, metrics_file
+    provider = args.provider
+    fake_latency = args.fakelatency
+    if args.url is not None:
+        set_backend_url(args.url)
+    metrics_file = args.metricsfile
+    if args.metricsport is not None:
+        start_server(args.metricsport)
+
+    if args.drain and args.spool is None:
+        parser.error("--drain requires --spool")
+
+    # the payloads are appended to the spool and sent by the drainer
+    spool = Spool(args.spool) if args.spool is not None else None
+
+    #=================================================================================
+    # Drain mode: only the records left in the spool by the previous runs
+    #=================================================================================
+    if(args.drain):
+        if not finish_drain(spool, args.batchsize, args.draintimeout):
+            sys.exit(1)
+        return
+
+    if args.type is None:
+        parser.error("--type is required")
+    if args.ticker is None and args.tickers is None and args.tickers_file is None:
+        parser.error("one of --ticker, --tickers or --tickers-file is required")
+
+    if args.offline and args.cachedir is None:
+        parser.error("--offline requires --cachedir")
+
+    # EQMKT needs the current prices, it only reads the cache in offline mode
+    global upstream_cache
+    upstream_cache = None
+    if args.cachedir is not None and (args.type != "EQMKT" or args.offline):
+        upstream_cache = UpstreamCache(args.cachedir, args.cachettl, args.offline)
 
     # get params
     ticker_symbol = args.ticker
@@ -296,73 +920,136 @@ def main(argv):
     start_date = args.sdate if args.sdate is not None else get_yesterday_iso_date()
     end_date = args.edate if args.edate is not None else get_yesterday_iso_date()
     feed_type = args.type
-    ex_div_year = args.exdivyear if args.exdivyear is not None else '1900'
+    # without --exdivyear EQDVD sends the whole dividend history
+    ex_div_year = args.exdivyear
+
+    #=================================================================================
+    # Sync mode: only the trading days missing in the backend for every ticker
+    #=================================================================================
+    if(args.sync):
+        if(feed_type != "EQHIST"):
+            print("--sync is only supported with --type EQHIST")
+            sys.exit(1)
+        ticker_symbols = read_tickers(args.tickers, args.tickers_file) if ticker_symbol is None else [ticker_symbol.upper()]
+        # the records spooled by the previous runs are sent first, so the
+        # summary of the backend includes them
+        if spool is not None and not finish_drain(spool, args.batchsize, args.draintimeout):
+            sys.exit(1)
+        ticker_ranges = plan_sync(ticker_symbols, start_date, end_date, args.fillgaps)
+        drainer = start_drainer(spool, args.batchsize) if spool is not None else None
+        stats = backfill(
+            ticker_ranges, period, args.batchsize,
+            args.fetchworkers, args.buildworkers, args.writeworkers, args.queuesize, spool
+        )
+        if spool is not None:
+            if len(stats['failed_tickers']) == 0:
+                spool.reset_done()
+            finish_drain(spool, args.batchsize, args.draintimeout, drainer)
+        if len(stats['failed_tickers']) != 0:
+            sys.exit(1)
+        return stats
+
+    #=================================================================================
+    # Backfill mode: every row of the history of every ticker in bulk
+    #=================================================================================
+    if(args.tickers is not None or args.tickers_file is not None):
+        if(feed_type not in ("EQHIST", "EQDVD")):
+            print("--tickers and --tickers-file are only supported with --type EQHIST or EQDVD")
+            sys.exit(1)
+        ticker_symbols = read_tickers(args.tickers, args.tickers_file)
+        drainer = start_drainer(spool, args.batchsize) if spool is not None else None
+        if(feed_type == "EQDVD"):
+            stats = backfill_dividends(ticker_symbols, ex_div_year, args.batchsize, args.fetchworkers, args.queuesize, spool)
+        else:
+            stats = backfill(
+                [(symbol, start_date, end_date, None) for symbol in ticker_symbols], period, args.batchsize,
+                args.fetchworkers, args.buildworkers, args.writeworkers, args.queuesize, spool
+            )
+        # the tickers spooled by an interrupted run are skipped when it is
+        # started again, a complete run starts from scratch the next time
+        if spool is not None:
+            if len(stats['failed_tickers']) == 0:
+                spool.reset_done()
+            finish_drain(spool, args.batchsize, args.draintimeout, drainer)
+        if len(stats['failed_tickers']) != 0:
+            sys.exit(1)
+        return stats
+
+    if(feed_type not in ("EQHIST", "EQMKT", "EQDVD")):
+        print("--type should be EQHIST, EQMKT, EQDVD instead of {0}".format(feed_type))
+        sys.exit(1)
+
+    with stage('fetch'):
+        ticker_data = get_ticker_data(ticker_symbol)
+        ticker_info_dict = get_ticker_info(ticker_data)
+        if(feed_type == "EQHIST"):
+            ticker_dataframe = get_ticker_hist_data(ticker_data, start_date, end_date, period)
+        elif(feed_type == "EQDVD"):
+            ticker_dividends = get_ticker_dividends(ticker_data)
 
-    ticker_data = get_ticker_data(ticker_symbol)  
-    ticker_info_dict = get_ticker_info(ticker_data)
-    
     #=================================================================================
     # Build the payload for EQHIST, EQMKT, or EQDVD
     #=================================================================================
     if(feed_type == "EQHIST"):
-        ticker_dataframe = get_ticker_hist_data(ticker_data, start_date, end_date, period)
-        if ticker_dataframe.empty:
+        payload = None
+        if not ticker_dataframe.empty:
+            with stage('build'):
+                payload = build_payload_eqhist(ticker_dataframe, ticker_info_dict)
+        if payload is None:
             print("No historical data found for the provided --sdate {0} and --edate {1}".format(start_date, end_date))
             sys.exit(1)
-        payload = build_payload_eqhist(ticker_dataframe, ticker_info_dict)
     elif(feed_type == "EQMKT"):
         if ticker_info_dict == None:
             print("No data found for the provided symbol {0}".format(ticker_symbol))
             sys.exit(1)
-        payload = build_payload_eqmkt(ticker_info_dict)
+        with stage('build'):
+            payload = build_payload_eqmkt(ticker_info_dict)
     elif(feed_type == "EQDVD"):
-        ticker_dividends = get_ticker_dividends(ticker_data)
-        if ticker_dividends.empty:
+        with stage('build'):
+            payload = build_payload_eqdvd(ticker_dividends, ticker_symbol, ex_div_year)
+        if len(payload['dividends']) == 0:
             print("No dividends data found for the provided symbol {0} and year {1}".format(ticker_symbol, ex_div_year))
             sys.exit(1)
 
-        # get the id field from the JSON GET request response
-        # filtering by equity label
-        # we will need it for the equity field in the dividend document
-        # since it's the foreign key to the equity document
-        # we take the ID of the last inserted Equity for a given symbol
-        # since the lookup Dividends -> Equity is just for general information
-        # and not to lookup prices/tickdata
-        equity = get_equity_by_label(ticker_symbol)
-        equity_id = equity[len(equity)-1]['id']
-        payload = build_payload_eqdvd(ticker_dividends.to_dict(), equity_id, ex_div_year)
-    else:
-        print("--type should be EQHIST, EQMKT, EQDVD instead of {0}".format(feed_type))
-        sys.exit(1)
-
     #=================================================================================
     # Make the POST/PUT request
     #=================================================================================
-    if(feed_type == "EQHIST" or feed_type == "EQMKT"):
-        # check if the label & md_date already exists in the database
-        # if it does make a PUT request instead of a POST request
-        equity = get_equity_by_label_and_date(ticker_symbol, payload['md_date'])
-        if(len(equity) != 0 and len(payload['tickdata']) != 0):
-            new_tickdata = payload['tickdata'][0]
-            existing_tickdata = json.loads(equity[0]['tickdata']) # need to convert the json nested array object into a python list
-            existing_tickdata.append(new_tickdata)
-            payload['tickdata'] = existing_tickdata
-        elif(len(equity) != 0):
-            existing_tickdata = json.loads(equity[0]['tickdata'])
-            payload['tickdata'] = existing_tickdata
-        if(len(equity) == 0):
-            post_request(DJANGO_BACKEND_EQUITY_ENDPOINT, payload)
-        else:
-            put_request(DJANGO_BACKEND_EQUITY_ENDPOINT + str(equity[0]['id']) + '/', payload)
-    elif(feed_type == "EQDVD"):
-        dividends = get_dividends_by_equity_and_year(payload['equity'], ex_div_year)
-        print(dividends)
-        if(len(dividends) == 0):
-            post_request(DJANGO_BACKEND_DIVIDEND_ENDPOINT, payload)
-        else:
-            put_request(DJANGO_BACKEND_DIVIDEND_ENDPOINT + str(dividends[0]['id']) + '/', payload)
+    with stage('write'):
+        if(feed_type == "EQHIST"):
+            # insert or update by label/md_date in a single request
+            write_bulk(DJANGO_BACKEND_SECURITY_BULK_ENDPOINT, [build_payload_security(ticker_info_dict)], spool)
+            write_bulk(DJANGO_BACKEND_EQUITY_BULK_ENDPOINT, [payload], spool)
+        elif(feed_type == "EQMKT"):
+            # send only the new tick, the backend appends it to the tick buckets
+            # of the label and updates the daily prices of the label/md_date document.
+            # If the document of the day does not exist yet (first tick) it is
+            # created with the bulk upsert, without the tick already stored.
+            # The ticks appends are not idempotent so they are never spooled
+            result = post_ticks_request(DJANGO_BACKEND_EQUITY_TICKS_ENDPOINT, [build_ticks_eqmkt(payload)])
+            if(len(result['missing']) != 0):
+                del payload['tickdata']
+                post_bulk_request(DJANGO_BACKEND_SECURITY_BULK_ENDPOINT, [build_payload_security(ticker_info_dict)])
+                post_bulk_request(DJANGO_BACKEND_EQUITY_BULK_ENDPOINT, [payload])
+        elif(feed_type == "EQDVD"):
+            # insert or merge by label/ex_div_date in a single request
+            write_bulk(DJANGO_BACKEND_DIVIDEND_BULK_ENDPOINT, [payload], spool)
+
+    if spool is not None:
+        finish_drain(spool, args.batchsize, args.draintimeout)
 
 #=================================================================================
 #=================================================================================
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    try:
+        main(sys.argv[1:])
+    except CacheMissError as e:
+        print("Offline: {0}".format(e))
+        sys.exit(1)
+    except requests.exceptions.RequestException as e:
+        print("Backend request failed: {0}".format(e))
+        sys.exit(1)
+    finally:
+        print_cache_stats()
+        print_stage_stats()
+        if metrics_file is not None:
+            write_textfile(metrics_file)
@@ -0,0 +1,117 @@
+import datetime
+from functools import lru_cache
+
+# trading days of the NYSE/NASDAQ calendar: weekdays which are not a full day
+# holiday. The holidays are computed from the exchange rules (observed on the
+# Friday before or the Monday after when they fall on a weekend, except New
+# Year's Day which is not observed on the Friday before) plus the unscheduled
+# closures listed in SPECIAL_CLOSURES. The early closes are trading days
+
+SPECIAL_CLOSURES = {
+    datetime.date(2001, 9, 11), datetime.date(2001, 9, 12),
+    datetime.date(2001, 9, 13), datetime.date(2001, 9, 14),  # September 11
+    datetime.date(2004, 6, 11),  # Ronald Reagan national day of mourning
+    datetime.date(2007, 1, 2),   # Gerald Ford national day of mourning
+    datetime.date(2012, 10, 29), datetime.date(2012, 10, 30),  # Hurricane Sandy
+    datetime.date(2018, 12, 5),  # George H.W. Bush national day of mourning
+    datetime.date(2025, 1, 9),   # Jimmy Carter national day of mourning
+}
+
+
+def nth_weekday(year, month, weekday, n):
+    # n-th weekday (0 = monday) of the month, the last one when n is -1
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = datetime.date(year, month + 1, 1) - datetime.timedelta(days=1) if month < 12 else datetime.date(year, 12, 31)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def easter(year):
+    # gregorian easter sunday (anonymous gregorian algorithm)
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def observed(day):
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=None)
+def get_holidays(year):
+    holidays = set()
+    new_year = datetime.date(year, 1, 1)
+    if new_year.weekday() != 5:
+        holidays.add(observed(new_year))
+    if year >= 1998:
+        holidays.add(nth_weekday(year, 1, 0, 3))  # Martin Luther King Jr. Day
+    holidays.add(nth_weekday(year, 2, 0, 3))      # Washington's Birthday
+    holidays.add(easter(year) - datetime.timedelta(days=2))  # Good Friday
+    holidays.add(nth_weekday(year, 5, 0, -1))     # Memorial Day
+    if year >= 2022:
+        holidays.add(observed(datetime.date(year, 6, 19)))  # Juneteenth
+    holidays.add(observed(datetime.date(year, 7, 4)))       # Independence Day
+    holidays.add(nth_weekday(year, 9, 0, 1))      # Labor Day
+    holidays.add(nth_weekday(year, 11, 3, 4))     # Thanksgiving Day
+    holidays.add(observed(datetime.date(year, 12, 25)))     # Christmas Day
+    holidays |= set(day for day in SPECIAL_CLOSURES if day.year == year)
+    return frozenset(holidays)
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in get_holidays(day.year)
+
+
+def previous_trading_day(day):
+    # last trading day before day
+    day = day - datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day = day - datetime.timedelta(days=1)
+    return day
+
+
+def next_trading_day(day):
+    # first trading day after day
+    day = day + datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day = day + datetime.timedelta(days=1)
+    return day
+
+
+def get_trading_days(start, end):
+    # trading days between start and end (inclusive)
+    days = []
+    day = start
+    while day <= end:
+        if is_trading_day(day):
+            days.append(day)
+        day = day + datetime.timedelta(days=1)
+    return days
+
+
+def get_missing_ranges(start, end, dates):
+    # (first, last) of every run of consecutive trading days between start
+    # and end (inclusive) which are not in dates
+    dates = set(dates)
+    ranges = []
+    for day in get_trading_days(start, end):
+        if day in dates:
+            continue
+        if len(ranges) != 0 and ranges[-1][1] == previous_trading_day(day):
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
@@ -0,0 +1,108 @@
+import datetime
+import math
+import time
+import zlib
+import pandas as pd
+
+# deterministic stand-in of yf.Ticker for the benchmarks and for running the
+# feeder without network (--provider fake). The values of a symbol only
+# depend on the symbol and the date, so overlapping ranges and repeated runs
+# return the same bars. latency (seconds) is slept on every upstream call to
+# simulate the Yahoo! Finance round trip
+
+
+def get_symbol_seed(symbol):
+    return zlib.crc32(symbol.encode())
+
+
+def get_noise(seed, ordinal):
+    # deterministic value in [-1, 1) of the symbol seed and the day
+    return zlib.crc32('{0}:{1}'.format(seed, ordinal).encode()) / 2 ** 31 - 1
+
+
+def get_business_days(start, end):
+    # weekdays of [start, end)
+    days = []
+    day = start
+    while day < end:
+        if day.weekday() < 5:
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+class FakeTicker:
+    def __init__(self, symbol, latency=0):
+        self.symbol = symbol.upper()
+        self.seed = get_symbol_seed(self.symbol)
+        self.latency = latency
+        self.base = 10 + self.seed % 490
+
+    def wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_close(self, day):
+        ordinal = day.toordinal()
+        return self.base * (1 + 0.3 * math.sin(ordinal / 60 + self.seed % 7)) * (1 + 0.02 * get_noise(self.seed, ordinal))
+
+    @property
+    def info(self):
+        self.wait()
+        today = datetime.date.today()
+        p_close = self.get_close(today - datetime.timedelta(days=1))
+        p_open = self.get_close(today)
+        # intraday price moving with the time of the day
+        p_mkt = p_open * (1 + 0.01 * math.sin(time.time() / 600 + self.seed))
+        return {
+            'symbol': self.symbol,
+            'longName': 'Fake security {0}'.format(self.symbol),
+            'industry': 'Benchmark',
+            'country': 'United States',
+            'currency': 'USD',
+            'market': 'us_market',
+            'exchange': 'NMS',
+            'currentPrice': round(p_mkt, 4),
+            'marketCap': int(p_mkt * (10 ** 7 + self.seed % 10 ** 9)),
+            'regularMarketDayHigh': round(max(p_open, p_mkt) * 1.01, 4),
+            'regularMarketDayLow': round(min(p_open, p_mkt) * 0.99, 4),
+            'regularMarketPreviousClose': round(p_close, 4),
+            'regularMarketOpen': round(p_open, 4)
+        }
+
+    def history(self, start=None, end=None, **kwargs):
+        # daily bars of [start, end) as returned by yf.Ticker.history
+        self.wait()
+        start = datetime.datetime.strptime(str(start)[:10], "%Y-%m-%d").date()
+        end = datetime.datetime.strptime(str(end)[:10], "%Y-%m-%d").date()
+        rows = []
+        days = get_business_days(start, end)
+        for day in days:
+            p_open = self.get_close(day - datetime.timedelta(days=1))
+            p_close = self.get_close(day)
+            spread = abs(get_noise(self.seed, -day.toordinal())) * 0.01
+            rows.append({
+                'Open': round(p_open, 4),
+                'High': round(max(p_open, p_close) * (1 + spread), 4),
+                'Low': round(min(p_open, p_close) * (1 - spread), 4),
+                'Close': round(p_close, 4),
+                'Volume': 10 ** 6 + self.seed % 10 ** 6,
+                'Dividends': 0.0,
+                'Stock Splits': 0.0
+            })
+        index = pd.DatetimeIndex([pd.Timestamp(day) for day in days], name='Date').tz_localize('America/New_York')
+        return pd.DataFrame(rows, index=index, columns=['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits'])
+
+    @property
+    def dividends(self):
+        # quarterly dividends since 2000 for three symbols out of four
+        self.wait()
+        if self.seed % 4 == 0:
+            return pd.Series([], dtype='float64', name='Dividends')
+        amount = round(0.05 + (self.seed % 200) / 100, 2)
+        days = [
+            day for day in get_business_days(datetime.date(2000, 1, 1), datetime.date.today())
+            if day.month % 3 == 2 and day.day <= 7 and day.weekday() == self.seed % 5
+        ]
+        index = pd.DatetimeIndex([pd.Timestamp(day) for day in days], name='Date').tz_localize('America/New_York')
+        return pd.Series([amount] * len(days), index=index, name='Dividends')
@@ -0,0 +1,97 @@
+import http.server
+import os
+import sys
+import threading
+import time
+
+# common/ at the root of the repository, shared with the backend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.prometheus import Counter, Histogram, render_metrics as render_registry
+
+# timings of the feeder stages in the Prometheus text format, served on
+# http://localhost:<port>/metrics during the run (--metricsport) and/or
+# written at the end of the run for the textfile collector of the node
+# exporter (--metricsfile)
+#
+#   feeder_stage_seconds{stage}             work of a stage on one item
+#                                           (fetch, build, write, drain)
+#   feeder_stage_wait_seconds{stage, side}  time a stage waited for the
+#                                           previous one (input) or for the
+#                                           next one (output)
+#   feeder_backend_request_seconds{method, endpoint, status}
+#   feeder_stage_errors_total{stage}
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram('feeder_stage_seconds', 'Work of a feeder stage on one item', ('stage',), DEFAULT_BUCKETS, REGISTRY)
+STAGE_WAIT_SECONDS = Histogram('feeder_stage_wait_seconds', 'Time a feeder stage waited for the previous (input) or the next stage (output)', ('stage', 'side'), DEFAULT_BUCKETS, REGISTRY)
+STAGE_ERRORS = Counter('feeder_stage_errors_total', 'Items failed by a feeder stage', ('stage',), REGISTRY)
+BACKEND_REQUEST_SECONDS = Histogram('feeder_backend_request_seconds', 'Duration of the backend requests', ('method', 'endpoint', 'status'), DEFAULT_BUCKETS, REGISTRY)
+
+
+def render_metrics():
+    return render_registry(REGISTRY)
+
+
+class stage:
+    # times the block as the work of a stage on one item
+    # with stage('fetch'):
+    #     ticker_info_dict = get_ticker_info(ticker_data)
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        STAGE_SECONDS.observe((self.name,), time.perf_counter() - self.started)
+        if exc_type is not None:
+            STAGE_ERRORS.inc((self.name,))
+        return False
+
+
+def print_stage_stats():
+    totals = STAGE_SECONDS.totals()
+    if len(totals) == 0:
+        return
+    waits = STAGE_WAIT_SECONDS.totals()
+    for (name,), (total, count) in sorted(totals.items()):
+        print("Stage {0}: {1} items in {2:.2f}s ({3:.1f}ms/item), waited {4:.2f}s for input and {5:.2f}s for output".format(
+            name, count, total, total / count * 1000,
+            waits.get((name, 'input'), (0, 0))[0], waits.get((name, 'output'), (0, 0))[0]
+        ))
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        content = render_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, host='127.0.0.1'):
+    # serves /metrics in a daemon thread for the duration of the run
+    server = http.server.HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def write_textfile(path):
+    # written then renamed, so the node exporter never reads a partial file
+    with open(path + '.tmp', 'w') as f:
+        f.write(render_metrics())
+    os.replace(path + '.tmp', path)
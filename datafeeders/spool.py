@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+import zlib
+
+# write-ahead spool of the feeder: the payloads built from the upstream data
+# are appended to a local append-only log before being sent to the backend,
+# so a backend outage never loses fetched data and a restart never fetches
+# it again. The log is split in segments:
+#
+#   <spool_dir>/segment-000000001.log   one record per line: "<crc32> <json>"
+#   <spool_dir>/checkpoint.json         {"segment": 1, "offset": 4096}
+#   <spool_dir>/done.log                keys of the work already spooled
+#   <spool_dir>/rejects.log             records rejected by the backend
+#
+# a record is {"url": <bulk upsert endpoint>, "payloads": [...]}. drain()
+# sends the records after the checkpoint to the backend, merging consecutive
+# records of the same endpoint in batches, and moves the checkpoint after
+# each successful request. The segments before the checkpoint are deleted.
+# Only the errors for which retryable(error) is true (backend down) stop the
+# drain: a batch rejected by the backend is sent again one record at a time
+# and the records rejected again are moved to rejects.log with the error, so
+# that they never block the records after them.
+# The bulk upserts are idempotent, so a record sent twice (crash between the
+# request and the checkpoint) is harmless. A torn record at the end of the
+# last segment (crash during an append) is truncated when the spool is opened
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+class Spool:
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, fsync=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.drain_lock = threading.Lock()
+        segments = self.get_segments()
+        self.segment = segments[-1] if len(segments) != 0 else 1
+        self.recover(self.segment)
+        self.file = open(self.get_path(self.segment), 'ab')
+        self.done = self.read_done()
+
+    def get_path(self, segment):
+        return os.path.join(self.directory, 'segment-{0:09d}.log'.format(segment))
+
+    def get_segments(self):
+        return sorted(
+            int(name[8:-4]) for name in os.listdir(self.directory)
+            if name.startswith('segment-') and name.endswith('.log')
+        )
+
+    def recover(self, segment):
+        path = self.get_path(segment)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                print("Spool: torn record of {0} bytes truncated in {1}".format(len(data) - end, path))
+                f.truncate(end)
+
+    def sync(self, f):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    #=================================================================================
+    # Writes
+    #=================================================================================
+    def append(self, url, payloads):
+        data = json.dumps({'url': url, 'payloads': payloads}, separators=(',', ':')).encode()
+        record = '{0:08x} '.format(zlib.crc32(data)).encode() + data + b'\n'
+        with self.lock:
+            if self.file.tell() != 0 and self.file.tell() + len(record) > self.segment_size:
+                self.file.close()
+                self.segment += 1
+                self.file = open(self.get_path(self.segment), 'ab')
+            self.file.write(record)
+            self.sync(self.file)
+
+    def read_done(self):
+        path = os.path.join(self.directory, 'done.log')
+        if not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return set(line.rstrip('\n') for line in f if line.endswith('\n'))
+
+    def mark_done(self, key):
+        # called once all the records of key are appended
+        with self.lock:
+            with open(os.path.join(self.directory, 'done.log'), 'a') as f:
+                f.write(key + '\n')
+                self.sync(f)
+            self.done.add(key)
+
+    def is_done(self, key):
+        return key in self.done
+
+    def reset_done(self):
+        with self.lock:
+            path = os.path.join(self.directory, 'done.log')
+            if os.path.exists(path):
+                os.remove(path)
+            self.done = set()
+
+    #=================================================================================
+    # Drain
+    #=================================================================================
+    def read_checkpoint(self):
+        path = os.path.join(self.directory, 'checkpoint.json')
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path) as f:
+            checkpoint = json.load(f)
+        return checkpoint['segment'], checkpoint['offset']
+
+    def write_checkpoint(self, segment, offset):
+        path = os.path.join(self.directory, 'checkpoint.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'segment': segment, 'offset': offset}, f)
+            self.sync(f)
+        os.replace(path + '.tmp', path)
+
+    def get_end(self):
+        with self.lock:
+            return self.segment, self.file.tell()
+
+    def pending(self):
+        # True if some records are not drained yet
+        checkpoint = self.read_checkpoint()
+        segments = self.get_segments()
+        if len(segments) == 0:
+            return False
+        if checkpoint[0] < segments[0]:
+            checkpoint = (segments[0], 0)
+        return checkpoint < self.get_end()
+
+    def read_records(self, segment, offset, limit):
+        # (record, offset after the record) of the segment between offset and
+        # limit, (None, offset) for a corrupted record which is skipped
+        with open(self.get_path(segment), 'rb') as f:
+            f.seek(offset)
+            while offset < limit:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    return
+                offset += len(line)
+                crc, data = line[:8], line[9:-1]
+                if int(crc, 16) != zlib.crc32(data):
+                    print("Spool: corrupted record skipped in segment {0} before offset {1}".format(segment, offset))
+                    yield None, offset
+                    continue
+                yield json.loads(data.decode()), offset
+
+    def reject(self, record, error):
+        print("Spool: {0} payloads for {1} rejected with {2}, moved to rejects.log".format(
+            len(record['payloads']), record['url'], error
+        ))
+        with self.lock:
+            with open(os.path.join(self.directory, 'rejects.log'), 'a') as f:
+                f.write(json.dumps(dict(record, error=str(error)), separators=(',', ':')) + '\n')
+                self.sync(f)
+
+    def send_batch(self, send, url, records, retryable):
+        # sends the payloads of the records of the same url in one request,
+        # returns the number of payloads sent
+        payloads = [payload for record in records for payload in record['payloads']]
+        try:
+            send(url, payloads)
+            return len(payloads)
+        except Exception as e:
+            if retryable(e):
+                raise
+            if len(records) == 1:
+                self.reject(records[0], e)
+                return 0
+        sent = 0
+        for record in records:
+            try:
+                send(url, record['payloads'])
+                sent += len(record['payloads'])
+            except Exception as e:
+                if retryable(e):
+                    raise
+                self.reject(record, e)
+        return sent
+
+    def drain(self, send, batch_size=1000, retryable=lambda e: True):
+        # sends the records appended so far with send(url, payloads), raises
+        # the retryable errors of send after checkpointing the batches already
+        # sent. Returns the number of payloads sent
+        with self.drain_lock:
+            end_segment, end_offset = self.get_end()
+            checkpoint_segment, checkpoint_offset = self.read_checkpoint()
+            sent = 0
+            for segment in self.get_segments():
+                if segment < checkpoint_segment:
+                    os.remove(self.get_path(segment))
+                    continue
+                if segment > end_segment:
+                    break
+                offset = checkpoint_offset if segment == checkpoint_segment else 0
+                limit = end_offset if segment == end_segment else os.path.getsize(self.get_path(segment))
+                url, records, count = None, [], 0
+                for record, next_offset in self.read_records(segment, offset, limit):
+                    if record is not None and len(records) != 0 and (
+                            record['url'] != url or count + len(record['payloads']) > batch_size):
+                        sent += self.send_batch(send, url, records, retryable)
+                        self.write_checkpoint(segment, offset)
+                        records, count = [], 0
+                    if record is not None:
+                        url = record['url']
+                        records.append(record)
+                        count += len(record['payloads'])
+                    offset = next_offset
+                if len(records) != 0:
+                    sent += self.send_batch(send, url, records, retryable)
+                if segment < end_segment:
+                    self.write_checkpoint(segment + 1, 0)
+                    os.remove(self.get_path(segment))
+                else:
+                    self.write_checkpoint(segment, offset)
+            return sent
@@ -0,0 +1,363 @@
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+import equity_feeder
+import exchange_calendar
+import upstream_cache
+from fake_provider import FakeTicker
+from spool import Spool
+
+# unit tests of the feeder helpers, without backend and without network
+# (the upstream is fake_provider.FakeTicker)
+#
+#   cd datafeeders && python -m unittest tests
+
+
+def to_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class ExchangeCalendarTests(unittest.TestCase):
+    def test_holidays(self):
+        self.assertEqual(sorted(exchange_calendar.get_holidays(2021)), [to_date(day) for day in (
+            '2021-01-01', '2021-01-18', '2021-02-15', '2021-04-02', '2021-05-31',
+            '2021-07-05', '2021-09-06', '2021-11-25', '2021-12-24'
+        )])
+
+    def test_observed_holidays(self):
+        # new year's day on a saturday is not observed on the friday before
+        self.assertTrue(exchange_calendar.is_trading_day(to_date('2021-12-31')))
+        # juneteenth since 2022, on a sunday observed on the monday after
+        self.assertFalse(exchange_calendar.is_trading_day(to_date('2022-06-20')))
+        self.assertTrue(exchange_calendar.is_trading_day(to_date('2021-06-18')))
+        self.assertEqual(exchange_calendar.easter(2024), to_date('2024-03-31'))
+        self.assertFalse(exchange_calendar.is_trading_day(to_date('2012-10-29')))
+
+    def test_next_and_previous_trading_day(self):
+        self.assertEqual(exchange_calendar.next_trading_day(to_date('2021-07-02')), to_date('2021-07-06'))
+        self.assertEqual(exchange_calendar.previous_trading_day(to_date('2021-07-06')), to_date('2021-07-02'))
+        self.assertEqual(exchange_calendar.next_trading_day(to_date('2021-08-20')), to_date('2021-08-23'))
+
+    def test_missing_ranges(self):
+        stored = [to_date(day) for day in ('2021-06-28', '2021-06-29', '2021-07-01', '2021-07-08')]
+        self.assertEqual(
+            exchange_calendar.get_missing_ranges(to_date('2021-06-28'), to_date('2021-07-08'), stored),
+            [(to_date('2021-06-30'), to_date('2021-06-30')), (to_date('2021-07-02'), to_date('2021-07-07'))]
+        )
+        self.assertEqual(exchange_calendar.get_missing_ranges(to_date('2021-07-03'), to_date('2021-07-05'), []), [])
+
+
+class UpstreamCacheRangesTests(unittest.TestCase):
+    def test_merge_ranges(self):
+        ranges = [(to_date('2021-03-01'), to_date('2021-04-01')), (to_date('2021-01-01'), to_date('2021-02-01')),
+                  (to_date('2021-02-01'), to_date('2021-02-15'))]
+        self.assertEqual(upstream_cache.merge_ranges(ranges), [
+            (to_date('2021-01-01'), to_date('2021-02-15')), (to_date('2021-03-01'), to_date('2021-04-01'))
+        ])
+
+    def test_missing_ranges(self):
+        ranges = [(to_date('2021-01-01'), to_date('2021-02-01')), (to_date('2021-03-01'), to_date('2021-04-01'))]
+        self.assertEqual(upstream_cache.get_missing_ranges(to_date('2020-12-01'), to_date('2021-05-01'), ranges), [
+            (to_date('2020-12-01'), to_date('2021-01-01')),
+            (to_date('2021-02-01'), to_date('2021-03-01')),
+            (to_date('2021-04-01'), to_date('2021-05-01'))
+        ])
+
+    def test_covered_range(self):
+        ranges = [(to_date('2021-01-01'), to_date('2021-04-01'))]
+        self.assertEqual(upstream_cache.get_missing_ranges(to_date('2021-02-01'), to_date('2021-03-01'), ranges), [])
+        self.assertEqual(upstream_cache.get_missing_ranges(to_date('2021-02-01'), to_date('2021-05-01'), ranges), [
+            (to_date('2021-04-01'), to_date('2021-05-01'))
+        ])
+
+
+class PlanSyncTests(unittest.TestCase):
+    def plan(self, summary, end_date, fill_gaps=False, md_dates=None):
+        with mock.patch.object(equity_feeder, 'get_equities_summary', return_value=summary), \
+                mock.patch.object(equity_feeder, 'get_md_dates', return_value=md_dates or []), \
+                contextlib.redirect_stdout(io.StringIO()):
+            return equity_feeder.plan_sync(list(summary), '2021-01-01', end_date, fill_gaps)
+
+    def fetch(self, ticker_range):
+        # md_dates of the rows fetched for a planned range
+        symbol, start_date, end_date, skip_dates = ticker_range
+        with contextlib.redirect_stdout(io.StringIO()):
+            dataframe = equity_feeder.get_ticker_hist_data(FakeTicker(symbol), start_date, end_date, None)
+        return [str(md_date)[:10] for md_date in dataframe.index]
+
+    def test_daily_sync_fetches_the_next_trading_day(self):
+        ranges = self.plan({'SYNF0000': {'first_md_date': '2021-08-02', 'last_md_date': '2021-08-23', 'count': 16}}, '2021-08-24')
+        self.assertEqual(len(ranges), 1)
+        self.assertEqual(self.fetch(ranges[0]), ['2021-08-24'])
+
+    def test_sync_fetches_every_missing_day(self):
+        # last md_date on a friday, synced on the next wednesday
+        ranges = self.plan({'SYNF0000': {'first_md_date': '2021-08-02', 'last_md_date': '2021-08-20', 'count': 15}}, '2021-08-25')
+        self.assertEqual(self.fetch(ranges[0]), ['2021-08-23', '2021-08-24', '2021-08-25'])
+
+    def test_up_to_date_label_is_not_synced(self):
+        ranges = self.plan({'SYNF0000': {'first_md_date': '2021-08-02', 'last_md_date': '2021-08-24', 'count': 17}}, '2021-08-24')
+        self.assertEqual(ranges, [])
+
+    def test_fill_gaps_fetches_the_first_missing_day(self):
+        stored = [
+            day for day in equity_feeder.get_trading_days(to_date('2021-08-02'), to_date('2021-08-23'))
+            if day not in (to_date('2021-08-10'), to_date('2021-08-11'))
+        ]
+        ranges = self.plan(
+            {'SYNF0000': {'first_md_date': '2021-08-02', 'last_md_date': '2021-08-23', 'count': len(stored)}},
+            '2021-08-24', fill_gaps=True, md_dates=stored
+        )
+        skip_dates = ranges[0][3]
+        missing = [md_date for md_date in self.fetch(ranges[0]) if md_date not in skip_dates]
+        self.assertEqual(missing, ['2021-08-10', '2021-08-11', '2021-08-24'])
+
+
+class BackfillTests(unittest.TestCase):
+    def test_failing_item_does_not_stop_the_pipeline(self):
+        # the build of SYNF0001 fails, with queues of one item the fetch
+        # stage would block forever if the build thread died
+        build_payloads_eqhist = equity_feeder.build_payloads_eqhist
+
+        def build(ticker_dataframe, ticker_info_dict):
+            if ticker_info_dict['symbol'] == 'SYNF0001':
+                raise KeyError('Close')
+            return build_payloads_eqhist(ticker_dataframe, ticker_info_dict)
+
+        sent = []
+        ranges = [('SYNF{0:04d}'.format(i), '2021-08-16', '2021-08-20', None) for i in range(4)]
+        with mock.patch.object(equity_feeder, 'provider', 'fake'), \
+                mock.patch.object(equity_feeder, 'build_payloads_eqhist', build), \
+                mock.patch.object(equity_feeder, 'send_request', lambda method, url, payload=None: sent.append(url)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            stats = equity_feeder.backfill(ranges, None, 100, fetch_workers=2, write_workers=1, queue_size=1)
+        self.assertEqual(stats['failed_tickers'], ['SYNF0001'])
+        self.assertEqual(stats['tickers'], 3)
+        self.assertEqual(stats['documents'], 12)
+
+
+class RejectedError(Exception):
+    pass
+
+
+class SpoolTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = Spool(self.directory, fsync=False)
+        self.sent = []
+
+    def tearDown(self):
+        self.spool.close()
+
+    def send(self, url, payloads):
+        # the backend rejects the payloads of the label BAD
+        if any(payload['label'] == 'BAD' for payload in payloads):
+            raise RejectedError('400')
+        self.sent.append((url, [payload['label'] for payload in payloads]))
+
+    def drain(self, send=None, batch_size=1000):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.spool.drain(send or self.send, batch_size, lambda e: not isinstance(e, RejectedError))
+
+    def test_drain_merges_the_records_of_an_url(self):
+        self.spool.append('/a/', [{'label': 'A'}])
+        self.spool.append('/a/', [{'label': 'B'}])
+        self.spool.append('/b/', [{'label': 'C'}])
+        self.assertEqual(self.drain(), 3)
+        self.assertEqual(self.sent, [('/a/', ['A', 'B']), ('/b/', ['C'])])
+        self.assertFalse(self.spool.pending())
+
+    def test_rejected_record_does_not_block_the_spool(self):
+        self.spool.append('/a/', [{'label': 'BAD'}])
+        self.spool.append('/a/', [{'label': 'A'}])
+        self.spool.append('/b/', [{'label': 'B'}])
+        self.assertEqual(self.drain(), 2)
+        self.assertEqual(self.sent, [('/a/', ['A']), ('/b/', ['B'])])
+        self.assertFalse(self.spool.pending())
+        with open(os.path.join(self.directory, 'rejects.log')) as f:
+            self.assertEqual(json.loads(f.readline())['payloads'], [{'label': 'BAD'}])
+
+    def test_retryable_error_keeps_the_records(self):
+        self.spool.append('/a/', [{'label': 'A'}])
+        self.spool.append('/b/', [{'label': 'B'}])
+
+        def send(url, payloads):
+            if url == '/b/':
+                raise ConnectionError('backend down')
+            self.send(url, payloads)
+        with self.assertRaises(ConnectionError):
+            self.drain(send)
+        self.assertTrue(self.spool.pending())
+        self.sent = []
+        self.assertEqual(self.drain(), 1)
+        self.assertEqual(self.sent, [('/b/', ['B'])])
+
+    def test_torn_record_is_truncated(self):
+        self.spool.append('/a/', [{'label': 'A'}])
+        self.spool.close()
+        with open(os.path.join(self.directory, 'segment-000000001.log'), 'ab') as f:
+            f.write(b'0000 {"url"')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.spool = Spool(self.directory, fsync=False)
+        self.assertEqual(self.drain(), 1)
+
+
+class FakeResponse:
+    def __init__(self, status, body='{}', content_type='application/json'):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+    async def json(self):
+        if self.content_type != 'application/json':
+            import aiohttp
+            raise aiohttp.ContentTypeError(mock.Mock(), (), status=self.status, message='unexpected mimetype')
+        return json.loads(self.body)
+
+    async def text(self):
+        return self.body
+
+
+class FakeSession:
+    # each request raises the next error or returns the next response
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+
+    @contextlib.asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        yield outcome
+
+
+class BackendClientTests(unittest.TestCase):
+    def setUp(self):
+        try:
+            import aiohttp
+            import backend_client
+        except ImportError:
+            self.skipTest('aiohttp is not installed')
+        self.aiohttp = aiohttp
+        self.backend_client = backend_client
+
+    def send(self, outcomes, retries=0):
+        async def run():
+            client = self.backend_client.BackendClient(retries=retries, backoff_base=0)
+            client.session = FakeSession(outcomes)
+            client.semaphore = asyncio.Semaphore(1)
+            return await client.get_equity(1)
+        return asyncio.run(run())
+
+    def test_responses(self):
+        self.assertEqual(self.send([FakeResponse(200, '{"id": 1}')]), {'id': 1})
+        self.assertIsNone(self.send([FakeResponse(204, '')]))
+
+    def test_error_statuses(self):
+        with self.assertRaises(self.backend_client.BackendNotFoundError):
+            self.send([FakeResponse(404)])
+        with self.assertRaises(self.backend_client.BackendHTTPError) as cm:
+            self.send([FakeResponse(503)])
+        self.assertEqual(cm.exception.status, 503)
+
+    def test_invalid_json_responses(self):
+        with self.assertRaises(self.backend_client.BackendResponseError):
+            self.send([FakeResponse(200, '<html></html>', 'text/html')])
+        with self.assertRaises(self.backend_client.BackendResponseError):
+            self.send([FakeResponse(200, 'not json')])
+
+    def test_aiohttp_errors_are_wrapped(self):
+        errors = [
+            (self.aiohttp.ServerDisconnectedError(), self.backend_client.BackendConnectionError),
+            (self.aiohttp.ClientPayloadError('truncated body'), self.backend_client.BackendConnectionError),
+            (asyncio.TimeoutError(), self.backend_client.BackendTimeoutError),
+            (self.aiohttp.InvalidURL('http://'), self.backend_client.BackendError),
+        ]
+        for error, backend_error in errors:
+            with self.assertRaises(backend_error):
+                self.send([error])
+
+    def test_connection_errors_are_retried(self):
+        self.assertEqual(self.send([self.aiohttp.ServerDisconnectedError(), FakeResponse(200, '[]')], retries=1), [])
+
+
+class FakeBackendClient:
+    # append_ticks fails with the errors given, then succeeds
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.appended = []
+
+    async def append_ticks(self, entries):
+        if len(self.errors) != 0:
+            raise self.errors.pop(0)
+        self.appended.extend(entries)
+        return {'missing': []}
+
+
+class TickCollectorTests(unittest.TestCase):
+    def setUp(self):
+        try:
+            import tick_collector
+            from backend_client import BackendHTTPError, BackendConnectionError
+        except ImportError:
+            self.skipTest('aiohttp is not installed')
+        self.tick_collector = tick_collector
+        self.BackendHTTPError = BackendHTTPError
+        self.BackendConnectionError = BackendConnectionError
+
+    def flush(self, client, payloads, rejects_file=None):
+        async def run():
+            collector = self.tick_collector.TickCollector(client, ['SYNF0000'], rejects_file=rejects_file)
+            collector.pending = list(payloads)
+            with contextlib.redirect_stdout(io.StringIO()):
+                await collector.flush()
+            collector.executor.shutdown(wait=True)
+            return collector
+        return asyncio.run(run())
+
+    def get_payload(self):
+        return equity_feeder.build_payload_eqmkt(equity_feeder.get_ticker_info(FakeTicker('SYNF0000')))
+
+    def test_retryable_errors_keep_the_ticks(self):
+        client = FakeBackendClient([self.BackendConnectionError('connection refused')])
+        collector = self.flush(client, [self.get_payload()])
+        self.assertEqual(len(collector.pending), 1)
+
+    def test_rejected_ticks_are_dropped(self):
+        rejects_file = os.path.join(tempfile.mkdtemp(), 'rejects.jsonl')
+        client = FakeBackendClient([self.BackendHTTPError('POST', '/equities/ticks/', 400, '{}')])
+        collector = self.flush(client, [self.get_payload()], rejects_file)
+        self.assertEqual(collector.pending, [])
+        with open(rejects_file) as f:
+            self.assertEqual(json.loads(f.readline())['payload']['label'], 'SYNF0000')
+
+    def test_unexpected_errors_reject_the_ticks(self):
+        rejects_file = os.path.join(tempfile.mkdtemp(), 'rejects.jsonl')
+        invalid = self.get_payload()
+        del invalid['md_date']
+        client = FakeBackendClient([])
+        collector = self.flush(client, [invalid, self.get_payload()], rejects_file)
+        # the invalid payload is rejected, the other one is sent
+        self.assertEqual(collector.pending, [])
+        self.assertEqual([entry['md_date'] for entry in client.appended], [self.get_payload()['md_date']])
+        collector = self.flush(FakeBackendClient([ValueError('unexpected')]), [self.get_payload()], rejects_file)
+        self.assertEqual(collector.pending, [])
+        with open(rejects_file) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_invalid_responses_do_not_stop_the_flush(self):
+        client = FakeBackendClient([])
+        client.append_ticks = mock.AsyncMock(return_value={})
+        collector = self.flush(client, [self.get_payload()])
+        self.assertEqual(collector.pending, [])
+        self.assertEqual(collector.missing, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
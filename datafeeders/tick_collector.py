@@ -0,0 +1,243 @@
+import asyncio
+import argparse
+import json
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from equity_feeder import (
+    get_ticker_data, get_ticker_info, build_payload_eqmkt, build_payload_security,
+    build_ticks_eqmkt, read_tickers, print_separator, DJANGO_BACKEND_URL
+)
+from backend_client import BackendClient, BackendError, is_retryable
+
+# long running EQMKT collector: instead of one process per symbol and snapshot
+# (cron job), a single process polls all the symbols on a schedule. The ticks are coalesced in micro batches which are sent to the
+# backend when batch_size ticks are pending or every flush_interval seconds.
+# Only the connection errors, timeouts and 5xx/429 responses keep the ticks
+# for the next flush, the payloads rejected by the backend (4xx) are dropped
+# and appended to rejects_file (JSON lines) when it is given, as the payloads
+# failing with an unexpected error (which would fail again on every flush).
+# SIGINT/SIGTERM stop the polling and the pending ticks are flushed before exiting
+#
+# usage: tick_collector.py [-h] (--tickers TICKERS | --tickers-file TICKERS_FILE) [--interval INTERVAL]
+#                          [--batchsize BATCHSIZE] [--flushinterval FLUSHINTERVAL] [--workers WORKERS]
+#                          [--maxpending MAXPENDING] [--rejectsfile REJECTSFILE] [--url URL]
+
+
+def get_snapshot(symbol):
+    # a new Ticker for every poll: yfinance keeps the info of a Ticker after
+    # the first request, a Ticker polled again would return the same price
+    return get_ticker_info(get_ticker_data(symbol))
+
+
+class TickCollector:
+    def __init__(self, client, symbols, interval=60, batch_size=500, flush_interval=5,
+                 workers=8, max_pending=100000, rejects_file=None):
+        self.client = client
+        self.symbols = symbols
+        self.interval = interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.rejects_file = rejects_file
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # snapshots waiting to be flushed: list of EQMKT payloads
+        self.pending = []
+        # daily documents to be created for the first ticks of the day
+        # and the last reference data of each label to create them with
+        self.missing = {}
+        self.securities = {}
+        self.flush_needed = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+
+    def stop(self):
+        print("Stopping the collector, pending ticks will be flushed")
+        self.stopping.set()
+        self.flush_needed.set()
+
+    async def poll_symbol(self, symbol):
+        loop = asyncio.get_running_loop()
+        try:
+            # yfinance is blocking, the polls run in the executor threads
+            ticker_info_dict = await loop.run_in_executor(self.executor, get_snapshot, symbol)
+        except Exception as e:
+            print("Polling {0} failed with {1}".format(symbol, e))
+            return
+        if ticker_info_dict is None:
+            print("No data found for the provided symbol {0}".format(symbol))
+            return
+        if ticker_info_dict['p_mkt'] is None:
+            print("No market price for {0}".format(symbol))
+            return
+
+        self.pending.append(build_payload_eqmkt(ticker_info_dict))
+        self.securities[ticker_info_dict['symbol']] = build_payload_security(ticker_info_dict)
+        if len(self.pending) > self.max_pending:
+            # the backend is behind for too long, the oldest ticks are dropped
+            dropped = len(self.pending) - self.max_pending
+            del self.pending[:dropped]
+            print("{0} pending ticks dropped".format(dropped))
+        if len(self.pending) >= self.batch_size:
+            self.flush_needed.set()
+
+    async def poll(self):
+        # polls are aligned on the schedule, a slow poll does not shift the next ones
+        next_poll = time.monotonic()
+        while not self.stopping.is_set():
+            await asyncio.gather(*[self.poll_symbol(symbol) for symbol in self.symbols])
+            next_poll += self.interval
+            delay = next_poll - time.monotonic()
+            if delay < 0:
+                print("Polling {0} symbols took longer than the {1}s interval".format(len(self.symbols), self.interval))
+                next_poll = time.monotonic()
+                continue
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def flush(self):
+        async with self.flush_lock:
+            if len(self.pending) == 0:
+                if len(self.missing) != 0:
+                    await self.create_missing()
+                return
+            payloads = self.pending
+            self.pending = []
+
+            # one entry for each label/md_date with all its ticks and the last prices
+            entries = {}
+            last_payloads = {}
+            valid_payloads = []
+            for payload in payloads:
+                try:
+                    key = (payload['label'], payload['md_date'])
+                    entry = build_ticks_eqmkt(payload)
+                    if key in entries:
+                        entry['tickdata'] = entries[key]['tickdata'] + entry['tickdata']
+                except Exception as e:
+                    # an invalid payload would fail again on every flush
+                    self.reject([payload], e)
+                    continue
+                entries[key] = entry
+                last_payloads[key] = payload
+                valid_payloads.append(payload)
+            payloads = valid_payloads
+            if len(payloads) == 0:
+                return
+
+            try:
+                result = await self.client.append_ticks(list(entries.values()))
+            except BackendError as e:
+                print("Flushing {0} ticks failed with {1}".format(len(payloads), e))
+                if is_retryable(e):
+                    # kept for the next flush, the ticks are still in order
+                    self.pending = payloads + self.pending
+                else:
+                    self.reject(payloads, e)
+                return
+            except Exception as e:
+                # not a failure of the backend, retrying would fail again
+                print("Flushing {0} ticks failed with {1!r}".format(len(payloads), e))
+                self.reject(payloads, e)
+                return
+            print("{0} ticks flushed for {1} symbols".format(len(payloads), len(entries)))
+
+            # first ticks of the day: the daily documents are created without
+            # the ticks since they have already been stored
+            try:
+                for key in result['missing']:
+                    payload = dict(last_payloads[(key['label'], key['md_date'])])
+                    del payload['tickdata']
+                    self.missing[(key['label'], key['md_date'])] = payload
+            except Exception as e:
+                print("Invalid response of the backend {0!r}: {1!r}".format(result, e))
+            if len(self.missing) != 0:
+                await self.create_missing()
+
+    async def create_missing(self):
+        try:
+            labels = set(label for label, md_date in self.missing)
+            await self.client.bulk_upsert_securities([self.securities[label] for label in labels])
+            await self.client.bulk_upsert_equities(list(self.missing.values()))
+            self.missing = {}
+        except Exception as e:
+            print("Creating {0} daily documents failed with {1!r}".format(len(self.missing), e))
+            if not isinstance(e, BackendError) or not is_retryable(e):
+                self.reject(list(self.missing.values()), e)
+                self.missing = {}
+
+    def reject(self, payloads, error):
+        # payloads the backend will never accept, retrying them would block
+        # the next flushes
+        print("{0} rejected payloads dropped".format(len(payloads)))
+        if self.rejects_file is None:
+            return
+        with open(self.rejects_file, 'a') as f:
+            for payload in payloads:
+                f.write(json.dumps({'error': str(error), 'payload': payload}, default=str) + '\n')
+
+    async def flush_loop(self):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.flush_needed.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_needed.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # the collector keeps running, the next flush is tried on schedule
+                print("Flush failed with {0!r}".format(e))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        print_separator()
+        print("Collecting {0} symbols every {1}s".format(len(self.symbols), self.interval))
+        print_separator()
+        await asyncio.gather(self.poll(), self.flush_loop())
+
+        # drain: the last flush is retried until the pending ticks are stored
+        while len(self.pending) != 0 or len(self.missing) != 0:
+            await self.flush()
+            if len(self.pending) != 0 or len(self.missing) != 0:
+                await asyncio.sleep(self.flush_interval)
+        self.executor.shutdown(wait=True)
+
+
+async def collect(args):
+    symbols = read_tickers(args.tickers, args.tickers_file)
+    async with BackendClient(args.url) as client:
+        collector = TickCollector(
+            client, symbols, args.interval, args.batchsize,
+            args.flushinterval, args.workers, args.maxpending, args.rejectsfile
+        )
+        await collector.run()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Tick collector for Django MongoDB backend.')
+    parser.add_argument('--tickers',       type=str)
+    parser.add_argument('--tickers-file',  type=str)
+    parser.add_argument('--interval',      type=float, default=60)
+    parser.add_argument('--batchsize',     type=int, default=500)
+    parser.add_argument('--flushinterval', type=float, default=5)
+    parser.add_argument('--workers',       type=int, default=8)
+    parser.add_argument('--maxpending',    type=int, default=100000)
+    parser.add_argument('--rejectsfile',   type=str)
+    parser.add_argument('--url',           type=str, default=DJANGO_BACKEND_URL)
+    args = parser.parse_args(argv)
+
+    if args.tickers is None and args.tickers_file is None:
+        parser.error("one of --tickers or --tickers-file is required")
+    asyncio.run(collect(args))
+
+#=================================================================================
+#=================================================================================
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,202 @@
+import datetime
+import json
+import os
+import threading
+import time
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# persistent cache of the yfinance responses used by equity_feeder.py, so
+# the re-runs, the retries and the overlapping date ranges do not call Yahoo!
+# Finance again. One directory per symbol:
+#
+#   <cache_dir>/MSFT/history.parquet   daily bars of every range fetched
+#   <cache_dir>/MSFT/history.json      {"ranges": [["2021-01-04", "2021-08-26"]]}
+#   <cache_dir>/MSFT/info.json         {"fetched_at": 1629915284.2, "info": {...}}
+#   <cache_dir>/MSFT/dividends.json    {"fetched_at": 1629915284.2, "dividends": [["2021-08-18", 0.56]]}
+#
+# the ranges of history.json are the [start, end) ranges already fetched
+# (with the start/end arguments of Ticker.history), a request only fetches
+# the parts which are not covered yet and merges them into the parquet file.
+# The current day is never marked as fetched since its bar is not final.
+# info and dividends are fetched again after ttl seconds. In offline mode
+# only the cache is read (whatever the age of the entries), to replay an
+# ingestion without network
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+class CacheMissError(Exception):
+    pass
+
+
+def to_date(value):
+    return datetime.datetime.strptime(str(value)[:10], DATE_FORMAT).date()
+
+
+def merge_ranges(ranges):
+    # sorted [start, end) date ranges, overlapping and adjacent ones merged
+    merged = []
+    for start, end in sorted(ranges):
+        if len(merged) != 0 and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def get_missing_ranges(start, end, ranges):
+    # parts of [start, end) not covered by the (merged) ranges
+    missing = []
+    for range_start, range_end in ranges:
+        if range_end <= start or range_start >= end:
+            continue
+        if range_start > start:
+            missing.append((start, range_start))
+        start = max(start, range_end)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+class UpstreamCache:
+    def __init__(self, cache_dir, ttl=86400, offline=False):
+        if pyarrow is None:
+            raise RuntimeError("pyarrow is required by the upstream cache (pip install pyarrow)")
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'fetched_ranges': 0}
+
+    def get_lock(self, symbol):
+        with self.locks_lock:
+            return self.locks.setdefault(symbol, threading.Lock())
+
+    def get_path(self, symbol, name):
+        return os.path.join(self.cache_dir, symbol.upper(), name)
+
+    def count(self, key, value=1):
+        with self.locks_lock:
+            self.stats[key] += value
+
+    def read_json(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def write_json(self, path, data):
+        # written to a temporary file and renamed, a crash never leaves a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, default=str)
+        os.replace(path + '.tmp', path)
+
+    def is_fresh(self, entry):
+        return entry is not None and (self.offline or time.time() - entry['fetched_at'] < self.ttl)
+
+    def get_info(self, symbol, fetch):
+        with self.get_lock(symbol):
+            path = self.get_path(symbol, 'info.json')
+            entry = self.read_json(path)
+            if self.is_fresh(entry):
+                self.count('hits')
+                return entry['info']
+            if self.offline:
+                raise CacheMissError("no info cached for {0}".format(symbol))
+            self.count('misses')
+            info = fetch()
+            self.write_json(path, {'fetched_at': time.time(), 'info': info})
+            return info
+
+    def get_dividends(self, symbol, fetch):
+        with self.get_lock(symbol):
+            path = self.get_path(symbol, 'dividends.json')
+            entry = self.read_json(path)
+            if self.is_fresh(entry):
+                self.count('hits')
+                dates = [ex_div_date for ex_div_date, dividend in entry['dividends']]
+                values = [dividend for ex_div_date, dividend in entry['dividends']]
+                return pd.Series(values, index=pd.to_datetime(dates), name='Dividends', dtype='float64')
+            if self.offline:
+                raise CacheMissError("no dividends cached for {0}".format(symbol))
+            self.count('misses')
+            dividends = fetch()
+            self.write_json(path, {
+                'fetched_at': time.time(),
+                'dividends': [[str(ex_div_date)[:10], float(dividend)] for ex_div_date, dividend in dividends.items()]
+            })
+            return dividends
+
+    def get_history(self, symbol, start, end, fetch):
+        # bars of [start, end) (dates or ISO strings), fetch(start, end) is
+        # the upstream call returning the bars of a range as a DataFrame
+        start, end = to_date(start), to_date(end)
+        with self.get_lock(symbol):
+            path = self.get_path(symbol, 'history.parquet')
+            meta_path = self.get_path(symbol, 'history.json')
+            meta = self.read_json(meta_path) or {'ranges': []}
+            ranges = [(to_date(range_start), to_date(range_end)) for range_start, range_end in meta['ranges']]
+            frame = pd.read_parquet(path) if os.path.exists(path) else None
+
+            missing = get_missing_ranges(start, end, ranges)
+            if len(missing) == 0:
+                self.count('hits')
+            elif self.offline:
+                if frame is None:
+                    raise CacheMissError("no history cached for {0}".format(symbol))
+                print("Offline: {0} has no cached bars for {1}".format(symbol, ', '.join(
+                    '{0}..{1}'.format(range_start, range_end) for range_start, range_end in missing
+                )))
+            else:
+                self.count('misses')
+                today = datetime.date.today()
+                frames = [] if frame is None else [frame]
+                for range_start, range_end in missing:
+                    fetched = fetch(range_start.isoformat(), range_end.isoformat())
+                    self.count('fetched_ranges')
+                    if not fetched.empty:
+                        frames.append(fetched)
+                    if range_start < today:
+                        ranges.append((range_start, min(range_end, today)))
+                if len(frames) != 0:
+                    frame = pd.concat(frames)
+                    frame = frame[~frame.index.duplicated(keep='last')].sort_index()
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    frame.to_parquet(path + '.tmp')
+                    os.replace(path + '.tmp', path)
+                self.write_json(meta_path, {'ranges': [
+                    [range_start.isoformat(), range_end.isoformat()] for range_start, range_end in merge_ranges(ranges)
+                ]})
+
+            if frame is None:
+                return pd.DataFrame()
+            dates = frame.index.strftime(DATE_FORMAT)
+            return frame[(dates >= start.isoformat()) & (dates < end.isoformat())]
+
+
+class CachedTicker:
+    # the attributes of yf.Ticker used by the feeder, read through the cache
+    def __init__(self, symbol, cache, ticker=None):
+        self.symbol = symbol
+        self.cache = cache
+        self.ticker = ticker
+
+    @property
+    def info(self):
+        return self.cache.get_info(self.symbol, lambda: self.ticker.info)
+
+    @property
+    def dividends(self):
+        return self.cache.get_dividends(self.symbol, lambda: self.ticker.dividends)
+
+    def history(self, start, end, **kwargs):
+        return self.cache.get_history(
+            self.symbol, start, end, lambda range_start, range_end: self.ticker.history(start=range_start, end=range_end, **kwargs)
+        )